@@ -0,0 +1,28 @@
+"""
+ASGI config for FABRICATEXTIL project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with any ASGI server, for example::
+
+    gunicorn FABRICATEXTIL.asgi:application -k uvicorn.workers.UvicornWorker
+
+Under ASGI the scan endpoints (kiosk, batch and offline sync) and the AI
+description endpoints are async views: a request waiting on the database or
+on the job queue does not hold a worker thread, so one process can serve the
+whole plant's scanners. The remaining views are synchronous and Django runs
+them in a thread pool.
+
+For more information, visit
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE',
+    'FABRICATEXTIL.settings')
+# Each request runs in its own thread: persistent connections would be orphaned.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+application = get_asgi_application()
@@ -28,6 +28,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero: mide la latencia total y agrega Server-Timing (app/metricas.py)
+    'app.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,7 +43,8 @@ ROOT_URLCONF = 'FABRICATEXTIL.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el tiempo de render por petición
+        'BACKEND': 'app.metricas.PlantillasMedidas',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -56,14 +59,104 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'FABRICATEXTIL.wsgi.application'
+ASGI_APPLICATION = 'FABRICATEXTIL.asgi.application'
+
+# --- Base de datos ---
+# DB_PERFIL elige el perfil:
+#  - 'sqlite' (por defecto): archivo local (DB_SQLITE) en modo WAL. Los lectores
+#    no esperan a los escritores y un escritor que encuentra el candado ocupado
+#    espera su turno (busy_timeout) en vez de fallar con "database is locked".
+#    WAL lo activa app/bd.py al conectar, salvo en la base de desarrollo incluida
+#    en el repo (SQLITE_INCLUIDA): el modo queda guardado en el archivo y git lo
+#    vería modificado. SQLITE_WAL=1 lo activa en todas, SQLITE_WAL=0 en ninguna.
+#  - 'postgres': DATABASE_URL con el pool de conexiones de psycopg 3
+#    (pip install "psycopg[binary,pool]").
+# DB_REPLICA (opcional): copia de solo lectura para reportes y exportaciones
+# (ver app/bd.py). Con SQLite es la ruta de un archivo que refresca
+# `manage.py copiar_replica`; con PostgreSQL, la URL de la réplica.
+DB_PERFIL = os.environ.get('DB_PERFIL', 'sqlite')
+DB_REPLICA = os.environ.get('DB_REPLICA', '')
+# Conexiones persistentes (segundos). asgi.py lo pone en 0: bajo ASGI cada
+# petición corre en su propio hilo y una conexión persistente quedaría huérfana.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+SQLITE_INCLUIDA = os.path.join(BASE_DIR, 'db.sqlite3')
+SQLITE_WAL = os.environ.get('SQLITE_WAL', '')
+
+SQLITE_OPCIONES = {
+    # El escritor toma el candado al abrir la transacción: con BEGIN a secas,
+    # dos transacciones que leen y luego escriben chocan y SQLite responde
+    # "database is locked" sin esperar el busy_timeout.
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': 'PRAGMA busy_timeout=20000;',
+}
+
+
+# La réplica solo se lee; copiar_replica la reescribe con su propia conexión.
+SQLITE_OPCIONES_REPLICA = {
+    'init_command': 'PRAGMA query_only=ON;PRAGMA busy_timeout=20000;',
+}
 
-# Configuración de Base de Datos (Solo SQLite Local)
-DATABASES = {
-    'default': {
+
+def _sqlite(nombre, opciones=SQLITE_OPCIONES, **extra):
+    return {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': nombre,
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': dict(opciones),
+        **extra,
+    }
+
+
+def _postgres(url):
+    import dj_database_url
+    base = dj_database_url.parse(url, conn_max_age=0)
+    # Con pool, Django exige CONN_MAX_AGE = 0: el pool es quien reutiliza.
+    base.setdefault('OPTIONS', {})['pool'] = {'min_size': 2, 'max_size': 20, 'timeout': 10}
+    return base
+
+
+if DB_PERFIL == 'postgres':
+    DATABASES = {'default': _postgres(os.environ['DATABASE_URL'])}
+    if DB_REPLICA:
+        DATABASES['replica'] = {**_postgres(DB_REPLICA), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': _sqlite(
+            os.environ.get('DB_SQLITE', SQLITE_INCLUIDA),
+            # Base de pruebas en archivo (no en memoria) para que las pruebas de
+            # concurrencia puedan abrir varias conexiones a la vez.
+            TEST={'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
+        ),
+    }
+    if DB_REPLICA:
+        DATABASES['replica'] = _sqlite(DB_REPLICA, SQLITE_OPCIONES_REPLICA, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['app.bd.RouterReportes']
+
+# --- Caché ---
+# Compartido por todos los procesos (workers de gunicorn, trabajador, importar,
+# plegar_fracciones): los KPIs y avisos que uno parcha los tienen que ver los demás.
+#  - Por defecto, tabla 'cache_django' en la base principal; la crea `migrate`
+#    (migración 0014). Si cambia LOCATION: `manage.py createcachetable`.
+#  - CACHE_URL=redis://host:6379/0: Redis (pip install redis), mejor con PostgreSQL
+#    o mucho tráfico, para no sumar escrituras a la base.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_django',
+        },
     }
-}
 
 # Validadores de contraseña
 AUTH_PASSWORD_VALIDATORS = [
@@ -93,6 +186,38 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# --- IA (descripciones de producto) ---
+# IA_CLIENTE: 'gemini', 'falso' (local, sin red) o ruta a una clase con generar(prompt).
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', 'TU_API_KEY_AQUI')
+IA_CLIENTE = os.environ.get('IA_CLIENTE', 'gemini')
+IA_MODELO = 'gemini-pro'
+IA_CACHE_MAX = 2000      # respuestas guardadas (LRU)
+IA_CONCURRENCIA = 4      # llamadas simultáneas del trabajo masivo
+
+# --- Etiquetas QR ---
+# Caché en disco de las imágenes QR (fuera de git, ver .gitignore).
+ETIQUETAS_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'qr')
+# Procesos para armar hojas PDF; cada proceso web arranca su grupo una sola vez.
+ETIQUETAS_PROCESOS = os.cpu_count() or 1
+
+# --- Archivo de movimientos ---
+# Los movimientos más viejos que esto pasan a MovimientoArchivado (manage.py archivar_movimientos).
+ARCHIVO_HORIZONTE_DIAS = 92
+
+# --- Stock mínimo ---
+# Mínimo por tipo cuando el producto no trae el suyo (Producto.stock_minimo); los
+# tipos que no aparecen usan 5. Tras cambiarlo: manage.py recalcular_alertas.
+STOCK_MINIMO_POR_TIPO = {
+    'Tela': 5,
+    'Toalla': 24,
+    'Paquete': 10,
+    'Bulto': 2,
+}
+
+# --- Métricas (/inventario/metricas/) ---
+# Prometheus raspa con 'Authorization: Bearer <token>'; sin token solo entra el staff.
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+
 # Redirección al iniciar sesión
 LOGIN_REDIRECT_URL = '/inventario/productos/'   
 
@@ -1,7 +1,13 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.urls import path
 # --- CORRECCIÓN 1 ---
 # Importamos SOLO los modelos que SÍ existen: Producto y MovimientoInventario
-from .models import Producto, MovimientoInventario
+from .models import Producto, MovimientoArchivado, MovimientoInventario, Trabajo
+from .forms import ImportarCatalogoForm
+from . import etiquetas, importar, trabajos
 
 # --- CORRECCIÓN 2 ---
 # Usamos el decorador @admin.register, es la forma moderna.
@@ -18,7 +24,7 @@ class ProductoAdmin(admin.ModelAdmin):
         ('Dimensiones y Stock', {
             # --- CORRECCIÓN 3 ---
             # Corregimos el typo a 'peso_por_pieza' (como en models.py)
-            'fields': (('largo', 'ancho'), ('pz', 'peso_por_pieza'), 'peso_aprox')
+            'fields': (('largo', 'ancho'), ('pz', 'peso_por_pieza'), 'peso_aprox', 'stock_minimo')
         }),
         # --- CORRECCIÓN 4 ---
         # Añadimos los NUEVOS campos de la tabla en su propia sección
@@ -31,29 +37,133 @@ class ProductoAdmin(admin.ModelAdmin):
         }),
     ]
     
+    # El stock solo se mueve con entradas, salidas y ajustes (app/stock.py), que
+    # dejan su movimiento en el historial; aquí se muestra pero no se edita.
+    readonly_fields = ('pz',)
+
     # Columnas que se verán en la lista de productos
     # --- CORRECCIÓN 5 ---
     # Añadimos los nuevos campos a la lista
     list_display = (
-        'sku', 'nombre_tela', 'tipo', 'color', 'pz', 
+        'sku', 'nombre_tela', 'tipo', 'color', 'pz', 'stock_minimo', 'bajo_minimo',
         'paquete_pz', 'bulto_pz', 'ubicacion'
     )
     
     # Añade filtros útiles
-    list_filter = ('tipo', 'color', 'composicion', 'ubicacion')
+    list_filter = ('bajo_minimo', 'tipo', 'color', 'composicion', 'ubicacion')
     # Añade una barra de búsqueda
     search_fields = ('sku', 'nombre_tela')
 
+    actions = ['describir_faltantes', 'imprimir_etiquetas']
+
+    @admin.action(description="Generar descripción con IA a los seleccionados que no tienen")
+    def describir_faltantes(self, request, queryset):
+        skus = list(queryset.values_list('sku', flat=True))
+        trabajo = trabajos.encolar('describir_faltantes', usuario=request.user, skus=skus)
+        self.message_user(request, f"Trabajo #{trabajo.pk} encolado.", messages.SUCCESS)
+
+    @admin.action(description="Imprimir etiquetas QR de los seleccionados (PDF)")
+    def imprimir_etiquetas(self, request, queryset):
+        productos = list(queryset.only('sku', 'nombre_tela').order_by('nombre_tela', 'sku'))
+        if len(productos) * 2 > etiquetas.MAX_ETIQUETAS:
+            self.message_user(request, f"Máximo {etiquetas.MAX_ETIQUETAS // 2} productos por hoja.", messages.ERROR)
+            return None
+        pdf = etiquetas.hoja_etiquetas(productos, request.build_absolute_uri('/'), ('info', 'accion'))
+        respuesta = HttpResponse(pdf, content_type='application/pdf')
+        respuesta['Content-Disposition'] = 'attachment; filename="etiquetas.pdf"'
+        return respuesta
+
+    # Botón "Importar catálogo" en la lista de productos
+    change_list_template = 'admin/app/producto/change_list.html'
+
+    def get_urls(self):
+        propias = [
+            path(
+                'importar/',
+                self.admin_site.admin_view(self.importar_catalogo),
+                name='app_producto_importar',
+            ),
+        ]
+        return propias + super().get_urls()
+
+    def importar_catalogo(self, request):
+        """Carga masiva (CSV/XLSX) con opción de solo simular el resultado."""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+
+        resultado = None
+        if request.method == 'POST':
+            form = ImportarCatalogoForm(request.POST, request.FILES)
+            if form.is_valid():
+                archivo = form.cleaned_data['archivo']
+                try:
+                    resultado = importar.importar_catalogo(
+                        importar.leer_filas(archivo.open('rb'), archivo.name),
+                        simular=form.cleaned_data['simular'],
+                        stock_inicial=form.cleaned_data['stock_inicial'],
+                        usuario=request.user,
+                    )
+                except ValueError as e:
+                    form.add_error('archivo', str(e))
+                else:
+                    nivel = messages.INFO if resultado.simulado else messages.SUCCESS
+                    self.message_user(request, resultado.resumen(), nivel)
+        else:
+            form = ImportarCatalogoForm()
+
+        contexto = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Importar catálogo',
+            'form': form,
+            'resultado': resultado,
+        }
+        return render(request, 'admin/app/producto/importar.html', contexto)
+
 
 # --- CORRECCIÓN 6 ---
 # Registramos el modelo de Movimientos para verlo en el Admin
 @admin.register(MovimientoInventario)
 class MovimientoInventarioAdmin(admin.ModelAdmin):
     list_display = ('fecha', 'producto', 'tipo_movimiento', 'cantidad', 'notas')
+    # La columna 'producto' y el __str__ (acciones, borrado) leen estas relaciones por fila
+    list_select_related = ('producto', 'usuario')
     list_filter = ('tipo_movimiento', 'fecha')
     search_fields = ('producto__sku', 'producto__nombre_tela', 'notas')
     date_hierarchy = 'fecha'
 
+    # Solo lectura: un movimiento creado, editado o borrado aquí no pasaría por
+    # app/stock.py y pz, el resumen diario, los KPIs y los puntos de control
+    # dejarían de cuadrar. Los ajustes se hacen con entradas, salidas o ajuste de stock.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(MovimientoArchivado)
+class MovimientoArchivadoAdmin(admin.ModelAdmin):
+    # Sin date_hierarchy ni filtro por fecha: en años de historial esas consultas pesan.
+    list_display = ('fecha', 'producto', 'tipo_movimiento', 'cantidad', 'notas')
+    search_fields = ('producto__sku',)
+    list_select_related = ('producto',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Trabajo)
+class TrabajoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'estado', 'intentos', 'creado', 'terminado', 'trabajador')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('creado', 'iniciado', 'terminado', 'trabajador', 'resultado', 'error')
+
 # --- CORRECCIÓN 7 ---
 # Eliminamos las líneas que daban error
 # admin.site.register(Categoria)  <-- ELIMINADO (daba error)
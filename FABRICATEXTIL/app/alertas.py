@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Stock mínimo por producto y alertas de stock bajo.
+
+El mínimo de un SKU es ``Producto.stock_minimo`` o, si está vacío, el de su
+tipo (``settings.STOCK_MINIMO_POR_TIPO``, por defecto ``STOCK_MINIMO``).
+``Producto.bajo_minimo`` dice si ``pz <= mínimo`` y tiene un índice parcial:
+contar o listar alertas lee solo los productos marcados, nunca el catálogo.
+
+El servicio de stock actualiza la marca en el mismo ``UPDATE`` que mueve
+``pz`` (``bajo_minimo=alertas.bajo(...)``) y avisa con ``cambio_stock``;
+cuando un SKU cruza su mínimo se emite la señal ``umbral_cruzado`` al
+confirmar la transacción (los KPIs del dashboard la escuchan en
+``signals.py``). Las altas y ediciones (formularios, admin, importación)
+pasan por ``recalcular``.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThanOrEqual
+from django.dispatch import Signal
+
+from .models import Producto
+
+STOCK_MINIMO = 5
+
+logger = logging.getLogger(__name__)
+
+# Argumentos: sku, pz, minimo y bajo (True al caer al mínimo o debajo, False al reponerse).
+umbral_cruzado = Signal()
+
+
+def _por_tipo():
+    return getattr(settings, 'STOCK_MINIMO_POR_TIPO', {})
+
+
+def minimo():
+    """Expresión SQL con el mínimo efectivo de cada producto."""
+    por_tipo = _por_tipo()
+    del_tipo = Case(
+        *[When(tipo=tipo, then=Value(valor)) for tipo, valor in por_tipo.items()],
+        default=Value(STOCK_MINIMO), output_field=IntegerField(),
+    ) if por_tipo else Value(STOCK_MINIMO)
+    return Coalesce(F('stock_minimo'), del_tipo, output_field=IntegerField())
+
+
+def minimo_de(producto):
+    """Lo mismo que ``minimo()`` para una instancia ya cargada."""
+    if producto.stock_minimo is not None:
+        return producto.stock_minimo
+    return _por_tipo().get(producto.tipo, STOCK_MINIMO)
+
+
+def bajo(pz):
+    """Valor para ``bajo_minimo`` en un ``UPDATE``; ``pz`` es el stock nuevo (número o expresión)."""
+    if isinstance(pz, int):
+        pz = Value(pz)
+    return LessThanOrEqual(pz, minimo())
+
+
+def con_minimo(productos=None):
+    productos = Producto.objects.all() if productos is None else productos
+    return productos.annotate(minimo=minimo())
+
+
+# --- Cruces del umbral ---
+
+def _cruce(sku, pz, minimo_sku, esta_bajo):
+    def enviar():
+        # Un receptor que falla no debe impedir que los demás se enteren.
+        respuestas = umbral_cruzado.send_robust(
+            sender=Producto, sku=sku, pz=pz, minimo=minimo_sku, bajo=esta_bajo,
+        )
+        for receptor, respuesta in respuestas:
+            if isinstance(respuesta, Exception):
+                logger.error("Falló %r al avisar el cruce de %s", receptor, sku, exc_info=respuesta)
+    transaction.on_commit(enviar, robust=True)
+
+
+def cambio_stock(sku, pz_anterior, pz_nuevo, minimo_sku):
+    """El servicio de stock movió ``sku``; si cruzó su mínimo se avisa."""
+    antes, ahora = pz_anterior <= minimo_sku, pz_nuevo <= minimo_sku
+    if antes != ahora:
+        _cruce(sku, pz_nuevo, minimo_sku, ahora)
+
+
+def recalcular(skus=None, avisar=True):
+    """
+    Corrige ``bajo_minimo`` de ``skus`` (o de todo el catálogo, p. ej. tras
+    cambiar ``STOCK_MINIMO_POR_TIPO``). Solo escribe los que cambian. Con
+    ``avisar=False`` no se emiten señales (el llamador invalida los KPIs).
+    Devuelve cuántos cambiaron.
+    """
+    productos = con_minimo(Producto.objects.all() if skus is None else Producto.objects.filter(pk__in=skus))
+    cambiados = list(
+        productos.annotate(calculado=bajo(F('pz'))).exclude(bajo_minimo=F('calculado'))
+        .values_list('sku', 'pz', 'minimo', 'calculado')
+    )
+    with transaction.atomic():
+        # La marca se vuelve a calcular en el UPDATE: un escaneo entre la lectura y aquí no la deja mal.
+        for inicio in range(0, len(cambiados), 500):
+            lote = [sku for sku, _, _, _ in cambiados[inicio:inicio + 500]]
+            Producto.objects.filter(pk__in=lote).update(bajo_minimo=bajo(F('pz')))
+        if avisar:
+            for sku, pz, minimo_sku, calculado in cambiados:
+                _cruce(sku, pz, minimo_sku, bool(calculado))
+    return len(cambiados)
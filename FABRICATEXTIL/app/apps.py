@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class InventarioConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'app'
+    verbose_name = 'Inventario Textil'
+
+    def ready(self):
+        # Conecta las señales (caché de KPIs, etc.)
+        from django.db.backends.signals import connection_created
+
+        from . import bd, signals  # noqa: F401
+        connection_created.connect(bd.activar_wal, dispatch_uid='app.bd.activar_wal')
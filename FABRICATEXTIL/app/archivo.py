@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Archivo de movimientos viejos (tabla caliente / tabla fría).
+
+``MovimientoInventario`` guarda solo el último trimestre
+(``settings.ARCHIVO_HORIZONTE_DIAS``); lo anterior se mueve por lotes a
+``MovimientoArchivado`` con ``INSERT ... SELECT`` + ``DELETE`` por rango de
+``id`` (y por fecha: un id no dice qué tan viejo es el movimiento). Antes de
+mover se deja un punto de control por producto
+(``conciliacion.crear_puntos_control``) como saldo inicial, así la
+conciliación no necesita el archivo; solo se mueve lo que entró en ese corte. El resumen diario no se archiva: los
+totales de reportes y dashboard siguen saliendo de ahí.
+
+``historial`` devuelve los querysets a consultar para un filtro: la tabla
+archivada solo se agrega si el rango de fechas llega hasta ella.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import conciliacion
+from .models import MovimientoArchivado, MovimientoInventario
+
+HORIZONTE_DIAS = 92
+TAMANO_LOTE = 5000
+
+_COLUMNAS = ['id', 'producto_id', 'usuario_id', 'tipo_movimiento', 'cantidad', 'fecha', 'notas']
+
+
+def horizonte():
+    """Fecha antes de la cual un movimiento se archiva."""
+    dias = getattr(settings, 'ARCHIVO_HORIZONTE_DIAS', HORIZONTE_DIAS)
+    return timezone.now() - timedelta(days=dias)
+
+
+def ultimo_archivado():
+    """Fecha del movimiento archivado más reciente, o ``None`` si no hay."""
+    return MovimientoArchivado.objects.aggregate(ultimo=Max('fecha'))['ultimo']
+
+
+def historial(filtro=None, desde=None):
+    """
+    ``[caliente]`` o ``[caliente, archivo]`` con ``filtro`` aplicado, del más
+    reciente al más antiguo (todo lo archivado es anterior a lo caliente).
+    ``desde`` es el inicio del rango; sin él se incluye el archivo si tiene algo.
+    """
+    filtro = filtro or Q()
+    querysets = [MovimientoInventario.objects.filter(filtro)]
+    limite = ultimo_archivado()
+    if limite is not None and (desde is None or desde <= limite):
+        querysets.append(MovimientoArchivado.objects.filter(filtro))
+    return querysets
+
+
+def _mover(desde_id, hasta_id, antes_de):
+    caliente = connection.ops.quote_name(MovimientoInventario._meta.db_table)
+    archivo = connection.ops.quote_name(MovimientoArchivado._meta.db_table)
+    columnas = ', '.join(connection.ops.quote_name(c) for c in _COLUMNAS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {archivo} ({columnas}) SELECT {columnas} FROM {caliente} "
+            f"WHERE id > %s AND id <= %s AND fecha < %s",
+            [desde_id, hasta_id, antes_de],
+        )
+        cursor.execute(
+            f"DELETE FROM {caliente} WHERE id > %s AND id <= %s AND fecha < %s",
+            [desde_id, hasta_id, antes_de],
+        )
+        return cursor.rowcount
+
+
+def archivar(antes_de=None, tamano_lote=TAMANO_LOTE, simular=False):
+    """
+    Mueve al archivo los movimientos anteriores a ``antes_de`` (por defecto
+    el horizonte). Devuelve cuántos se movieron (o se moverían, con ``simular``).
+    """
+    antes_de = antes_de or horizonte()
+    viejos = MovimientoInventario.objects.filter(fecha__lt=antes_de)
+    if simular:
+        return viejos.count()
+    # Mismo corte que el punto de control: lo que se mueve ya quedó en su saldo.
+    corte = conciliacion.corte_movimientos(antes_de)
+    if not viejos.filter(id__lte=corte).exists():
+        return 0
+
+    # Saldo inicial de cada producto al corte; después el archivo ya no hace falta para conciliar.
+    conciliacion.crear_puntos_control(fecha=antes_de, corte=corte)
+
+    movidos, desde_id = 0, 0
+    while desde_id < corte:
+        # Cada lote en su propia transacción: la tabla caliente no queda bloqueada mucho tiempo.
+        siguiente = (
+            viejos.filter(id__gt=desde_id, id__lte=corte)
+            .order_by('id').values_list('id', flat=True)[tamano_lote - 1:tamano_lote]
+        )
+        hasta_id = next(iter(siguiente), corte)
+        with transaction.atomic():
+            movidos += _mover(desde_id, hasta_id, antes_de)
+        desde_id = hasta_id
+    return movidos
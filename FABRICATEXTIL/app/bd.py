@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Lecturas pesadas en la réplica.
+
+Los reportes y las exportaciones recorren miles de movimientos. Si hay una
+réplica configurada (``settings.DB_REPLICA``, alias ``'replica'``) se leen de
+ahí y la base principal queda libre para los escaneos. Las vistas se marcan
+con ``@bd.reportes``: mientras corre la vista (y mientras se transmite una
+respuesta en streaming) ``RouterReportes`` manda a la réplica las lecturas de
+los modelos de la app. Las escrituras, la sesión y los usuarios van siempre a
+la principal; ``en_principal()`` la fuerza para lo que no tolera atraso (el
+caché de KPIs, que después se parcha con cada escaneo).
+
+Sin réplica todo sigue en la principal. Con SQLite la réplica es una copia
+que ``manage.py copiar_replica`` refresca con la API de respaldo en línea
+(ver ``copiar_replica``); con PostgreSQL, una réplica de streaming.
+"""
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PRINCIPAL = 'default'
+REPLICA = 'replica'
+
+_lectura = ContextVar('bd_lectura', default=PRINCIPAL)
+
+
+def hay_replica():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def _leer_de(alias):
+    ficha = _lectura.set(alias)
+    try:
+        yield
+    finally:
+        _lectura.reset(ficha)
+
+
+def en_replica():
+    """Las lecturas del bloque van a la réplica, si hay."""
+    return _leer_de(REPLICA)
+
+
+def en_principal():
+    """Las lecturas del bloque van a la principal aunque se esté dentro de ``en_replica``."""
+    return _leer_de(PRINCIPAL)
+
+
+def _en_replica_al_iterar(contenido):
+    # Cada trozo se pide dentro del contexto: bajo ASGI cada ``next`` puede
+    # correr en otro hilo (y otro contexto), así que no se deja abierto entre trozos.
+    iterador = iter(contenido)
+    while True:
+        with en_replica():
+            try:
+                trozo = next(iterador)
+            except StopIteration:
+                return
+        yield trozo
+
+
+def reportes(vista):
+    """Decorador para vistas de solo lectura que toleran unos minutos de atraso."""
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        with en_replica():
+            respuesta = vista(request, *args, **kwargs)
+        if respuesta.streaming:
+            respuesta.streaming_content = _en_replica_al_iterar(respuesta.streaming_content)
+        return respuesta
+    return envoltura
+
+
+class RouterReportes:
+    """Router de ``settings.DATABASE_ROUTERS``."""
+
+    def db_for_read(self, model, **hints):
+        if _lectura.get() == REPLICA and model._meta.app_label == 'app' and hay_replica():
+            return REPLICA
+        return PRINCIPAL
+
+    def db_for_write(self, model, **hints):
+        return PRINCIPAL
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica es copia de la principal: las relaciones valen entre ambas.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # La réplica se copia (o replica) de la principal, no se migra.
+        return db != REPLICA
+
+
+def activar_wal(sender, connection, **kwargs):
+    """
+    Receptor de ``connection_created``: pone en WAL la base SQLite principal
+    (lectores sin esperar a escritores). Se deja fuera la base de desarrollo
+    del repo (``settings.SQLITE_INCLUIDA``), porque el modo se guarda en el
+    archivo; ``settings.SQLITE_WAL`` ('1' o '0') fuerza una u otra cosa.
+    """
+    if connection.vendor != 'sqlite' or connection.alias != PRINCIPAL:
+        return
+    modo = getattr(settings, 'SQLITE_WAL', '')
+    incluida = connection.settings_dict['NAME'] == getattr(settings, 'SQLITE_INCLUIDA', None)
+    if modo == '0' or (modo != '1' and incluida):
+        return
+    # En WAL, NORMAL no arriesga la integridad (solo la última transacción ante un apagón).
+    connection.connection.execute('PRAGMA journal_mode=WAL')
+    connection.connection.execute('PRAGMA synchronous=NORMAL')
+
+
+def copiar_replica(origen=None, destino=None):
+    """
+    Copia la base SQLite principal sobre la réplica. La API de respaldo lee
+    una foto consistente sin bloquear a los escritores (WAL) y la réplica se
+    reescribe en una sola transacción: sus lectores ven la copia anterior o
+    la nueva, nunca una mezcla. Devuelve las páginas copiadas.
+    """
+    if origen is None or destino is None:
+        if not hay_replica():
+            raise ValueError("No hay réplica configurada (DB_REPLICA).")
+        principal, replica = settings.DATABASES[PRINCIPAL], settings.DATABASES[REPLICA]
+        if 'sqlite3' not in principal['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+            raise ValueError("copiar_replica es para SQLite; con PostgreSQL la réplica se alimenta sola.")
+        origen, destino = origen or principal['NAME'], destino or replica['NAME']
+
+    fuente = sqlite3.connect(origen, timeout=20)
+    copia = sqlite3.connect(destino, timeout=20)
+    try:
+        fuente.backup(copia)
+        return copia.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        copia.close()
+        fuente.close()
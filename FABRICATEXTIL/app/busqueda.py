@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda de productos.
+
+En SQLite se usa la tabla virtual FTS5 ``app_producto_fts`` (creada por la
+migración 0004 y mantenida con triggers sobre ``app_producto``), con
+coincidencia por prefijo en SKU, nombre, color, composición, ubicación y tipo,
+y resultados ordenados por relevancia (bm25).
+
+En otros motores (o si SQLite no trae FTS5) se cae a un ``icontains`` sobre
+los mismos campos; en PostgreSQL la migración deja índices trigram que
+aceleran esa consulta.
+"""
+import re
+
+from django.db import DatabaseError, connection
+from django.db.models import Q
+
+from .models import Producto
+
+TABLA_FTS = 'app_producto_fts'
+CAMPOS_BUSQUEDA = ('sku', 'nombre_tela', 'color', 'composicion', 'ubicacion', 'tipo')
+
+# Peso de cada columna para bm25, en el orden de CAMPOS_BUSQUEDA.
+PESOS_BM25 = (10.0, 5.0, 2.0, 2.0, 1.0, 1.0)
+
+LIMITE_RESULTADOS = 200
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def consulta_fts(texto):
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5: cada palabra se
+    busca por prefijo y todas deben aparecer. Devuelve ``''`` si no hay
+    palabras útiles.
+    """
+    return ' '.join(f'"{token}"*' for token in _TOKEN.findall(texto))
+
+
+def _buscar_fts(texto, limite):
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return []
+    pesos = ', '.join(str(p) for p in PESOS_BM25)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT sku FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s "
+            f"ORDER BY bm25({TABLA_FTS}, {pesos}) LIMIT %s",
+            [consulta, limite],
+        )
+        skus = [fila[0] for fila in cursor.fetchall()]
+    productos = Producto.objects.in_bulk(skus)
+    return [productos[sku] for sku in skus if sku in productos]
+
+
+def _buscar_icontains(texto, limite):
+    filtro = Q()
+    for campo in CAMPOS_BUSQUEDA:
+        filtro |= Q(**{f'{campo}__icontains': texto})
+    return list(Producto.objects.filter(filtro).order_by('nombre_tela', 'sku')[:limite])
+
+
+def buscar_productos(texto, limite=LIMITE_RESULTADOS):
+    """
+    Devuelve una lista de ``Producto`` que coinciden con ``texto``, los más
+    relevantes primero (máximo ``limite``).
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    if connection.vendor == 'sqlite':
+        try:
+            return _buscar_fts(texto, limite)
+        except DatabaseError:
+            # SQLite compilado sin FTS5: la migración no creó la tabla.
+            pass
+    return _buscar_icontains(texto, limite)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Datos sintéticos y prueba de carga.
+
+``sembrar`` llena la base con un catálogo, usuarios e historial de
+movimientos realistas: pocos SKUs concentran la mayoría de los escaneos
+(distribución tipo Zipf), ninguna salida deja stock negativo y el ``pz`` de
+cada producto cuadra con su historial. Todo lo sembrado usa el prefijo
+``SKU_PREFIJO`` para poder borrarlo después.
+
+``correr`` simula kioscos, escáneres y usuarios de oficina concurrentes (un
+hilo cada uno) contra la app WSGI en el mismo proceso, o contra un servidor
+real con ``base_url``. Con ``asgi=True`` cada cliente es una tarea de
+``asyncio`` contra la pila ASGI en el mismo proceso (``ASGIHandler``, como la
+serviría uvicorn), para comparar ambas con cientos de kioscos. ``resumen`` calcula peticiones por segundo y latencias
+p50/p95/p99 por tipo de petición.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from . import alertas, kpis, resumenes
+from .models import (
+    MovimientoArchivado, MovimientoDiario, MovimientoInventario, Producto, PuntoControlStock,
+    TIPO_CHOICES,
+)
+
+SKU_PREFIJO = 'SEM-'
+USUARIO_PREFIJO = 'operador'
+CONTRASENA = 'carga-local'
+TAMANO_LOTE = 10000
+
+TELAS = ['Popelina', 'Gabardina', 'Mezclilla', 'Franela', 'Loneta', 'Satín', 'Lino', 'Toalla Rizo', 'Tergal', 'Manta']
+COLORES = ['Blanco', 'Negro', 'Azul Marino', 'Rojo', 'Gris Oxford', 'Beige', 'Verde Militar', 'Rosa', 'Vino', 'Crudo']
+COMPOSICIONES = ['100% Algodón', '65% Poliéster / 35% Algodón', '100% Poliéster', '98% Algodón / 2% Elastano', 'Lino / Algodón']
+UBICACIONES = [f'Pasillo {p}-{n}' for p in 'ABCDEF' for n in range(1, 9)]
+
+
+# --- Datos sintéticos ---
+
+def limpiar():
+    """Borra lo sembrado (productos con el prefijo, su historial y los operadores)."""
+    sembrados = {'producto__sku__startswith': SKU_PREFIJO}
+    # Los modelos hijos se borran primero con un DELETE directo cada uno;
+    # así el borrado en cascada de Producto no carga millones de filas.
+    for modelo in (MovimientoInventario, MovimientoArchivado, MovimientoDiario, PuntoControlStock):
+        modelo.objects.filter(**sembrados).delete()
+    Producto.objects.filter(sku__startswith=SKU_PREFIJO).delete()
+    User.objects.filter(username__startswith=USUARIO_PREFIJO, email__endswith='@carga.local').delete()
+    kpis.invalidar()
+
+
+def sembrar(productos=2000, movimientos=200000, usuarios=20, dias=365, semilla=None):
+    """Crea el catálogo, los usuarios y el historial. Devuelve un dict con los conteos."""
+    azar = random.Random(semilla)
+    ahora = timezone.now()
+    tipos = [clave for clave, _ in TIPO_CHOICES]
+
+    clave_hash = make_password(CONTRASENA)  # un solo hash para todos: hashear es lento a propósito
+    operadores = [
+        User(username=f'{USUARIO_PREFIJO}{i:02}', email=f'{USUARIO_PREFIJO}{i:02}@carga.local',
+             password=clave_hash, is_staff=(i == 1))
+        for i in range(1, usuarios + 1)
+    ]
+
+    skus = [f'{SKU_PREFIJO}{i:05}' for i in range(1, productos + 1)]
+    # Zipf: el SKU en la posición k recibe escaneos en proporción a 1/k.
+    pesos = [1 / k for k in range(1, productos + 1)]
+    azar.shuffle(skus)
+    elegidos = azar.choices(skus, weights=pesos, k=movimientos)
+    # Fechas ordenadas: los ids quedan en el mismo orden que las fechas.
+    segundos = dias * 86400
+    desplazamientos = sorted(azar.uniform(0, segundos) for _ in range(movimientos))
+
+    pz = dict.fromkeys(skus, 0)
+    filas = []
+    for sku, atras in zip(elegidos, desplazamientos):
+        cantidad = azar.choice((1, 1, 1, 2, 3, 5, 10, 12, 24, 50))
+        tipo = 'SALIDA' if pz[sku] >= cantidad and azar.random() < 0.45 else 'ENTRADA'
+        pz[sku] += cantidad if tipo == 'ENTRADA' else -cantidad
+        filas.append((sku, tipo, cantidad, ahora - timedelta(seconds=segundos - atras)))
+
+    with transaction.atomic():
+        User.objects.bulk_create(operadores)
+        ids_usuarios = list(
+            User.objects.filter(username__in=[u.username for u in operadores]).values_list('pk', flat=True)
+        )
+        Producto.objects.bulk_create([
+            Producto(
+                sku=sku,
+                nombre_tela=f'{azar.choice(TELAS)} {azar.choice(COLORES)}',
+                tipo=azar.choice(tipos),
+                color=azar.choice(COLORES),
+                composicion=azar.choice(COMPOSICIONES),
+                ancho=Decimal(azar.choice(('1.50', '1.60', '1.80', '2.20', '2.50'))),
+                ubicacion=azar.choice(UBICACIONES),
+                pz=pz[sku],
+            )
+            for sku in skus
+        ], batch_size=1000)
+
+        # INSERT directo: ``bulk_create`` pisaría la fecha (auto_now_add).
+        tabla = connection.ops.quote_name(MovimientoInventario._meta.db_table)
+        sql = (
+            f"INSERT INTO {tabla} (producto_id, usuario_id, tipo_movimiento, cantidad, fecha, notas) "
+            f"VALUES (%s, %s, %s, %s, %s, %s)"
+        )
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(filas), TAMANO_LOTE):
+                cursor.executemany(sql, [
+                    (sku, azar.choice(ids_usuarios) if ids_usuarios else None, tipo, cantidad,
+                     connection.ops.adapt_datetimefield_value(fecha), 'Datos sintéticos')
+                    for sku, tipo, cantidad, fecha in filas[inicio:inicio + TAMANO_LOTE]
+                ])
+
+    desde = timezone.localdate(ahora - timedelta(days=dias))
+    resumenes.reconstruir(desde=desde)
+    alertas.recalcular(avisar=False)
+    kpis.invalidar()
+    return {'productos': productos, 'movimientos': movimientos, 'usuarios': usuarios}
+
+
+# --- Carga concurrente ---
+
+# rol -> peticiones que hace en ciclo: (nombre, método, nombre de URL, ¿lleva SKU?, query string)
+ROLES = {
+    # Kiosco de piso: registra entradas y salidas (formulario clásico y vía rápida JSON)
+    'kiosco': [
+        ('kiosco_post', 'POST', 'app:kiosco_movimiento', True, ''),
+        ('kiosco_json', 'POST', 'app:kiosco_movimiento', True, '?formato=json'),
+    ],
+    # Celular que escanea un QR y abre la ficha del kiosco
+    'escaner': [('kiosco_get', 'GET', 'app:kiosco_movimiento', True, '')],
+    # Oficina: catálogo, dashboard y reportes
+    'oficina': [
+        ('lista_productos', 'GET', 'app:lista_productos', False, ''),
+        ('dashboard', 'GET', 'app:dashboard', False, ''),
+        ('ver_reportes', 'GET', 'app:ver_reportes', False, ''),
+    ],
+}
+
+
+class _ClienteWSGI:
+    """La app en el mismo proceso, con el cliente de pruebas de Django (pila WSGI completa)."""
+
+    def __init__(self, usuario):
+        self.cliente = Client()
+        self.cliente.force_login(usuario)
+
+    def pedir(self, metodo, url, datos=None):
+        if metodo == 'POST':
+            respuesta = self.cliente.post(url, datos)
+        else:
+            respuesta = self.cliente.get(url)
+        respuesta.close()
+        return respuesta.status_code
+
+
+class _ClienteHTTP:
+    """Un servidor real (gunicorn, runserver) que comparte la base de datos."""
+
+    def __init__(self, usuario, base_url):
+        self.base_url = base_url.rstrip('/')
+        # La sesión se crea en la base compartida; el token CSRF va en cookie y encabezado.
+        sesion = Client()
+        sesion.force_login(usuario)
+        self.csrf = get_random_string(32)
+        self.cookies = f"sessionid={sesion.cookies['sessionid'].value}; csrftoken={self.csrf}"
+        self.abridor = urllib.request.build_opener(_SinRedireccion)
+
+    def pedir(self, metodo, url, datos=None):
+        cuerpo = urllib.parse.urlencode(datos).encode() if datos else None
+        peticion = urllib.request.Request(self.base_url + url, data=cuerpo, method=metodo, headers={
+            'Cookie': self.cookies, 'X-CSRFToken': self.csrf, 'Referer': self.base_url + url,
+        })
+        try:
+            with self.abridor.open(peticion, timeout=30) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class _ClienteASGI:
+    """La app en el mismo proceso por la pila ASGI, sin red: cada petición es un ``scope`` HTTP."""
+
+    def __init__(self, usuario, aplicacion):
+        self.aplicacion = aplicacion
+        sesion = Client()
+        sesion.force_login(usuario)
+        self.csrf = get_random_string(32)
+        self.encabezados = [
+            (b'host', b'testserver'),
+            (b'cookie', f"sessionid={sesion.cookies['sessionid'].value}; csrftoken={self.csrf}".encode()),
+            (b'x-csrftoken', self.csrf.encode()),
+        ]
+
+    async def pedir(self, metodo, url, datos=None):
+        ruta, _, consulta = url.partition('?')
+        cuerpo = urllib.parse.urlencode(datos).encode() if datos else b''
+        encabezados = self.encabezados
+        if datos:
+            encabezados = encabezados + [(b'content-type', b'application/x-www-form-urlencoded')]
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': metodo, 'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(),
+            'query_string': consulta.encode(), 'root_path': '', 'headers': encabezados,
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        mensajes = [{'type': 'http.request', 'body': cuerpo, 'more_body': False}]
+        estado = 0
+
+        async def recibir():
+            if mensajes:
+                return mensajes.pop()
+            # El cliente no se desconecta: Django cancela esta espera al responder.
+            await asyncio.get_running_loop().create_future()
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje['type'] == 'http.response.start':
+                estado = mensaje['status']
+
+        await self.aplicacion(scope, recibir, enviar)
+        return estado
+
+
+class _SinRedireccion(urllib.request.HTTPRedirectHandler):
+    # Se mide la petición tal cual: el 302 del kiosco es su respuesta normal.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _peticion(peticiones, turno, skus, azar):
+    nombre, metodo, url, con_sku, consulta = peticiones[turno % len(peticiones)]
+    url = reverse(url, args=[azar.choice(skus)] if con_sku else []) + consulta
+    datos = None
+    if metodo == 'POST':
+        datos = {'tipo': azar.choice(('entrada', 'salida')), 'cantidad': azar.choice((1, 1, 2, 5))}
+    return nombre, metodo, url, datos
+
+
+def _trabajar(rol, cliente, skus, hasta, resultados, azar):
+    peticiones = ROLES[rol]
+    turno = 0
+    try:
+        while time.perf_counter() < hasta:
+            nombre, metodo, url, datos = _peticion(peticiones, turno, skus, azar)
+            turno += 1
+            inicio = time.perf_counter()
+            try:
+                estado = cliente.pedir(metodo, url, datos)
+            except Exception:
+                estado = 0
+            resultados.append((nombre, time.perf_counter() - inicio, estado))
+    finally:
+        # Cada hilo abre su propia conexión; se cierra al terminar.
+        connection.close()
+
+
+async def _atrabajar(rol, cliente, skus, hasta, resultados, azar):
+    peticiones = ROLES[rol]
+    turno = 0
+    while time.perf_counter() < hasta:
+        nombre, metodo, url, datos = _peticion(peticiones, turno, skus, azar)
+        turno += 1
+        inicio = time.perf_counter()
+        try:
+            estado = await cliente.pedir(metodo, url, datos)
+        except Exception:
+            estado = 0
+        resultados.append((nombre, time.perf_counter() - inicio, estado))
+
+
+async def _correr_asgi(clientes, skus, duracion, resultados):
+    hasta = time.perf_counter() + duracion
+    await asyncio.gather(*(
+        _atrabajar(rol, cliente, skus, hasta, resultados, azar_cliente)
+        for rol, cliente, azar_cliente in clientes
+    ))
+
+
+def correr(usuario, roles, duracion=10.0, base_url=None, skus=None, semilla=None, asgi=False):
+    """
+    Lanza ``roles[rol]`` hilos (o tareas, con ``asgi``) por rol durante
+    ``duracion`` segundos. Devuelve ``(resultados, segundos)`` con una tupla
+    ``(nombre, segundos, estado)`` por petición.
+    """
+    if asgi and base_url:
+        raise ValueError("asgi es para la app en este proceso; un servidor real ya es WSGI o ASGI.")
+    if skus is None:
+        skus = list(Producto.objects.order_by('sku').values_list('sku', flat=True)[:1000])
+    if not skus:
+        raise ValueError("No hay productos; siembra datos primero.")
+    azar = random.Random(semilla)
+
+    resultados = []
+    hilos = []
+    aplicacion = ASGIHandler() if asgi else None
+    for rol, cuantos in roles.items():
+        for _ in range(cuantos):
+            if asgi:
+                cliente = _ClienteASGI(usuario, aplicacion)
+            else:
+                cliente = _ClienteHTTP(usuario, base_url) if base_url else _ClienteWSGI(usuario)
+            hilos.append((rol, cliente, random.Random(azar.random())))
+
+    inicio = time.perf_counter()
+    if asgi:
+        asyncio.run(_correr_asgi(hilos, skus, duracion, resultados))
+        return resultados, time.perf_counter() - inicio
+    hasta = inicio + duracion
+    hilos = [
+        threading.Thread(target=_trabajar, args=(rol, cliente, skus, hasta, resultados, azar_hilo))
+        for rol, cliente, azar_hilo in hilos
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados, time.perf_counter() - inicio
+
+
+def _percentil(ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not ordenados:
+        return 0.0
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def _estadisticas(filas, segundos):
+    latencias = sorted(latencia for _, latencia, _ in filas)
+    return {
+        'peticiones': len(filas),
+        'errores': sum(1 for _, _, estado in filas if not estado or estado >= 400),
+        'por_segundo': round(len(filas) / segundos, 2) if segundos else 0.0,
+        'p50_ms': round(_percentil(latencias, 50) * 1000, 2),
+        'p95_ms': round(_percentil(latencias, 95) * 1000, 2),
+        'p99_ms': round(_percentil(latencias, 99) * 1000, 2),
+        'max_ms': round(latencias[-1] * 1000, 2) if latencias else 0.0,
+    }
+
+
+def resumen(resultados, segundos):
+    """Estadísticas totales y por tipo de petición."""
+    por_nombre = {}
+    for fila in resultados:
+        por_nombre.setdefault(fila[0], []).append(fila)
+    return {
+        'segundos': round(segundos, 2),
+        'total': _estadisticas(resultados, segundos),
+        'peticiones': {
+            nombre: _estadisticas(filas, segundos) for nombre, filas in sorted(por_nombre.items())
+        },
+    }
+
+
+def regresiones(actual, base, tolerancia=0.25):
+    """
+    Compara contra una línea base guardada. Devuelve los mensajes de lo que
+    empeoró más de ``tolerancia`` (p95 más alto o menos peticiones por segundo).
+    """
+    mensajes = []
+    for nombre, previo in base.get('peticiones', {}).items():
+        nuevo = actual['peticiones'].get(nombre)
+        if nuevo is None:
+            continue
+        if nuevo['p95_ms'] > previo['p95_ms'] * (1 + tolerancia):
+            mensajes.append(f"{nombre}: p95 {nuevo['p95_ms']:.1f} ms (antes {previo['p95_ms']:.1f} ms)")
+        if nuevo['por_segundo'] < previo['por_segundo'] * (1 - tolerancia):
+            mensajes.append(
+                f"{nombre}: {nuevo['por_segundo']:.1f} pet/s (antes {previo['por_segundo']:.1f} pet/s)"
+            )
+    return mensajes
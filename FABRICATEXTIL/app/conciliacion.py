@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Conciliación del contador ``Producto.pz`` contra el libro de movimientos.
+
+El stock esperado de un SKU es su último punto de control
+(``PuntoControlStock``) más la suma con signo de los movimientos con id
+mayor a ``ultimo_movimiento``. Todo se calcula en una sola consulta con
+subconsultas correlacionadas que recorren el índice de ``producto_id``: una
+auditoría solo lee los movimientos posteriores a cada corte, no el historial
+completo, y nunca itera productos en Python.
+
+``crear_puntos_control`` hace un corte nuevo (se corre periódicamente con
+``manage.py conciliar_stock --punto-control``). Como los movimientos
+posteriores se reconocen por id, el corte no puede dejar atrás un id menor
+que aún no se confirma (PostgreSQL reparte los ids antes del commit): ver
+``corte_movimientos``. ``reparar`` corrige las
+diferencias ajustando el contador o registrando un movimiento de ajuste.
+En un SKU fraccionado el contador es la suma de sus fracciones, no el ``pz``
+en caché (ver ``app/fracciones.py``).
+"""
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import alertas, fracciones, kpis, metricas, resumenes
+from .models import MovimientoArchivado, MovimientoInventario, Producto, PuntoControlStock, nueva_version
+
+MODOS_REPARACION = ('contador', 'libro')
+NOTA_AJUSTE = 'Conciliación: ajuste del historial al stock'
+
+_CON_SIGNO = Case(
+    When(tipo_movimiento='ENTRADA', then=F('cantidad')),
+    default=-F('cantidad'),
+    output_field=IntegerField(),
+)
+
+
+def _ultimo_punto(fecha=None):
+    puntos = PuntoControlStock.objects.filter(producto=OuterRef('pk'))
+    if fecha is not None:
+        puntos = puntos.filter(fecha__lte=fecha)
+    return puntos.order_by('-fecha')
+
+
+def _delta(modelo, fecha=None, hasta_movimiento=None):
+    """Suma con signo de los movimientos posteriores al punto de control."""
+    movimientos = modelo.objects.filter(
+        producto=OuterRef('pk'), id__gt=OuterRef('base_movimiento')
+    )
+    if fecha is not None:
+        movimientos = movimientos.filter(fecha__lte=fecha)
+    if hasta_movimiento is not None:
+        movimientos = movimientos.filter(id__lte=hasta_movimiento)
+    return Subquery(
+        movimientos.order_by().values('producto').annotate(total=Sum(_CON_SIGNO)).values('total')
+    )
+
+
+def con_esperado(productos=None, fecha=None, hasta_movimiento=None):
+    """
+    Anota ``esperado`` (stock según el libro) en ``productos``. Con ``fecha``
+    es el stock a ese momento y se suman también los movimientos archivados
+    (el stock actual nunca los necesita: cada archivado deja su punto de
+    control). ``delta`` queda en ``NULL`` si no hubo movimientos después del
+    punto de control.
+    """
+    productos = Producto.objects.all() if productos is None else productos
+    punto = _ultimo_punto(fecha)
+    productos = productos.annotate(
+        base_pz=Coalesce(Subquery(punto.values('pz')[:1]), Value(0)),
+        base_movimiento=Coalesce(Subquery(punto.values('ultimo_movimiento')[:1]), Value(0)),
+        delta=_delta(MovimientoInventario, fecha, hasta_movimiento),
+    )
+    esperado = F('base_pz') + Coalesce(F('delta'), Value(0))
+    if fecha is not None:
+        productos = productos.annotate(delta_archivo=_delta(MovimientoArchivado, fecha, hasta_movimiento))
+        esperado += Coalesce(F('delta_archivo'), Value(0))
+    return productos.annotate(esperado=esperado)
+
+
+def _filtrar(skus):
+    productos = Producto.objects.order_by('sku')
+    return productos if skus is None else productos.filter(pk__in=skus)
+
+
+def diferencias(skus=None):
+    """Lista de ``(sku, pz, esperado)`` de los productos que no cuadran."""
+    return list(
+        con_esperado(_filtrar(skus)).annotate(real=fracciones.stock_real()).exclude(real=F('esperado'))
+        .values_list('sku', 'real', 'esperado')
+    )
+
+
+def stock_al(fecha, skus=None):
+    """``{sku: piezas}`` según el libro al momento ``fecha``."""
+    return dict(con_esperado(_filtrar(skus), fecha=fecha).values_list('sku', 'esperado'))
+
+
+def corte_movimientos(fecha=None):
+    """
+    id del último movimiento de un corte: todos los de id menor o igual ya
+    están confirmados y, con ``fecha``, son anteriores a ella (un movimiento
+    viejo con id mayor queda para el siguiente corte).
+
+    En PostgreSQL se toma con la tabla bloqueada en modo SHARE: espera a las
+    transacciones que ya insertaron (y tienen su id) y detiene las nuevas
+    solo mientras dura esta consulta. SQLite ya confirma en orden de id.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            tabla = connection.ops.quote_name(MovimientoInventario._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {tabla} IN SHARE MODE')
+        movimientos = MovimientoInventario.objects.all()
+        if fecha is not None:
+            primero_nuevo = movimientos.filter(fecha__gte=fecha).aggregate(primero=Min('id'))['primero']
+            if primero_nuevo is not None:
+                return primero_nuevo - 1
+        return movimientos.aggregate(ultimo=Max('id'))['ultimo'] or 0
+
+
+def crear_puntos_control(skus=None, fecha=None, corte=None):
+    """
+    Guarda un corte para cada producto con movimientos desde su corte
+    anterior. Con ``fecha`` el corte incluye solo movimientos anteriores a
+    ella (lo usa el archivado, que pasa ``corte`` para mover exactamente lo
+    que quedó en los puntos). Devuelve cuántos puntos se crearon.
+    """
+    if corte is None:
+        corte = corte_movimientos(fecha)
+    fecha_corte = fecha or timezone.now()
+    filas = (
+        con_esperado(_filtrar(skus), fecha=fecha, hasta_movimiento=corte)
+        .filter(delta__isnull=False).values_list('sku', 'esperado')
+    )
+    puntos = [
+        PuntoControlStock(producto_id=sku, fecha=fecha_corte, pz=esperado, ultimo_movimiento=corte)
+        for sku, esperado in filas.iterator()
+    ]
+    PuntoControlStock.objects.bulk_create(puntos, batch_size=1000)
+    return len(puntos)
+
+
+def reparar(faltantes, modo='contador', usuario=None):
+    """
+    Corrige las diferencias de ``diferencias()``:
+
+    - ``'contador'``: ``pz`` toma el valor del libro.
+    - ``'libro'``: se registra un movimiento de ajuste para que el libro
+      llegue al ``pz`` actual.
+
+    Cada SKU se corrige con compare-and-set sobre el ``pz`` leído; si un
+    escaneo lo cambió mientras tanto se omite (la siguiente auditoría lo
+    vuelve a revisar). Devuelve cuántos se corrigieron.
+    """
+    if modo not in MODOS_REPARACION:
+        raise ValueError(f"Modo de reparación inválido: {modo}")
+
+    corregidos = 0
+    nuevos = []
+    minimos = {}
+    productos = Producto.objects.filter(pk__in=[sku for sku, _, _ in faltantes])
+    fraccionados = set(productos.filter(fracciones__gt=0).values_list('sku', flat=True))
+    if modo == 'contador':
+        minimos = dict(alertas.con_minimo(productos).values_list('sku', 'minimo'))
+    with transaction.atomic():
+        for sku, pz, esperado in faltantes:
+            if sku in fraccionados:
+                # El mismo compare-and-set, sobre el total; las fracciones quedan bloqueadas hasta el commit.
+                if modo == 'contador':
+                    if fracciones.fijar(sku, esperado, si_era=pz) == pz:
+                        corregidos += 1
+                    continue
+                if fracciones.fijar(sku, pz, si_era=pz) != pz:
+                    continue
+                Producto.objects.filter(pk=sku).update(**nueva_version())
+            elif modo == 'contador':
+                filas = Producto.objects.filter(pk=sku, pz=pz).update(
+                    pz=esperado, bajo_minimo=alertas.bajo(esperado), **nueva_version(),
+                )
+                if filas:
+                    kpis.cambio_stock(sku, pz, esperado)
+                    alertas.cambio_stock(sku, pz, esperado, minimos[sku])
+                    corregidos += 1
+                continue
+            else:
+                # Bloquea el contador hasta el commit para que el ajuste sea exacto; la
+                # versión sube porque el historial del producto cambia.
+                if not Producto.objects.filter(pk=sku, pz=pz).update(pz=pz, **nueva_version()):
+                    continue
+            diferencia = pz - esperado
+            nuevos.append(MovimientoInventario(
+                producto_id=sku,
+                tipo_movimiento='ENTRADA' if diferencia > 0 else 'SALIDA',
+                cantidad=abs(diferencia),
+                notas=NOTA_AJUSTE,
+                usuario=usuario,
+            ))
+            corregidos += 1
+        MovimientoInventario.objects.bulk_create(nuevos)
+        resumenes.acumular(nuevos)
+        kpis.movimientos_registrados([m.tipo_movimiento for m in nuevos])
+        metricas.movimientos_registrados([m.tipo_movimiento for m in nuevos])
+    return corregidos
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+GET condicional (ETag / Last-Modified → 304) para las vistas de producto.
+
+El ETag sale del sello de versión (``Producto.version``, que sube con cada
+save, movimiento de stock o importación) más la cookie CSRF: el formulario del
+kiosco lleva el token y, si la cookie rota (p. ej. al iniciar sesión), una
+copia vieja fallaría al enviar. Si el navegador ya tiene esa versión se
+responde ``304`` con una sola consulta por llave primaria, sin tocar la
+sesión ni renderizar nada; si no, la vista reutiliza esa misma fila
+(``obtener``).
+
+Con mensajes pendientes (``messages``) no hay 304: el aviso del último
+movimiento se tiene que mostrar. Tampoco para un SKU fraccionado
+(``Producto.fracciones``): sus movimientos no suben la versión hasta el
+siguiente pliegue, así que la versión no dice si cambió su actividad. Las respuestas van con
+``Cache-Control: private, no-cache``: el navegador guarda la página pero
+pregunta cada vez, y ningún proxy la comparte entre usuarios.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.contrib import messages
+from django.http import Http404
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .models import Producto
+
+# Súbelo si cambian las plantillas de producto: invalida los ETag que tienen los navegadores.
+ESQUEMA = 1
+
+
+def _aplica(request):
+    # Se calcula una vez: ``condition`` la consulta para el ETag y para Last-Modified.
+    if not hasattr(request, '_condicional_aplica'):
+        request._condicional_aplica = (
+            request.method in ('GET', 'HEAD') and not len(messages.get_messages(request))
+        )
+    return request._condicional_aplica
+
+
+def _cliente(request):
+    # En la primera visita todavía no hay cookie: se genera aquí (la plantilla
+    # reutiliza el mismo secreto) para que el ETag ya coincida en la siguiente.
+    if 'CSRF_COOKIE' not in request.META:
+        get_token(request)
+    return hashlib.sha1(request.META['CSRF_COOKIE'].encode()).hexdigest()[:12]
+
+
+def _leido(request, sku):
+    if getattr(request, '_producto_condicional', (None, None))[0] != sku:
+        request._producto_condicional = (sku, Producto.objects.filter(pk=sku).first())
+    return request._producto_condicional[1]
+
+
+def obtener(request, sku):
+    """El producto que ya leyó el decorador para el ETag (o 404)."""
+    producto = _leido(request, sku)
+    if producto is None:
+        raise Http404(f"No existe el producto {sku}")
+    return producto
+
+
+async def aobtener(request, sku):
+    """``obtener`` para vistas async (ORM asíncrono)."""
+    if getattr(request, '_producto_condicional', (None, None))[0] != sku:
+        request._producto_condicional = (sku, await Producto.objects.filter(pk=sku).afirst())
+    return obtener(request, sku)
+
+
+def _etag(request, sku, *args, **kwargs):
+    producto = _leido(request, sku)
+    if producto is None or producto.fracciones or not _aplica(request):
+        return None
+    return f'{ESQUEMA}-{sku}-{producto.version}-{_cliente(request)}'
+
+
+def _modificado(request, sku, *args, **kwargs):
+    producto = _leido(request, sku)
+    if producto is None or producto.fracciones or not _aplica(request):
+        return None
+    return producto.modificado
+
+
+def _privada(respuesta):
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
+
+
+def producto(vista):
+    """Decorador para vistas con ``sku`` en la URL; los POST pasan directo."""
+    condicional = condition(etag_func=_etag, last_modified_func=_modificado)(vista)
+
+    if iscoroutinefunction(vista):
+        # ``condition`` llama a _etag/_modificado de forma síncrona: la fila y los
+        # mensajes se leen antes, fuera del event loop, y ahí ya quedan en caché.
+        @wraps(vista)
+        async def envoltura_async(request, sku, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await vista(request, sku, *args, **kwargs)
+            request._producto_condicional = (sku, await Producto.objects.filter(pk=sku).afirst())
+            await sync_to_async(_aplica)(request)
+            return _privada(await condicional(request, sku, *args, **kwargs))
+        return envoltura_async
+
+    @wraps(vista)
+    def envoltura(request, sku, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return vista(request, sku, *args, **kwargs)
+        return _privada(condicional(request, sku, *args, **kwargs))
+    return envoltura
+
+
+def lista(request, productos, generar):
+    """
+    Para una página de productos ya consultada: el ETag resume los SKUs y
+    versiones de la página (y la URL, que trae filtros y cursor). En un
+    acierto se ahorra todo el render.
+    """
+    if not _aplica(request):
+        return _privada(generar())
+    huella = hashlib.sha1(f'{ESQUEMA}|{_cliente(request)}|{request.get_full_path()}'.encode())
+    modificado = None
+    fraccionada = False
+    for p in productos:
+        # pz va en la huella: en un SKU fraccionado cambia sin subir la versión
+        # (la vista ya puso el exacto, ver fracciones.al_dia).
+        huella.update(f'|{p.sku}:{p.version}:{p.pz}'.encode())
+        modificado = p.modificado if modificado is None else max(modificado, p.modificado)
+        fraccionada = fraccionada or bool(p.fracciones)
+    etag = quote_etag(huella.hexdigest()[:32])
+    # Por la misma razón, con alguno fraccionado la fecha no sirve para el 304.
+    ultimo = int(modificado.timestamp()) if modificado and not fraccionada else None
+
+    respuesta = get_conditional_response(request, etag=etag, last_modified=ultimo)
+    if respuesta is None:
+        respuesta = generar()
+        respuesta.headers.setdefault('ETag', etag)
+        if ultimo is not None:
+            respuesta.headers.setdefault('Last-Modified', http_date(ultimo))
+    return _privada(respuesta)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Códigos QR y hojas de etiquetas generados en el servidor.
+
+Cada producto tiene dos QR: *info* (ficha del producto, para el estante) y
+*acción* (kiosco, para el escáner). Las imágenes PNG/SVG se guardan en disco
+en ``settings.ETIQUETAS_CACHE_DIR`` con una clave que incluye la URL, así un
+cambio de dominio genera archivos nuevos en lugar de servir QR viejos.
+
+Las hojas de etiquetas son un PDF escrito a mano: cada módulo del QR es un
+rectángulo vectorial, así no hace falta ``reportlab`` y la impresión sale
+nítida a cualquier escala. Las páginas se dibujan en paralelo en un
+``ProcessPoolExecutor`` (codificar QR es trabajo de CPU). El grupo se crea una
+vez por proceso web y lo comparten todas las peticiones: arrancar procesos en
+cada hoja costaría más que dibujarla, y varias hojas a la vez no multiplican
+los procesos. ``settings.ETIQUETAS_PROCESOS`` fija su tamaño.
+
+``segno`` se importa al generar el primer QR, no al cargar el módulo.
+"""
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.urls import reverse
+
+# tipo -> (texto de la etiqueta, nombre de la URL)
+TIPOS_QR = {
+    'info': ('ESTANTE', 'app:detalle_producto'),
+    'accion': ('ACCIÓN', 'app:kiosco_movimiento'),
+}
+FORMATOS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+ESCALA = 8          # píxeles por módulo en PNG/SVG
+BORDE = 2           # módulos de margen blanco
+MAX_ETIQUETAS = 2000
+PAGINAS_POR_PROCESO = 4
+
+# Hoja carta (puntos PDF: 1/72 de pulgada), 3 x 7 etiquetas con margen de 1/2"
+ANCHO_HOJA, ALTO_HOJA = 612, 792
+MARGEN = 36
+COLUMNAS, FILAS = 3, 7
+
+
+def _qr(url):
+    import segno
+    return segno.make(url, error='m')
+
+
+def url_qr(base, sku, tipo):
+    """URL absoluta que codifica el QR; ``base`` es p. ej. ``https://host``."""
+    return base.rstrip('/') + reverse(TIPOS_QR[tipo][1], args=[sku])
+
+
+# --- Imágenes individuales (caché en disco) ---
+
+def _carpeta_cache():
+    return getattr(settings, 'ETIQUETAS_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'qr'))
+
+
+def _ruta_cache(url, sku, tipo, formato):
+    huella = hashlib.sha256(f'{url}|{ESCALA}|{BORDE}'.encode()).hexdigest()[:16]
+    seguro = re.sub(r'[^A-Za-z0-9_.-]', '_', sku)
+    return os.path.join(_carpeta_cache(), f'{seguro}-{tipo}-{huella}.{formato}')
+
+
+def imagen_qr(url, sku, tipo, formato='png'):
+    """Devuelve la ruta del archivo PNG/SVG del QR, generándolo si no existe."""
+    ruta = _ruta_cache(url, sku, tipo, formato)
+    if not os.path.exists(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Se escribe a un temporal y se renombra: otra petición nunca lee un archivo a medias.
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as archivo:
+                _qr(url).save(archivo, kind=formato, scale=ESCALA, border=BORDE)
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.remove(temporal)
+            raise
+    return ruta
+
+
+# --- Hoja de etiquetas en PDF ---
+
+def _texto_pdf(texto, limite=None):
+    texto = str(texto)
+    if limite and len(texto) > limite:
+        texto = texto[:limite - 1] + '…'
+    datos = texto.encode('cp1252', 'replace')
+    return datos.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _dibujar_pagina(etiquetas):
+    """
+    Dibuja una página (lista de ``(texto_tipo, nombre, sku, url)``) y
+    devuelve su content stream. No toca la base de datos: corre en otro proceso.
+    """
+    ancho = (ANCHO_HOJA - 2 * MARGEN) / COLUMNAS
+    alto = (ALTO_HOJA - 2 * MARGEN) / FILAS
+    lado_qr = alto - 12
+    partes = []
+    for indice, (texto_tipo, nombre, sku, url) in enumerate(etiquetas):
+        fila, columna = divmod(indice, COLUMNAS)
+        x = MARGEN + columna * ancho
+        y = ALTO_HOJA - MARGEN - (fila + 1) * alto
+
+        # Contorno de corte
+        partes.append(b'0.8 G 0.5 w %.2f %.2f %.2f %.2f re S 0 G' % (x + 2, y + 2, ancho - 4, alto - 4))
+
+        # QR: un rectángulo por cada tramo horizontal de módulos oscuros
+        matriz = _qr(url).matrix
+        modulo = lado_qr / (len(matriz) + 2 * BORDE)
+        qx, qy = x + 6, y + 6
+        rectangulos = []
+        for r, renglon in enumerate(matriz):
+            fy = qy + lado_qr - (r + BORDE + 1) * modulo
+            c = 0
+            while c < len(renglon):
+                if renglon[c]:
+                    inicio = c
+                    while c < len(renglon) and renglon[c]:
+                        c += 1
+                    rectangulos.append(b'%.2f %.2f %.2f %.2f re' % (
+                        qx + (inicio + BORDE) * modulo, fy, (c - inicio) * modulo, modulo))
+                else:
+                    c += 1
+        partes.append(b'\n'.join(rectangulos) + b' f')
+
+        # Textos a la derecha del QR
+        tx = qx + lado_qr + 4
+        partes.append(b'BT /F2 7 Tf %.2f %.2f Td (%s) Tj ET' % (tx, y + alto - 18, _texto_pdf(texto_tipo)))
+        partes.append(b'BT /F2 10 Tf %.2f %.2f Td (%s) Tj ET' % (tx, y + alto - 32, _texto_pdf(nombre, 16)))
+        partes.append(b'BT /F1 9 Tf %.2f %.2f Td (SKU: %s) Tj ET' % (tx, y + 14, _texto_pdf(sku, 18)))
+    return b'\n'.join(partes)
+
+
+def _armar_pdf(contenidos):
+    """Une los content streams en un PDF de una página por stream."""
+    objetos = []
+
+    def agregar(cuerpo):
+        objetos.append(cuerpo)
+        return len(objetos)
+
+    catalogo = agregar(None)
+    paginas = agregar(None)
+    fuente = agregar(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    negrita = agregar(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+    hijos = []
+    for contenido in contenidos:
+        comprimido = zlib.compress(contenido)
+        flujo = agregar(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(comprimido), comprimido))
+        hijos.append(agregar(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>'
+            % (paginas, ANCHO_HOJA, ALTO_HOJA, fuente, negrita, flujo)
+        ))
+    objetos[catalogo - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % paginas
+    objetos[paginas - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % h for h in hijos), len(hijos))
+
+    salida = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    posiciones = []
+    for numero, cuerpo in enumerate(objetos, 1):
+        posiciones.append(len(salida))
+        salida += b'%d 0 obj\n%s\nendobj\n' % (numero, cuerpo)
+    inicio_xref = len(salida)
+    salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+    for posicion in posiciones:
+        salida += b'%010d 00000 n \n' % posicion
+    salida += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objetos) + 1, catalogo, inicio_xref)
+    return bytes(salida)
+
+
+_grupos = {}
+_candado = threading.Lock()
+
+
+def _grupo(procesos):
+    # Un grupo por tamaño y proceso web, creado en el primer uso (después del fork de gunicorn).
+    # Los hijos arrancan con 'spawn': hacer fork de un worker con hilos (ASGI, hilos de
+    # gunicorn) puede copiar un candado tomado y colgar al hijo.
+    with _candado:
+        grupo = _grupos.get(procesos)
+        if grupo is None:
+            grupo = _grupos[procesos] = ProcessPoolExecutor(
+                max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+            )
+        return grupo
+
+
+def _dibujar_en_grupo(paginas, procesos):
+    grupo = _grupo(procesos)
+    try:
+        return list(grupo.map(_dibujar_pagina, paginas, chunksize=PAGINAS_POR_PROCESO))
+    except BrokenProcessPool:
+        # Un proceso hijo murió (p. ej. sin memoria): ese grupo ya no sirve; la
+        # siguiente hoja crea otro.
+        with _candado:
+            if _grupos.get(procesos) is grupo:
+                del _grupos[procesos]
+        raise
+
+
+def hoja_etiquetas(productos, base, tipos=('info',), procesos=None):
+    """
+    PDF con una etiqueta por producto y tipo de QR. ``productos`` son
+    instancias (o cualquier objeto con ``sku`` y ``nombre_tela``).
+    """
+    etiquetas = [
+        (TIPOS_QR[tipo][0], producto.nombre_tela, producto.sku, url_qr(base, producto.sku, tipo))
+        for producto in productos
+        for tipo in tipos
+    ]
+    por_pagina = COLUMNAS * FILAS
+    paginas = [etiquetas[i:i + por_pagina] for i in range(0, len(etiquetas), por_pagina)] or [[]]
+
+    procesos = procesos or getattr(settings, 'ETIQUETAS_PROCESOS', os.cpu_count() or 1)
+    if procesos > 1 and len(paginas) > 1:
+        contenidos = _dibujar_en_grupo(paginas, procesos)
+    else:
+        contenidos = [_dibujar_pagina(pagina) for pagina in paginas]
+    return _armar_pdf(contenidos)
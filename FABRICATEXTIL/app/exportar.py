@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación en streaming (CSV y XLSX) del historial y del stock.
+
+Las filas salen de ``.iterator(chunk_size=...)`` y se escriben al cliente a
+medida que se generan, así la memoria del worker no crece con el número de
+filas. El XLSX se arma a mano (es un ZIP con XML) escribiendo el ZIP sobre un
+buffer que se vacía en cada trozo; no hace falta ``openpyxl``.
+"""
+import csv
+import re
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import Q
+from django.utils import timezone
+
+from . import archivo, fracciones
+from .models import Producto
+
+TAMANO_TROZO = 2000
+# Límite de filas por hoja de Excel (incluye el encabezado).
+MAX_FILAS_HOJA = 1048576
+
+ENCABEZADOS_MOVIMIENTOS = [
+    'ID', 'Fecha', 'SKU', 'Tela', 'Tipo', 'Cantidad', 'Usuario', 'Notas',
+]
+ENCABEZADOS_STOCK = [
+    'SKU', 'Tela', 'Tipo', 'Color', 'Composición', 'Largo (m)', 'Ancho (m)',
+    'Peso por Pieza (kg)', 'Ubicación', 'Piezas',
+]
+COLUMNAS_STOCK = [
+    'sku', 'nombre_tela', 'tipo', 'color', 'composicion',
+    'largo', 'ancho', 'peso_por_pieza', 'ubicacion', 'pz',
+]
+
+_CARACTERES_INVALIDOS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# --- Consultas ---
+
+def filtrar_movimientos(parametros):
+    """
+    Aplica los filtros de la URL (``fecha_inicio``, ``fecha_fin``, ``sku``,
+    ``usuario``, ``tipo``) al historial. Los filtros inválidos se ignoran.
+    Devuelve la lista de querysets de ``archivo.historial``: el archivo solo
+    se incluye si ``fecha_inicio`` llega hasta él.
+    """
+    filtro = Q()
+    inicio = None
+    try:
+        if parametros.get('fecha_inicio'):
+            inicio = timezone.make_aware(datetime.strptime(parametros['fecha_inicio'], '%Y-%m-%d'))
+            filtro &= Q(fecha__gte=inicio)
+        if parametros.get('fecha_fin'):
+            fin = datetime.strptime(parametros['fecha_fin'], '%Y-%m-%d') + timedelta(days=1)
+            filtro &= Q(fecha__lt=timezone.make_aware(fin))
+    except ValueError:
+        pass
+
+    if parametros.get('sku'):
+        filtro &= Q(producto_id=parametros['sku'])
+    if parametros.get('usuario'):
+        filtro &= Q(usuario__username=parametros['usuario'])
+    tipo = (parametros.get('tipo') or '').upper()
+    if tipo in ('ENTRADA', 'SALIDA'):
+        filtro &= Q(tipo_movimiento=tipo)
+    return archivo.historial(filtro, desde=inicio)
+
+
+def filas_movimientos(movimientos):
+    """Filas del más antiguo al más reciente; ``movimientos`` es un queryset o una lista de ellos."""
+    querysets = movimientos if isinstance(movimientos, (list, tuple)) else [movimientos]
+    for queryset in reversed(querysets):
+        yield from _filas_movimientos(queryset)
+
+
+def _filas_movimientos(movimientos):
+    movimientos = (
+        movimientos.select_related('producto', 'usuario')
+        .only(
+            'fecha', 'tipo_movimiento', 'cantidad', 'notas',
+            'producto__sku', 'producto__nombre_tela', 'usuario__username',
+        )
+        .order_by('fecha', 'id')
+    )
+    for mov in movimientos.iterator(chunk_size=TAMANO_TROZO):
+        yield [
+            mov.pk,
+            timezone.localtime(mov.fecha).strftime('%Y-%m-%d %H:%M:%S'),
+            mov.producto_id,
+            mov.producto.nombre_tela,
+            mov.tipo_movimiento,
+            mov.cantidad,
+            mov.usuario.username if mov.usuario else '',
+            mov.notas or '',
+        ]
+
+
+def filas_stock():
+    # Piezas exactas: en un SKU fraccionado pz es la suma del último pliegue.
+    productos = (
+        Producto.objects.annotate(pz_real=fracciones.stock_real())
+        .order_by('nombre_tela', 'sku').values_list(*COLUMNAS_STOCK[:-1], 'pz_real')
+    )
+    for fila in productos.iterator(chunk_size=TAMANO_TROZO):
+        yield [valor if valor is not None else '' for valor in fila]
+
+
+# --- CSV ---
+
+class _Eco:
+    """Objeto tipo archivo cuyo ``write`` devuelve lo escrito (para ``csv.writer``)."""
+
+    def write(self, valor):
+        return valor
+
+
+def _celda_csv(valor):
+    # Evita que Excel interprete notas como fórmulas (=, +, -, @).
+    if isinstance(valor, str) and valor[:1] in ('=', '+', '-', '@'):
+        return "'" + valor
+    return valor
+
+
+def csv_streaming(encabezados, filas):
+    escritor = csv.writer(_Eco())
+    # BOM para que Excel abra el archivo como UTF-8.
+    yield '\ufeff' + escritor.writerow(encabezados)
+    for fila in filas:
+        yield escritor.writerow([_celda_csv(v) for v in fila])
+
+
+# --- XLSX ---
+
+class _BufferZip:
+    """Destino no buscable para ``ZipFile``: acumula bytes hasta que se vacían."""
+
+    def __init__(self):
+        self.trozos = []
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.trozos)
+        self.trozos = []
+        return datos
+
+
+def _columna(indice):
+    letras = ''
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _fila_xml(numero, valores):
+    celdas = []
+    for i, valor in enumerate(valores):
+        ref = f'{_columna(i)}{numero}'
+        if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+            celdas.append(f'<c r="{ref}"><v>{valor}</v></c>')
+        else:
+            texto = escape(_CARACTERES_INVALIDOS.sub('', str(valor)))
+            celdas.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>')
+    return f'<row r="{numero}">{"".join(celdas)}</row>'
+
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+
+def _archivos_fijos(hojas):
+    tipos = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/'
+        f'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(hojas) + 1)
+    )
+    hojas_xml = ''.join(
+        f'<sheet name="{escape(nombre)}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, nombre in enumerate(hojas, 1)
+    )
+    relaciones = ''.join(
+        f'<Relationship Id="rId{i}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(hojas) + 1)
+    )
+    return {
+        '[Content_Types].xml': (
+            f'{_XML}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            f'{tipos}</Types>'
+        ),
+        '_rels/.rels': (
+            f'{_XML}<Relationships xmlns="{_NS_PKG}">'
+            f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/workbook.xml': (
+            f'{_XML}<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}">'
+            f'<sheets>{hojas_xml}</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            f'{_XML}<Relationships xmlns="{_NS_PKG}">{relaciones}</Relationships>'
+        ),
+    }
+
+
+def xlsx_streaming(encabezados, filas, nombre_hoja='Hoja', max_filas=MAX_FILAS_HOJA):
+    """
+    Genera un XLSX trozo a trozo. Si las filas no caben en una hoja se abren
+    más (``Hoja (2)``, ...); el libro y sus relaciones se escriben al final,
+    cuando ya se sabe cuántas hojas hubo.
+    """
+    buffer = _BufferZip()
+    libro = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED)
+    hojas = []
+    hoja = None
+    numero = 0
+    pendientes = []
+
+    def cerrar_hoja():
+        hoja.write(''.join(pendientes).encode())
+        hoja.write(b'</sheetData></worksheet>')
+        hoja.close()
+
+    for fila in filas:
+        if hoja is None or numero >= max_filas:
+            if hoja is not None:
+                cerrar_hoja()
+                pendientes = []
+            hojas.append(nombre_hoja if not hojas else f'{nombre_hoja} ({len(hojas) + 1})')
+            hoja = libro.open(f'xl/worksheets/sheet{len(hojas)}.xml', 'w')
+            hoja.write(f'{_XML}<worksheet xmlns="{_NS_MAIN}"><sheetData>'.encode())
+            hoja.write(_fila_xml(1, encabezados).encode())
+            numero = 1
+        numero += 1
+        pendientes.append(_fila_xml(numero, fila))
+        if len(pendientes) >= TAMANO_TROZO:
+            hoja.write(''.join(pendientes).encode())
+            pendientes = []
+            datos = buffer.vaciar()
+            if datos:
+                yield datos
+
+    if hoja is None:
+        # Sin filas: una hoja con solo el encabezado.
+        hojas.append(nombre_hoja)
+        hoja = libro.open('xl/worksheets/sheet1.xml', 'w')
+        hoja.write(f'{_XML}<worksheet xmlns="{_NS_MAIN}"><sheetData>'.encode())
+        hoja.write(_fila_xml(1, encabezados).encode())
+    cerrar_hoja()
+
+    for nombre, contenido in _archivos_fijos(hojas).items():
+        libro.writestr(nombre, contenido)
+    libro.close()
+    yield buffer.vaciar()
@@ -21,11 +21,15 @@ class BootstrapAuthenticationForm(AuthenticationForm):
 # --- Formularios de Inventario (AÑADIDOS) ---
 
 class ProductoForm(forms.ModelForm):
+    # Al editar: el pz que se mostró. Solo si el usuario lo cambió se ajusta el
+    # stock; un escaneo mientras el formulario estaba abierto no se pisa.
+    pz_mostrado = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Producto
         fields = [
             'sku', 'nombre_tela', 'tipo', 'composicion', 'color', 
-            'largo', 'ancho', 'pz', 
+            'largo', 'ancho', 'pz', 'stock_minimo',
             'peso_por_pieza', 'peso_aprox', 
             'paquete_pz', 'paquetes_bulto', 'bulto_pz',  # <-- NUEVOS
             'ubicacion', 'descripcion'
@@ -41,6 +45,7 @@ class ProductoForm(forms.ModelForm):
             'largo': forms.NumberInput(attrs={'class': 'form-control'}),
             'ancho': forms.NumberInput(attrs={'class': 'form-control'}),
             'pz': forms.NumberInput(attrs={'class': 'form-control'}),
+            'stock_minimo': forms.NumberInput(attrs={'class': 'form-control'}),
             'peso_por_pieza': forms.NumberInput(attrs={'class': 'form-control'}),
             'peso_aprox': forms.NumberInput(attrs={'class': 'form-control'}),
             
@@ -73,4 +78,26 @@ class AjustarStockForm(forms.Form):
         required=True,
         min_value=0, # No se puede tener stock negativo
         widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Ej: 50'})
-    )
\ No newline at end of file
+    )
+
+class ImportarCatalogoForm(forms.Form):
+    """Carga masiva del catálogo desde el admin."""
+    archivo = forms.FileField(
+        label="Archivo CSV o XLSX",
+        help_text="Primera fila con encabezados; se requiere la columna SKU.",
+    )
+    simular = forms.BooleanField(
+        label="Solo simular (no guarda nada)",
+        required=False,
+        initial=True,
+    )
+    stock_inicial = forms.BooleanField(
+        label="Registrar el stock de los SKUs nuevos como movimiento de entrada",
+        required=False,
+    )
+
+    def clean_archivo(self):
+        archivo = self.cleaned_data['archivo']
+        if not archivo.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Solo se aceptan archivos .csv o .xlsx.")
+        return archivo
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Contador de stock fraccionado para los SKUs más escaneados.
+
+Con ``Producto.fracciones = N`` el stock de un SKU vive en N filas de
+``FraccionStock``, cada una con su parte (nunca negativa). Una entrada suma a
+una fracción al azar y una salida descuenta de la primera fracción que
+alcance, empezando también al azar (``mover``): escaneos simultáneos del
+mismo SKU caen en filas distintas en vez de hacer fila en el candado de una
+sola. Si ninguna fracción alcanza sola, el servicio de stock las bloquea
+todas (``bloquear``) y reparte la salida entre varias; el total nunca queda
+negativo.
+
+``Producto.pz`` pasa a ser la suma en caché: ``plegar`` (``manage.py
+plegar_fracciones``, periódico) la pone al día junto con la marca de stock
+bajo, el sello de versión, los KPIs y los avisos de umbral, y de paso vuelve
+a repartir las piezas parejo entre las fracciones. El stock exacto es
+``total`` (o ``stock_real()`` en una consulta); las vistas y la exportación
+muestran ese, no el ``pz`` del último pliegue (``al_dia``). Como la versión tampoco sube con cada
+movimiento, la ficha de un SKU fraccionado no responde 304 ni guarda su
+actividad en caché (ver ``app/condicional.py``).
+
+Con SQLite todo escritor toma el candado de la base entera, así que aquí el
+fraccionado no gana nada; sirve con el perfil ``postgres``.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from . import alertas, kpis
+from .models import FraccionStock, Producto, nueva_version
+
+
+def total(sku):
+    """Stock exacto de un SKU fraccionado: la suma de sus fracciones."""
+    return FraccionStock.objects.filter(producto_id=sku).aggregate(total=Sum('pz'))['total'] or 0
+
+
+def stock_real():
+    """Expresión SQL con el stock exacto: ``pz`` o, si está fraccionado, la suma de sus fracciones."""
+    suma = Subquery(
+        FraccionStock.objects.filter(producto=OuterRef('pk'))
+        .order_by().values('producto').annotate(total=Sum('pz')).values('total')
+    )
+    return Case(
+        When(fracciones__gt=0, then=Coalesce(suma, Value(0))),
+        default=F('pz'), output_field=IntegerField(),
+    )
+
+
+def al_dia(productos):
+    """
+    Pone en ``pz`` de los productos fraccionados su stock exacto, con una
+    sola consulta (ninguna si no hay fraccionados). Solo para mostrar: esas
+    instancias no se deben guardar.
+    """
+    fraccionados = {p.pk: p for p in productos if p.fracciones}
+    if fraccionados:
+        sumas = dict(
+            FraccionStock.objects.filter(producto_id__in=fraccionados).order_by()
+            .values('producto').annotate(total=Sum('pz')).values_list('producto', 'total')
+        )
+        for sku, producto in fraccionados.items():
+            producto.pz = sumas.get(sku, 0)
+    return productos
+
+
+# --- Movimientos (dentro de la transacción del servicio de stock) ---
+
+def mover(sku, tipo_movimiento, cantidad, fracciones):
+    """
+    Aplica el movimiento en una sola fracción, sin bloquear las demás.
+    Devuelve ``False`` si ninguna alcanzó (o ya no existen): el llamador
+    sigue con ``bloquear``.
+    """
+    filas = FraccionStock.objects.filter(producto_id=sku)
+    inicio = random.randrange(fracciones)
+    if tipo_movimiento == 'ENTRADA':
+        return bool(filas.filter(indice=inicio).update(pz=F('pz') + cantidad))
+    for paso in range(fracciones):
+        indice = (inicio + paso) % fracciones
+        if filas.filter(indice=indice, pz__gte=cantidad).update(pz=F('pz') - cantidad):
+            return True
+    return False
+
+
+def bloquear(sku):
+    """Las fracciones de ``sku`` bloqueadas hasta el commit, siempre en el mismo orden; ``[]`` si no tiene."""
+    return list(FraccionStock.objects.select_for_update().filter(producto_id=sku).order_by('indice'))
+
+
+def cambiar(partes, delta):
+    """
+    Suma ``delta`` a fracciones ya bloqueadas. Uno negativo se descuenta de
+    las más llenas primero; el llamador ya revisó que el total alcance.
+    """
+    if delta >= 0:
+        parte = min(partes, key=lambda p: p.pz)
+        parte.pz += delta
+        parte.save(update_fields=['pz'])
+        return
+    faltan = -delta
+    for parte in sorted(partes, key=lambda p: -p.pz):
+        quitar = min(parte.pz, faltan)
+        if quitar:
+            parte.pz -= quitar
+            parte.save(update_fields=['pz'])
+            faltan -= quitar
+        if not faltan:
+            break
+
+
+def _repartir(partes, pz):
+    base, resto = divmod(pz, len(partes))
+    for i, parte in enumerate(partes):
+        nuevo = base + (1 if i < resto else 0)
+        if parte.pz != nuevo:
+            parte.pz = nuevo
+            parte.save(update_fields=['pz'])
+
+
+def _guardar_suma(sku, pz):
+    # La suma en caché manda en KPIs y alertas del SKU: se parchan con lo que cambió desde el último pliegue.
+    anterior, minimo = (
+        alertas.con_minimo(Producto.objects.select_for_update().filter(pk=sku))
+        .values_list('pz', 'minimo').get()
+    )
+    if anterior == pz:
+        return False
+    Producto.objects.filter(pk=sku).update(pz=pz, bajo_minimo=alertas.bajo(pz), **nueva_version())
+    kpis.cambio_stock(sku, anterior, pz)
+    alertas.cambio_stock(sku, anterior, pz, minimo)
+    return True
+
+
+def fijar(sku, pz, si_era=None):
+    """
+    Lleva el stock de un SKU fraccionado a ``pz`` (ajuste manual,
+    conciliación) y actualiza la suma en caché. Con ``si_era`` solo cambia si
+    el total sigue siendo ése. Devuelve el total anterior, o ``None`` si el
+    SKU no está fraccionado. Debe llamarse dentro de una transacción.
+    """
+    partes = bloquear(sku)
+    if not partes:
+        return None
+    anterior = sum(parte.pz for parte in partes)
+    if anterior != pz and si_era in (None, anterior):
+        _repartir(partes, pz)
+        _guardar_suma(sku, pz)
+    return anterior
+
+
+# --- Pliegue y configuración ---
+
+def plegar(skus=None):
+    """
+    Pone al día ``Producto.pz`` de los SKUs fraccionados con la suma de sus
+    fracciones y las vuelve a emparejar. Cada SKU va en su propia transacción
+    para tener sus fracciones bloqueadas solo un momento. Devuelve cuántos
+    cambiaron de ``pz``.
+    """
+    productos = Producto.objects.filter(fracciones__gt=0)
+    if skus is not None:
+        productos = productos.filter(pk__in=skus)
+    cambiados = 0
+    for sku in productos.values_list('sku', flat=True):
+        with transaction.atomic():
+            partes = bloquear(sku)
+            if not partes:
+                continue
+            pz = sum(parte.pz for parte in partes)
+            _repartir(partes, pz)
+            cambiados += _guardar_suma(sku, pz)
+    return cambiados
+
+
+def configurar(sku, fracciones):
+    """
+    Activa (``fracciones`` > 0), cambia o quita (0) el contador fraccionado
+    de ``sku``. El stock se conserva: se junta y se reparte entre las
+    fracciones nuevas, o regresa a ``Producto.pz``. Devuelve el stock.
+    """
+    if fracciones < 0:
+        raise ValueError("El número de fracciones no puede ser negativo.")
+    with transaction.atomic():
+        pz, actuales = Producto.objects.select_for_update().values_list('pz', 'fracciones').get(pk=sku)
+        partes = bloquear(sku)
+        if actuales:
+            pz = sum(parte.pz for parte in partes)
+        FraccionStock.objects.filter(producto_id=sku).delete()
+        if fracciones:
+            partes = [FraccionStock(producto_id=sku, indice=i) for i in range(fracciones)]
+            base, resto = divmod(pz, fracciones)
+            for i, parte in enumerate(partes):
+                parte.pz = base + (1 if i < resto else 0)
+            FraccionStock.objects.bulk_create(partes)
+        Producto.objects.filter(pk=sku).update(fracciones=fracciones, **nueva_version())
+        _guardar_suma(sku, pz)
+    return pz
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Stock en el tiempo: series por SKU, tipo o ubicación, por día, semana o mes.
+
+El stock al abrir el rango sale del libro con ``conciliacion.con_esperado``
+(punto de control + movimientos posteriores, una sola consulta) y la
+variación neta de cada día del resumen diario (``MovimientoDiario``, otra
+consulta agrupada por día y grupo). Cada serie es la suma acumulada de un
+arreglo de variaciones diarias (``itertools.accumulate``) y cada periodo toma
+el stock al cierre de su último día. Nunca se consulta día por día.
+
+Los movimientos llevan siempre la fecha en que se registran, así que un
+periodo cerrado ya no cambia: esa parte se guarda en caché y las siguientes
+peticiones solo calculan el periodo en curso a partir del último valor
+cerrado (una consulta al resumen de esos días). Se deja un día de margen
+porque la réplica de reportes puede venir atrasada unos minutos.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+
+from . import conciliacion
+from .models import MovimientoDiario, Producto
+
+AGRUPACIONES = ('sku', 'tipo', 'ubicacion')
+GRANULARIDADES = ('dia', 'semana', 'mes')
+MAX_SERIES = 100
+MAX_PERIODOS = 1000
+# Súbelo si cambia la forma de los valores guardados.
+ESQUEMA = 1
+TTL_CERRADOS = 6 * 3600
+
+_NETO = Sum(Case(
+    When(tipo_movimiento='ENTRADA', then=F('cantidad')),
+    default=-F('cantidad'),
+    output_field=IntegerField(),
+))
+
+
+def periodos(desde, hasta, granularidad):
+    """``[(inicio, fin), ...]`` entre ``desde`` y ``hasta``; semanas de lunes a domingo."""
+    resultado = []
+    inicio = desde
+    while inicio <= hasta:
+        if granularidad == 'dia':
+            siguiente = inicio + timedelta(days=1)
+        elif granularidad == 'semana':
+            siguiente = inicio + timedelta(days=7 - inicio.weekday())
+        else:
+            siguiente = (inicio.replace(day=1) + timedelta(days=32)).replace(day=1)
+        resultado.append((inicio, min(siguiente - timedelta(days=1), hasta)))
+        inicio = siguiente
+    return resultado
+
+
+def _bases(campo, seleccion, dia):
+    # Stock por grupo según el libro justo antes de ``dia`` (local).
+    corte = timezone.make_aware(datetime.combine(dia, time.min)) - timedelta(microseconds=1)
+    bases = defaultdict(int)
+    filas = conciliacion.con_esperado(Producto.objects.filter(**seleccion), fecha=corte)
+    for clave, pz in filas.values_list(campo, 'esperado').iterator():
+        bases[clave] += pz
+    return bases
+
+
+def _variaciones(campo, seleccion, desde, hasta):
+    # {grupo: {dia: neto}}; por SKU no hace falta unir con la tabla de productos.
+    columna = 'producto_id' if campo == 'sku' else f'producto__{campo}'
+    filas = (
+        MovimientoDiario.objects
+        .filter(dia__range=(desde, hasta), **{f'producto__{k}': v for k, v in seleccion.items()})
+        .order_by().values_list('dia', columna).annotate(neto=_NETO)
+    )
+    variaciones = defaultdict(dict)
+    for dia, clave, neto in filas.iterator():
+        variaciones[clave][dia] = neto
+    return variaciones
+
+
+def _acumular(bases, variaciones, lista):
+    desde = lista[0][0]
+    netos_vacios = [0] * ((lista[-1][1] - desde).days + 1)
+    cortes = [(fin - desde).days for _, fin in lista]
+    series = {}
+    for clave in set(bases) | set(variaciones):
+        netos = list(netos_vacios)
+        for dia, neto in variaciones.get(clave, {}).items():
+            netos[(dia - desde).days] = neto
+        netos[0] += bases.get(clave, 0)
+        stock = list(accumulate(netos))
+        series[clave] = [stock[i] for i in cortes]
+    return series
+
+
+def _clave_cache(agrupar, granularidad, cerrados, seleccion):
+    filtros = sorted(
+        (campo, sorted(valor) if isinstance(valor, (list, tuple, set)) else valor)
+        for campo, valor in seleccion.items()
+    )
+    huella = hashlib.sha1(repr((agrupar, granularidad, cerrados[0], cerrados[-1], filtros)).encode())
+    return f'historial:{ESQUEMA}:{huella.hexdigest()}'
+
+
+def serie(agrupar='sku', granularidad='dia', desde=None, hasta=None, **seleccion):
+    """
+    Stock al cierre de cada periodo entre ``desde`` y ``hasta`` (días locales,
+    inclusivos; por omisión el último año). ``seleccion`` son filtros de
+    ``Producto`` (``sku__in``, ``tipo``, ``ubicacion``). Devuelve
+    ``(periodos, {grupo: [pz, ...]})``; lanza ``ValueError`` con parámetros
+    inválidos.
+    """
+    if agrupar not in AGRUPACIONES:
+        raise ValueError(f"agrupar debe ser {', '.join(AGRUPACIONES)}")
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f"granularidad debe ser {', '.join(GRANULARIDADES)}")
+    hoy = timezone.localdate()
+    hasta = min(hasta or hoy, hoy)
+    desde = desde or hasta - timedelta(days=364)
+    if desde > hasta:
+        raise ValueError("desde debe ser anterior a hasta")
+    lista = periodos(desde, hasta, granularidad)
+    if len(lista) > MAX_PERIODOS:
+        raise ValueError(f"Máximo {MAX_PERIODOS} periodos; usa una granularidad mayor")
+
+    cerrados = [p for p in lista if p[1] < hoy - timedelta(days=1)]
+    abiertos = lista[len(cerrados):]
+    clave = _clave_cache(agrupar, granularidad, cerrados, seleccion) if cerrados else None
+    guardadas = cache.get(clave) if clave else None
+
+    if guardadas is None:
+        series = _acumular(
+            _bases(agrupar, seleccion, desde), _variaciones(agrupar, seleccion, desde, hasta), lista,
+        )
+        if clave:
+            cache.set(clave, {g: valores[:len(cerrados)] for g, valores in series.items()}, TTL_CERRADOS)
+    elif abiertos:
+        ultimos = {g: valores[-1] for g, valores in guardadas.items()}
+        resto = _acumular(ultimos, _variaciones(agrupar, seleccion, abiertos[0][0], hasta), abiertos)
+        series = {g: guardadas.get(g, [0] * len(cerrados)) + valores for g, valores in resto.items()}
+    else:
+        series = guardadas
+    return lista, series
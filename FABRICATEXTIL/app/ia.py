@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Generación de texto con IA (descripciones de producto).
+
+El proveedor se elige con ``settings.IA_CLIENTE``: un nombre registrado
+(``'gemini'``, ``'falso'``) o la ruta a una clase con ``generar(prompt)`` y
+atributo ``modelo``. Los SDK se importan al crear el primer cliente, no al
+cargar este módulo: el de Gemini arrastra grpc/protobuf (~0.8 s) y solo lo
+necesita el trabajador. Si el SDK no está instalado se lanza
+``ProveedorNoDisponible`` en ese momento, no al arrancar.
+
+Las respuestas se guardan en ``RespuestaIA`` por hash de (modelo, prompt);
+al pasar de ``settings.IA_CACHE_MAX`` entradas se borran las de uso más
+antiguo.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import RespuestaIA
+
+PROVEEDOR_POR_DEFECTO = 'gemini'
+CACHE_MAX = 2000
+
+
+class ProveedorNoDisponible(Exception):
+    """El SDK del proveedor configurado no está instalado o no se pudo cargar."""
+
+
+class ClienteGemini:
+    @classmethod
+    def modelo_configurado(cls):
+        return getattr(settings, 'IA_MODELO', 'gemini-pro')
+
+    def __init__(self, modelo=None):
+        try:
+            import google.generativeai as genai
+        except ImportError as e:
+            raise ProveedorNoDisponible(
+                "Falta el paquete google-generativeai para usar Gemini"
+            ) from e
+        self.modelo = modelo or self.modelo_configurado()
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self._modelo = genai.GenerativeModel(self.modelo)
+
+    def generar(self, prompt):
+        return self._modelo.generate_content(prompt).text
+
+
+class ClienteFalso:
+    """Modelo local determinista, sin red. Para pruebas y desarrollo."""
+
+    @classmethod
+    def modelo_configurado(cls):
+        return 'falso'
+
+    def __init__(self, modelo=None):
+        self.modelo = modelo or self.modelo_configurado()
+        self.llamadas = 0
+
+    def generar(self, prompt):
+        self.llamadas += 1
+        return f"Descripción generada para: {prompt.splitlines()[-1]}"
+
+
+# --- Registro de proveedores ---
+
+_proveedores = {}
+_clientes = {}
+
+
+def registrar_proveedor(nombre, ruta):
+    """Asocia ``nombre`` con la ruta de su clase (no se importa hasta usarla)."""
+    _proveedores[nombre] = ruta
+
+
+registrar_proveedor('gemini', 'app.ia.ClienteGemini')
+registrar_proveedor('falso', 'app.ia.ClienteFalso')
+
+
+def clase_cliente():
+    nombre = getattr(settings, 'IA_CLIENTE', PROVEEDOR_POR_DEFECTO)
+    return import_string(_proveedores.get(nombre, nombre))
+
+
+def modelo_actual():
+    """Nombre del modelo configurado, sin crear el cliente (ni cargar su SDK)."""
+    return clase_cliente().modelo_configurado()
+
+
+def obtener_cliente():
+    """Una instancia por clase configurada y proceso (se reutiliza entre llamadas)."""
+    clase = clase_cliente()
+    if clase not in _clientes:
+        _clientes[clase] = clase()
+    return _clientes[clase]
+
+
+def _hash(modelo, prompt):
+    return hashlib.sha256(f'{modelo}\n{prompt}'.encode()).hexdigest()
+
+
+# --- Caché LRU en base de datos ---
+
+def respuesta_guardada(prompt, modelo=None):
+    """Devuelve la respuesta en caché (y la marca como usada) o ``None``."""
+    clave = _hash(modelo or modelo_actual(), prompt)
+    respuesta = RespuestaIA.objects.filter(pk=clave).values_list('respuesta', flat=True).first()
+    if respuesta is not None:
+        RespuestaIA.objects.filter(pk=clave).update(
+            ultimo_uso=timezone.now(), aciertos=F('aciertos') + 1
+        )
+    return respuesta
+
+
+async def arespuesta_guardada(prompt, modelo=None):
+    """``respuesta_guardada`` con el ORM asíncrono (vistas async)."""
+    clave = _hash(modelo or modelo_actual(), prompt)
+    respuesta = await RespuestaIA.objects.filter(pk=clave).values_list('respuesta', flat=True).afirst()
+    if respuesta is not None:
+        await RespuestaIA.objects.filter(pk=clave).aupdate(
+            ultimo_uso=timezone.now(), aciertos=F('aciertos') + 1
+        )
+    return respuesta
+
+
+def _guardar(clave, modelo, respuesta):
+    try:
+        RespuestaIA.objects.create(clave=clave, modelo=modelo, respuesta=respuesta)
+    except IntegrityError:
+        # Otro proceso la guardó primero; es la misma respuesta.
+        return
+    limite = getattr(settings, 'IA_CACHE_MAX', CACHE_MAX)
+    sobrantes = RespuestaIA.objects.count() - limite
+    if sobrantes > 0:
+        viejas = RespuestaIA.objects.order_by('ultimo_uso').values_list('pk', flat=True)[:sobrantes]
+        RespuestaIA.objects.filter(pk__in=list(viejas)).delete()
+
+
+def generar(prompt, cliente=None):
+    """Respuesta del modelo para ``prompt``, desde el caché si ya se pidió antes."""
+    cliente = cliente or obtener_cliente()
+    respuesta = respuesta_guardada(prompt, cliente.modelo)
+    if respuesta is None:
+        respuesta = cliente.generar(prompt)
+        _guardar(_hash(cliente.modelo, prompt), cliente.modelo, respuesta)
+    return respuesta
+
+
+# --- Prompts ---
+
+def prompt_descripcion(producto):
+    datos = [
+        f"Tipo: {producto.tipo}",
+        f"Composición: {producto.composicion}" if producto.composicion else None,
+        f"Color: {producto.color}" if producto.color else None,
+        f"Ancho: {producto.ancho} m" if producto.ancho else None,
+    ]
+    return (
+        "Escribe una descripción comercial breve (máximo 60 palabras) en español "
+        "para este artículo de una fábrica textil.\n"
+        + "\n".join(d for d in datos if d)
+        + f"\n{producto.nombre_tela}"
+    )
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Importación masiva del catálogo de ``Producto`` desde CSV o XLSX.
+
+El archivo se lee fila a fila y se procesa en lotes: por cada lote se traen
+los SKUs existentes con una consulta, se valida cada fila con
+``full_clean`` (sin consultas de unicidad) y se hace un solo upsert
+``bulk_create(update_conflicts=True)`` con las filas nuevas o cambiadas.
+
+El stock (``pz``) de un producto existente no se toca: solo cambia con
+movimientos. Para los SKUs nuevos, ``pz`` es el stock inicial y, si se pide,
+se registra como ``MovimientoInventario`` de ENTRADA. En modo de prueba
+(``simular=True``) se calcula todo el diff sin escribir nada.
+"""
+import csv
+import io
+import unicodedata
+import zipfile
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import alertas, exportar, kpis, resumenes
+from .models import MovimientoInventario, Producto, nueva_version
+
+TAMANO_LOTE = 1000
+NOTA_STOCK_INICIAL = 'Stock inicial (importación de catálogo)'
+
+# Campos que la importación puede escribir (todos menos el stock y los calculados).
+CAMPOS_DESCRIPTIVOS = [
+    f.name for f in Producto._meta.concrete_fields if f.editable and f.name not in ('sku', 'pz')
+]
+
+
+class ResultadoImportacion:
+    """Conteos y detalle de lo que hizo (o haría) una importación."""
+
+    def __init__(self, simulado):
+        self.simulado = simulado
+        self.insertados = 0
+        self.actualizados = 0
+        self.sin_cambios = 0
+        self.movimientos = 0
+        self.errores = []      # (línea, mensaje)
+        self.conflictos = []   # (línea, sku, motivo)
+
+    def resumen(self):
+        prefijo = '[SIMULACIÓN] ' if self.simulado else ''
+        return (
+            f'{prefijo}{self.insertados} nuevos, {self.actualizados} actualizados, '
+            f'{self.sin_cambios} sin cambios, {len(self.conflictos)} conflictos, '
+            f'{len(self.errores)} errores, {self.movimientos} movimientos de stock inicial'
+        )
+
+
+# --- Lectura de archivos ---
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(texto.lower().replace('_', ' ').split())
+
+
+def _alias_columnas():
+    """Acepta el nombre del campo, su ``verbose_name`` y los encabezados de la exportación."""
+    alias = {}
+    for campo in Producto._meta.concrete_fields:
+        if not campo.editable:
+            continue
+        alias[_normalizar(campo.name)] = campo.name
+        alias[_normalizar(campo.verbose_name)] = campo.name
+    exportados = dict(zip(exportar.ENCABEZADOS_STOCK, exportar.COLUMNAS_STOCK))
+    for encabezado, campo in exportados.items():
+        alias[_normalizar(encabezado)] = campo
+    return alias
+
+
+def _leer_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    muestra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    try:
+        yield from csv.reader(texto, dialecto)
+    except csv.Error as e:
+        raise ValueError(f'El CSV no se pudo leer: {e}') from e
+
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def _indice_columna(referencia):
+    indice = 0
+    for letra in referencia:
+        if not letra.isalpha():
+            break
+        indice = indice * 26 + ord(letra.upper()) - 64
+    return indice - 1
+
+
+def _leer_xlsx(archivo):
+    """
+    Lee la primera hoja con ``iterparse``, liberando cada fila al terminarla.
+    Un archivo dañado o que no es XLSX lanza ``ValueError``.
+    """
+    # Se importa aquí: solo hace falta para XLSX y no debe pesar en el arranque.
+    from xml.etree import ElementTree
+
+    try:
+        yield from _filas_xlsx(archivo, ElementTree)
+    except (zipfile.BadZipFile, ElementTree.ParseError, IndexError) as e:
+        raise ValueError(f'El XLSX no se pudo leer: {e}') from e
+
+
+def _filas_xlsx(archivo, ElementTree):
+    libro = zipfile.ZipFile(archivo)
+    compartidas = []
+    if 'xl/sharedStrings.xml' in libro.namelist():
+        with libro.open('xl/sharedStrings.xml') as xml:
+            for _, nodo in ElementTree.iterparse(xml):
+                if nodo.tag == f'{_NS}si':
+                    compartidas.append(''.join(t.text or '' for t in nodo.iter(f'{_NS}t')))
+                    nodo.clear()
+
+    hojas = sorted(n for n in libro.namelist() if n.startswith('xl/worksheets/sheet'))
+    if not hojas:
+        raise ValueError('El XLSX no tiene hojas')
+    with libro.open(hojas[0]) as xml:
+        for _, nodo in ElementTree.iterparse(xml):
+            if nodo.tag != f'{_NS}row':
+                continue
+            fila = []
+            for celda in nodo.iter(f'{_NS}c'):
+                indice = _indice_columna(celda.get('r', ''))
+                if indice < 0:
+                    indice = len(fila)
+                tipo = celda.get('t')
+                if tipo == 'inlineStr':
+                    valor = ''.join(t.text or '' for t in celda.iter(f'{_NS}t'))
+                else:
+                    nodo_valor = celda.find(f'{_NS}v')
+                    valor = nodo_valor.text if nodo_valor is not None else ''
+                    if tipo == 's' and valor:
+                        valor = compartidas[int(valor)]
+                fila.extend([''] * (indice + 1 - len(fila)))
+                fila[indice] = valor or ''
+            nodo.clear()
+            yield fila
+
+
+def leer_filas(archivo, nombre):
+    """
+    Devuelve ``(número de línea, dict campo -> texto)`` por cada fila con datos.
+    ``archivo`` es un archivo binario; el formato se deduce de ``nombre``.
+    """
+    filas = _leer_xlsx(archivo) if nombre.lower().endswith('.xlsx') else _leer_csv(archivo)
+    alias = _alias_columnas()
+    encabezados = None
+    for linea, fila in enumerate(filas, 1):
+        if encabezados is None:
+            encabezados = [alias.get(_normalizar(c)) for c in fila]
+            if 'sku' not in encabezados:
+                raise ValueError('El archivo no tiene columna "sku"')
+            continue
+        datos = {
+            campo: str(valor).strip()
+            for campo, valor in zip(encabezados, fila)
+            if campo
+        }
+        if any(datos.values()):
+            yield linea, datos
+
+
+# --- Importación ---
+
+def _limpiar(datos, existente):
+    """
+    Arma la instancia a guardar: sobre el producto existente (si lo hay) se
+    aplican solo las columnas que trae el archivo. Lanza ``ValidationError``.
+    """
+    producto = Producto(**{
+        f.attname: getattr(existente, f.attname) for f in Producto._meta.concrete_fields
+    }) if existente else Producto()
+
+    for campo, valor in datos.items():
+        if campo == 'pz' and existente:
+            continue
+        field = Producto._meta.get_field(campo)
+        if valor == '':
+            valor = None if field.null else field.get_default()
+        setattr(producto, campo, valor)
+
+    # En un producto nuevo se validan todos los campos (los obligatorios deben venir).
+    excluir = [f.name for f in Producto._meta.concrete_fields if f.name not in datos] if existente else []
+    producto.full_clean(exclude=excluir, validate_unique=False, validate_constraints=False)
+    return producto
+
+
+def _cambio(producto, existente, campos):
+    return any(getattr(producto, c) != getattr(existente, c) for c in campos)
+
+
+def _procesar_lote(lote, resultado, simular, stock_inicial, usuario, vistos):
+    existentes = Producto.objects.in_bulk([datos['sku'] for _, datos in lote])
+    guardar, iniciales = [], []
+
+    for linea, datos in lote:
+        sku = datos['sku']
+        if sku in vistos:
+            resultado.conflictos.append((linea, sku, f'SKU repetido (ya venía en la línea {vistos[sku]})'))
+            continue
+        vistos[sku] = linea
+        existente = existentes.get(sku)
+        try:
+            producto = _limpiar(datos, existente)
+        except ValidationError as e:
+            mensajes = '; '.join(
+                f'{campo}: {" ".join(errores)}' for campo, errores in e.message_dict.items()
+            )
+            resultado.errores.append((linea, mensajes))
+            continue
+
+        if existente is None:
+            resultado.insertados += 1
+            guardar.append(producto)
+            if stock_inicial and producto.pz > 0:
+                iniciales.append(producto)
+            continue
+
+        if datos.get('pz') and datos['pz'] != str(existente.pz):
+            resultado.conflictos.append((
+                linea, sku,
+                f'pz {datos["pz"]} ignorado: el stock actual es {existente.pz} y solo cambia con movimientos',
+            ))
+        campos = [c for c in datos if c in CAMPOS_DESCRIPTIVOS]
+        if _cambio(producto, existente, campos):
+            resultado.actualizados += 1
+            guardar.append(producto)
+        else:
+            resultado.sin_cambios += 1
+
+    resultado.movimientos += len(iniciales)
+    if simular or not guardar:
+        return
+
+    # Un solo upsert por lote. Si otro proceso creó el SKU entretanto, la
+    # fila se actualiza en lugar de fallar; ``pz`` nunca está en update_fields.
+    Producto.objects.bulk_create(
+        guardar,
+        update_conflicts=True,
+        unique_fields=['sku'],
+        update_fields=CAMPOS_DESCRIPTIVOS,
+        batch_size=TAMANO_LOTE,
+    )
+    # El upsert no pasa por save(): se sube la versión (ETag, fragmentos en caché) y
+    # tipo, stock mínimo o stock inicial pudieron mover la marca de stock bajo.
+    skus = [p.sku for p in guardar]
+    Producto.objects.filter(pk__in=skus).update(**nueva_version())
+    alertas.recalcular(skus)
+    if iniciales:
+        movimientos = MovimientoInventario.objects.bulk_create([
+            MovimientoInventario(
+                producto_id=p.sku, tipo_movimiento='ENTRADA', cantidad=p.pz,
+                usuario=usuario, notas=NOTA_STOCK_INICIAL,
+            )
+            for p in iniciales
+        ])
+        resumenes.acumular(movimientos)
+
+
+def importar_catalogo(filas, simular=False, stock_inicial=False, usuario=None, tamano_lote=TAMANO_LOTE):
+    """
+    Importa ``filas`` (lo que devuelve ``leer_filas``) en una sola transacción
+    y devuelve un ``ResultadoImportacion``. Las filas inválidas o en conflicto
+    se saltan y se reportan; el resto se guarda.
+    """
+    resultado = ResultadoImportacion(simulado=simular)
+    vistos = {}
+    with transaction.atomic():
+        lote = []
+        for linea, datos in filas:
+            if not datos.get('sku'):
+                resultado.errores.append((linea, 'sku: Falta el SKU.'))
+                continue
+            lote.append((linea, datos))
+            if len(lote) >= tamano_lote:
+                _procesar_lote(lote, resultado, simular, stock_inicial, usuario, vistos)
+                lote = []
+        if lote:
+            _procesar_lote(lote, resultado, simular, stock_inicial, usuario, vistos)
+
+        if not simular and (resultado.insertados or resultado.actualizados):
+            # ``bulk_create`` no dispara señales: los KPIs se recalculan completos.
+            transaction.on_commit(kpis.invalidar, robust=True)
+    return resultado
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de KPIs del dashboard y reportes.
+
+Los agregados (conteos, sumas, top 10, alertas de stock) se guardan en el
+caché de Django con claves versionadas ``kpis:<esquema>:<generación>:<nombre>``.
+El servicio de stock y las señales de ``Producto`` los *parchan* (``incr`` /
+``decr``) cuando el cambio se puede aplicar sin recalcular, o borran solo la
+clave afectada; ``invalidar()`` sube la generación y descarta todo de golpe.
+
+Todos los parches se aplican con ``transaction.on_commit``: si la transacción
+se deshace, el caché no se entera. Por lo mismo los valores se calculan
+siempre en la base principal, aunque los pida una vista de reportes que lee
+de la réplica (``bd.en_principal``): parchar una foto atrasada perdería
+los escaneos de en medio. Un parche que llega mientras otra petición
+recalcula puede perderse, por eso cada valor tiene además un TTL corto.
+
+El caché tiene que ser compartido (``CACHES`` en settings: tabla en la base
+o Redis): con uno por proceso, los parches de un worker o de un comando no
+llegarían a los demás.
+"""
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Producto
+from . import alertas, bd, resumenes
+
+# Súbelo si cambia la forma de los valores guardados.
+ESQUEMA = 2
+TTL = 300
+TAMANO_TOP = 10
+TAMANO_ALERTA = 5
+
+_CLAVE_GENERACION = f'kpis:{ESQUEMA}:generacion'
+
+
+def _generacion():
+    generacion = cache.get(_CLAVE_GENERACION)
+    if generacion is None:
+        cache.add(_CLAVE_GENERACION, 1, timeout=None)
+        generacion = cache.get(_CLAVE_GENERACION, 1)
+    return generacion
+
+
+def _clave(nombre):
+    return f'kpis:{ESQUEMA}:{_generacion()}:{nombre}'
+
+
+def _obtener(nombre, calcular):
+    clave = _clave(nombre)
+    valor = cache.get(clave)
+    if valor is None:
+        with bd.en_principal():
+            valor = calcular()
+        # ``add`` y no ``set``: si un parche ya dejó un valor más nuevo, no se pisa.
+        cache.add(clave, valor, timeout=TTL)
+    return valor
+
+
+def _incrementar(nombre, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(_clave(nombre), delta)
+    except ValueError:
+        # La clave no está en caché: se calculará completa la próxima vez.
+        pass
+
+
+def _borrar(*nombres):
+    cache.delete_many([_clave(n) for n in nombres])
+
+
+def invalidar():
+    """Descarta todos los KPIs (cambia la generación de las claves)."""
+    try:
+        cache.incr(_CLAVE_GENERACION)
+    except ValueError:
+        cache.add(_CLAVE_GENERACION, 1, timeout=None)
+
+
+# --- Lecturas ---
+
+def _producto_dict(p):
+    return {'sku': p.sku, 'nombre_tela': p.nombre_tela, 'pz': p.pz}
+
+
+def total_productos():
+    return _obtener('total_productos', Producto.objects.count)
+
+
+def total_piezas():
+    return _obtener(
+        'total_piezas',
+        lambda: Producto.objects.aggregate(total=Sum('pz'))['total'] or 0,
+    )
+
+
+def productos_bajo_stock():
+    # Cuenta sobre el índice parcial de bajo_minimo: no recorre el catálogo.
+    return _obtener(
+        'productos_bajo_stock',
+        lambda: Producto.objects.filter(bajo_minimo=True).count(),
+    )
+
+
+def top_productos():
+    return _obtener(
+        'top_productos',
+        lambda: [_producto_dict(p) for p in Producto.objects.order_by('-pz')[:TAMANO_TOP]],
+    )
+
+
+def alerta_stock():
+    return _obtener(
+        'alerta_stock',
+        lambda: [
+            dict(_producto_dict(p), minimo=p.minimo)
+            for p in alertas.con_minimo(Producto.objects.filter(bajo_minimo=True)).order_by('pz')[:TAMANO_ALERTA]
+        ],
+    )
+
+
+def stock_por_modelo():
+    return _obtener(
+        'stock_por_modelo',
+        lambda: list(
+            Producto.objects.values('nombre_tela')
+            .annotate(total_pz=Sum('pz')).order_by('-total_pz')
+        ),
+    )
+
+
+def movimientos_por_tipo():
+    """Número histórico de entradas y salidas (desde el resumen diario)."""
+    claves = {tipo: _clave(f'movimientos_{tipo}') for tipo in ('ENTRADA', 'SALIDA')}
+    guardados = cache.get_many(claves.values())
+    if len(guardados) == len(claves):
+        return {tipo: guardados[clave] for tipo, clave in claves.items()}
+
+    totales = resumenes.totales_por_tipo()
+    for tipo, clave in claves.items():
+        cache.add(clave, totales[tipo]['movimientos'], timeout=TTL)
+    return {tipo: totales[tipo]['movimientos'] for tipo in claves}
+
+
+# --- Parches (los llaman el servicio de stock y las señales) ---
+
+def _aplicar_cambio_stock(sku, pz_anterior, pz_nuevo):
+    """``None`` en ``pz_anterior`` / ``pz_nuevo`` significa que el SKU no existía / ya no existe."""
+    _incrementar('total_piezas', (pz_nuevo or 0) - (pz_anterior or 0))
+
+    # Los cruces del mínimo llegan por ``cruce_umbral``; aquí solo cambia el pz mostrado.
+    alerta = cache.get(_clave('alerta_stock'))
+    if alerta is not None and any(p['sku'] == sku for p in alerta):
+        _borrar('alerta_stock')
+
+    # El top 10 solo cambia si el SKU está en él o si ahora supera al último.
+    top = cache.get(_clave('top_productos'))
+    if top is not None:
+        en_top = any(p['sku'] == sku for p in top)
+        supera = pz_nuevo is not None and (len(top) < TAMANO_TOP or pz_nuevo > top[-1]['pz'])
+        if en_top or supera:
+            _borrar('top_productos')
+
+    _borrar('stock_por_modelo')
+
+
+def cambio_stock(sku, pz_anterior, pz_nuevo):
+    """Un SKU pasó de ``pz_anterior`` a ``pz_nuevo`` piezas."""
+    if pz_anterior != pz_nuevo:
+        transaction.on_commit(
+            lambda: _aplicar_cambio_stock(sku, pz_anterior, pz_nuevo), robust=True
+        )
+
+
+def movimientos_registrados(tipos):
+    """Se registraron movimientos nuevos; ``tipos`` trae el tipo de cada uno."""
+    conteo = Counter(tipos)
+
+    def aplicar():
+        for tipo, numero in conteo.items():
+            _incrementar(f'movimientos_{tipo}', numero)
+    transaction.on_commit(aplicar, robust=True)
+
+
+def cruce_umbral(bajo):
+    """Un SKU cayó a su mínimo (``bajo``) o se repuso; ya se confirmó la transacción."""
+    _incrementar('productos_bajo_stock', 1 if bajo else -1)
+    _borrar('alerta_stock')
+
+
+def producto_creado(producto):
+    sku, pz = producto.sku, producto.pz
+
+    def aplicar():
+        _incrementar('total_productos', 1)
+        _aplicar_cambio_stock(sku, None, pz)
+    transaction.on_commit(aplicar, robust=True)
+
+
+def producto_eliminado(producto):
+    sku, pz, bajo = producto.sku, producto.pz, producto.bajo_minimo
+
+    def aplicar():
+        _incrementar('total_productos', -1)
+        _aplicar_cambio_stock(sku, pz, None)
+        if bajo:
+            cruce_umbral(False)
+        # Sus movimientos se borran en cascada: los conteos por tipo se recalculan.
+        _borrar('movimientos_ENTRADA', 'movimientos_SALIDA')
+    transaction.on_commit(aplicar, robust=True)
+
+
+def producto_editado():
+    """Edición completa (formulario/admin): nombre o pz pudieron cambiar."""
+    transaction.on_commit(invalidar, robust=True)
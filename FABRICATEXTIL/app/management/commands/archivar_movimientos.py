@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app import archivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve los movimientos más viejos que el horizonte (ARCHIVO_HORIZONTE_DIAS) "
+        "a la tabla de archivo, dejando un punto de control por producto como saldo inicial."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int,
+                            help='Horizonte en días (default: settings.ARCHIVO_HORIZONTE_DIAS).')
+        parser.add_argument('--lote', type=int, default=archivo.TAMANO_LOTE,
+                            help='Movimientos por transacción (default %(default)s).')
+        parser.add_argument('--simular', action='store_true',
+                            help='Solo cuenta cuántos movimientos se moverían.')
+
+    def handle(self, *args, **options):
+        if options['dias'] is not None and options['dias'] < 1:
+            raise CommandError("--dias debe ser al menos 1.")
+        antes_de = None
+        if options['dias'] is not None:
+            antes_de = timezone.now() - timedelta(days=options['dias'])
+
+        inicio = time.perf_counter()
+        movidos = archivo.archivar(antes_de, tamano_lote=options['lote'], simular=options['simular'])
+        segundos = time.perf_counter() - inicio
+        if options['simular']:
+            self.stdout.write(f"Se archivarían {movidos} movimientos.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Archivados {movidos} movimientos en {segundos:.1f} s."))
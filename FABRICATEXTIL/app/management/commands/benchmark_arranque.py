@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Módulos pesados que un worker web no debe cargar al arrancar.
+PROHIBIDOS = ('google.generativeai', 'grpc', 'google.protobuf')
+
+# Se corre en un proceso nuevo: importa la app WSGI y atiende una petición.
+_SCRIPT = """
+import io, json, sys, time
+inicio = time.perf_counter()
+from FABRICATEXTIL.wsgi import application
+importado = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+entorno = {'PATH_INFO': sys.argv[1], 'REQUEST_METHOD': 'GET', 'wsgi.errors': io.StringIO()}
+setup_testing_defaults(entorno)
+estado = []
+b''.join(application(entorno, lambda s, h, e=None: estado.append(s)))
+fin = time.perf_counter()
+print(json.dumps({
+    'importacion_ms': (importado - inicio) * 1000,
+    'primera_respuesta_ms': (fin - inicio) * 1000,
+    'estado': estado[0],
+    'modulos': sorted(sys.modules),
+}))
+"""
+
+
+def _medir(url):
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _SCRIPT, url],
+        cwd=settings.BASE_DIR, capture_output=True, text=True,
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'FABRICATEXTIL.settings'},
+    )
+    if resultado.returncode:
+        raise CommandError(f"El proceso de prueba falló:\n{resultado.stderr[-2000:]}")
+    medicion = json.loads(resultado.stdout.strip().splitlines()[-1])
+
+    # "import time: propio | acumulado | módulo"; cada nivel de anidación son
+    # dos espacios más. Se listan los tres primeros niveles.
+    pesados = []
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, modulo = linea[len('import time:'):].split('|')
+        nivel = (len(modulo) - len(modulo.lstrip()) - 1) // 2
+        if nivel <= 2:
+            pesados.append((int(acumulado) / 1000, modulo.strip()))
+    medicion['mas_pesados'] = sorted(pesados, reverse=True)[:10]
+    return medicion
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el arranque en frío de un worker: costo de importación (-X importtime) "
+        "y tiempo hasta la primera respuesta WSGI. Falla si se cargan módulos "
+        "prohibidos o se pasan los límites indicados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/accounts/login/',
+                            help='Ruta de la primera petición (default %(default)s).')
+        parser.add_argument('--repeticiones', type=int, default=3,
+                            help='Se reporta la mejor de N corridas (default %(default)s).')
+        parser.add_argument('--max-importacion-ms', type=float,
+                            help='Falla si importar la app WSGI tarda más.')
+        parser.add_argument('--max-primera-respuesta-ms', type=float,
+                            help='Falla si la primera respuesta tarda más.')
+        parser.add_argument('--prohibidos', nargs='*', default=list(PROHIBIDOS),
+                            help='Módulos que no deben cargarse al arrancar.')
+        parser.add_argument('--json', dest='salida_json',
+                            help='Guarda el resultado en este archivo.')
+
+    def handle(self, *args, **options):
+        corridas = [_medir(options['url']) for _ in range(max(1, options['repeticiones']))]
+        mejor = min(corridas, key=lambda c: c['primera_respuesta_ms'])
+
+        self.stdout.write(f"Importación de la app WSGI: {mejor['importacion_ms']:.0f} ms")
+        self.stdout.write(
+            f"Primera respuesta ({options['url']}): {mejor['primera_respuesta_ms']:.0f} ms [{mejor['estado']}]"
+        )
+        self.stdout.write("Módulos más pesados:")
+        for ms, modulo in mejor['mas_pesados']:
+            self.stdout.write(f"  {ms:8.1f} ms  {modulo}")
+
+        errores = []
+        cargados = set(mejor['modulos'])
+        for prohibido in options['prohibidos']:
+            if any(m == prohibido or m.startswith(prohibido + '.') for m in cargados):
+                errores.append(f"se cargó {prohibido} al arrancar")
+        limite = options['max_importacion_ms']
+        if limite is not None and mejor['importacion_ms'] > limite:
+            errores.append(f"importación {mejor['importacion_ms']:.0f} ms > {limite:.0f} ms")
+        limite = options['max_primera_respuesta_ms']
+        if limite is not None and mejor['primera_respuesta_ms'] > limite:
+            errores.append(f"primera respuesta {mejor['primera_respuesta_ms']:.0f} ms > {limite:.0f} ms")
+
+        if options['salida_json']:
+            del mejor['modulos']
+            with open(options['salida_json'], 'w', encoding='utf-8') as f:
+                json.dump({**mejor, 'errores': errores}, f, indent=2)
+        if errores:
+            raise CommandError("; ".join(errores))
+        self.stdout.write(self.style.SUCCESS("Arranque dentro de lo esperado."))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import conciliacion
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el stock de cada producto (pz) con el que resulta del historial "
+        "de movimientos. Con --reparar corrige las diferencias y con "
+        "--punto-control guarda un corte para que la siguiente auditoría sea más rápida."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sku', nargs='+', dest='skus', help='Solo estos SKUs.')
+        parser.add_argument('--reparar', choices=conciliacion.MODOS_REPARACION,
+                            help="'contador': pz toma el valor del historial; "
+                                 "'libro': se registra un movimiento de ajuste.")
+        parser.add_argument('--punto-control', action='store_true',
+                            help='Al terminar guarda un punto de control por producto.')
+
+    def handle(self, *args, **options):
+        faltantes = conciliacion.diferencias(options['skus'])
+        for sku, pz, esperado in faltantes[:50]:
+            self.stdout.write(f"  {sku}: pz={pz} historial={esperado} ({pz - esperado:+d})")
+
+        if faltantes and options['reparar']:
+            corregidos = conciliacion.reparar(faltantes, options['reparar'])
+            self.stdout.write(f"Corregidos: {corregidos} de {len(faltantes)}.")
+            faltantes = conciliacion.diferencias(options['skus'])
+
+        if options['punto_control']:
+            creados = conciliacion.crear_puntos_control(options['skus'])
+            self.stdout.write(f"Puntos de control creados: {creados}.")
+
+        if faltantes:
+            raise CommandError(
+                f"{len(faltantes)} productos no cuadran con el historial. "
+                "Ejecuta con --reparar contador o --reparar libro para corregirlos."
+            )
+        self.stdout.write(self.style.SUCCESS("El stock coincide con el historial."))
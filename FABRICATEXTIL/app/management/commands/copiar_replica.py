@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bd
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresca la réplica SQLite de reportes (DB_REPLICA) con una copia "
+        "consistente de la base principal. Se corre periódicamente (cron); "
+        "los reportes van tan atrasados como la última copia."
+    )
+
+    def handle(self, *args, **options):
+        try:
+            paginas = bd.copiar_replica()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Réplica actualizada ({paginas} páginas)."))
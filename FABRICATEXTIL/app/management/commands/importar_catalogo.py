@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import importar
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa (alta o actualización) el catálogo de productos desde un CSV o XLSX. "
+        "Con --simular solo muestra qué se insertaría, actualizaría o quedaría en conflicto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo .csv o .xlsx.')
+        parser.add_argument('--simular', action='store_true',
+                            help='No escribe nada; solo reporta el diff.')
+        parser.add_argument('--stock-inicial', action='store_true',
+                            help='Registra el pz de los SKUs nuevos como movimiento de ENTRADA.')
+        parser.add_argument('--lote', type=int, default=importar.TAMANO_LOTE,
+                            help='Filas por lote (default %(default)s).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resultado = importar.importar_catalogo(
+                    importar.leer_filas(archivo, options['archivo']),
+                    simular=options['simular'],
+                    stock_inicial=options['stock_inicial'],
+                    tamano_lote=options['lote'],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for linea, mensaje in resultado.errores[:50]:
+            self.stdout.write(self.style.ERROR(f"  línea {linea}: {mensaje}"))
+        for linea, sku, motivo in resultado.conflictos[:50]:
+            self.stdout.write(self.style.WARNING(f"  línea {linea} ({sku}): {motivo}"))
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(f"{resultado.resumen()} en {segundos:.1f} s."))
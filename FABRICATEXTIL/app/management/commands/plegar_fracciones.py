@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import fracciones
+from app.models import Producto
+
+
+class Command(BaseCommand):
+    help = (
+        "Pliega los contadores fraccionados: pone al día el pz de cada SKU fraccionado "
+        "con la suma de sus fracciones. Con --fracciones activa, cambia o quita el "
+        "fraccionado de los SKUs indicados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sku', nargs='+', dest='skus', help='Solo estos SKUs.')
+        parser.add_argument('--fracciones', type=int,
+                            help='Número de fracciones para los SKUs de --sku (0 lo quita).')
+        parser.add_argument('--cada', type=float,
+                            help='Segundos entre pliegues; sin esto pliega una vez y termina.')
+
+    def handle(self, *args, **options):
+        skus = options['skus']
+        if options['fracciones'] is not None:
+            if not skus:
+                raise CommandError("--fracciones necesita --sku.")
+            for sku in skus:
+                try:
+                    pz = fracciones.configurar(sku, options['fracciones'])
+                except Producto.DoesNotExist:
+                    raise CommandError(f"No existe el producto {sku}")
+                self.stdout.write(f"{sku}: {options['fracciones']} fracciones, {pz} pz.")
+            return
+
+        while True:
+            cambiados = fracciones.plegar(skus)
+            self.stdout.write(self.style.SUCCESS(f"SKUs con pz al día: {cambiados}."))
+            if not options['cada']:
+                break
+            time.sleep(options['cada'])
@@ -0,0 +1,74 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import carga
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula kioscos, escáneres y usuarios de oficina concurrentes y reporta "
+        "peticiones por segundo y latencias p50/p95/p99. Sin --servidor corre "
+        "contra la app WSGI en este proceso (o ASGI con --asgi); con --servidor "
+        "contra un servidor real que use la misma base de datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kioscos', type=int, default=4, help='Hilos que registran movimientos.')
+        parser.add_argument('--escaneres', type=int, default=4, help='Hilos que abren el kiosco de un SKU.')
+        parser.add_argument('--oficina', type=int, default=2,
+                            help='Hilos que ven catálogo, dashboard y reportes.')
+        parser.add_argument('--duracion', type=float, default=10.0, help='Segundos (default %(default)s).')
+        parser.add_argument('--usuario', default=f'{carga.USUARIO_PREFIJO}01',
+                            help='Usuario con el que entran los hilos (default %(default)s).')
+        parser.add_argument('--servidor', help='URL base, p. ej. http://127.0.0.1:8000')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Pila ASGI en este proceso: cada cliente es una tarea de asyncio, no un hilo.')
+        parser.add_argument('--semilla', type=int)
+        parser.add_argument('--json', dest='salida_json', help='Guarda el resultado (línea base) en este archivo.')
+        parser.add_argument('--comparar', help='Línea base anterior; falla si algo empeoró.')
+        parser.add_argument('--tolerancia', type=float, default=0.25,
+                            help='Empeoramiento aceptado al comparar (default %(default)s = 25%%).')
+
+    def handle(self, *args, **options):
+        usuario = User.objects.filter(username=options['usuario']).first()
+        if usuario is None:
+            raise CommandError(f"No existe el usuario {options['usuario']}; corre sembrar_datos primero.")
+        roles = {rol: options[campo] for rol, campo in
+                 (('kiosco', 'kioscos'), ('escaner', 'escaneres'), ('oficina', 'oficina'))
+                 if options[campo] > 0}
+        if not roles:
+            raise CommandError("Indica al menos un hilo.")
+
+        try:
+            resultados, segundos = carga.correr(
+                usuario, roles, duracion=options['duracion'],
+                base_url=options['servidor'], semilla=options['semilla'], asgi=options['asgi'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        reporte = carga.resumen(resultados, segundos)
+        reporte['hilos'] = roles
+        reporte['servidor'] = options['servidor'] or ('asgi' if options['asgi'] else 'wsgi')
+
+        self.stdout.write(f"{'Petición':<16} {'total':>7} {'err':>5} {'pet/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        filas = list(reporte['peticiones'].items()) + [('TOTAL', reporte['total'])]
+        for nombre, e in filas:
+            self.stdout.write(
+                f"{nombre:<16} {e['peticiones']:>7} {e['errores']:>5} {e['por_segundo']:>8.1f} "
+                f"{e['p50_ms']:>6.1f}ms {e['p95_ms']:>6.1f}ms {e['p99_ms']:>6.1f}ms"
+            )
+
+        if options['salida_json']:
+            with open(options['salida_json'], 'w', encoding='utf-8') as f:
+                json.dump(reporte, f, indent=2)
+        errores = []
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as f:
+                errores = carga.regresiones(reporte, json.load(f), options['tolerancia'])
+        if reporte['total']['errores']:
+            errores.append(f"{reporte['total']['errores']} peticiones con error")
+        if errores:
+            raise CommandError("; ".join(errores))
+        self.stdout.write(self.style.SUCCESS("Prueba de carga terminada."))
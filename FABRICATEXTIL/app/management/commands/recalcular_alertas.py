@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app import alertas, kpis
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula la marca de stock bajo (bajo_minimo) de todo el catálogo. "
+        "Hace falta después de cambiar STOCK_MINIMO_POR_TIPO en settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sku', nargs='+', dest='skus', help='Solo estos SKUs.')
+        parser.add_argument('--sin-avisos', action='store_true',
+                            help='No emite los avisos de cruce de umbral (carga inicial).')
+
+    def handle(self, *args, **options):
+        cambiados = alertas.recalcular(options['skus'], avisar=not options['sin_avisos'])
+        if options['sin_avisos'] and cambiados:
+            kpis.invalidar()
+        self.stdout.write(self.style.SUCCESS(f"Productos con la marca corregida: {cambiados}."))
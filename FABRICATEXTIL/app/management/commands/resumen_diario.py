@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import resumenes
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica el resumen diario de movimientos contra el historial crudo. "
+        "Con --reconstruir lo vuelve a calcular desde cero (o solo el rango indicado)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true',
+                            help='Borra y recalcula el resumen antes de verificar.')
+        parser.add_argument('--desde', type=date.fromisoformat, help='Primer día (AAAA-MM-DD).')
+        parser.add_argument('--hasta', type=date.fromisoformat, help='Último día (AAAA-MM-DD).')
+
+    def handle(self, *args, **options):
+        desde, hasta = options['desde'], options['hasta']
+
+        if options['reconstruir']:
+            creadas = resumenes.reconstruir(desde, hasta)
+            self.stdout.write(f"Resumen reconstruido: {creadas} filas.")
+
+        faltantes = resumenes.diferencias(desde, hasta)
+        for (dia, sku, tipo), esperado, guardado in faltantes[:50]:
+            self.stdout.write(f"  {dia} {sku} {tipo}: historial={esperado} resumen={guardado}")
+        if faltantes:
+            raise CommandError(
+                f"{len(faltantes)} diferencias entre el resumen y el historial. "
+                "Ejecuta con --reconstruir para corregirlas."
+            )
+        self.stdout.write(self.style.SUCCESS("El resumen diario coincide con el historial."))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from app import carga
+
+
+class Command(BaseCommand):
+    help = (
+        "Siembra datos sintéticos para pruebas de carga: productos, operadores e "
+        "historial de movimientos con SKUs más y menos escaneados. Los productos "
+        f"llevan el prefijo {carga.SKU_PREFIJO} y los operadores entran con la "
+        f"contraseña '{carga.CONTRASENA}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=2000, help='Default %(default)s.')
+        parser.add_argument('--movimientos', type=int, default=200000, help='Default %(default)s.')
+        parser.add_argument('--usuarios', type=int, default=20, help='Default %(default)s.')
+        parser.add_argument('--dias', type=int, default=365,
+                            help='Días de historial hacia atrás (default %(default)s).')
+        parser.add_argument('--semilla', type=int, help='Semilla para repetir el mismo conjunto.')
+        parser.add_argument('--limpiar', action='store_true',
+                            help='Borra antes lo sembrado en una corrida anterior.')
+
+    def handle(self, *args, **options):
+        if min(options['productos'], options['dias']) < 1 or options['movimientos'] < 0:
+            raise CommandError("--productos y --dias deben ser al menos 1.")
+        inicio = time.perf_counter()
+        if options['limpiar']:
+            carga.limpiar()
+        try:
+            conteo = carga.sembrar(
+                productos=options['productos'], movimientos=options['movimientos'],
+                usuarios=options['usuarios'], dias=options['dias'], semilla=options['semilla'],
+            )
+        except IntegrityError:
+            raise CommandError("Ya hay datos sembrados; usa --limpiar para reemplazarlos.")
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Sembrados {conteo['productos']} productos, {conteo['movimientos']} movimientos "
+            f"y {conteo['usuarios']} usuarios en {segundos:.1f} s."
+        ))
@@ -0,0 +1,34 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import trabajos
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta los trabajos en segundo plano (descripciones con IA, etc.). "
+        "Corre en su propio proceso, aparte de los workers web."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Vacía la cola y termina (útil en cron o pruebas).')
+        parser.add_argument('--espera', type=float, default=2.0,
+                            help='Segundos entre consultas cuando la cola está vacía.')
+
+    def handle(self, *args, **options):
+        nombre = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Trabajador {nombre} iniciado.")
+        while True:
+            liberados = trabajos.liberar_vencidos()
+            if liberados:
+                self.stdout.write(self.style.WARNING(f"{liberados} trabajos vencidos regresaron a la cola."))
+            hechos = trabajos.procesar_pendientes(nombre)
+            if hechos:
+                self.stdout.write(f"{hechos} trabajos procesados.")
+            if options['una_vez']:
+                break
+            time.sleep(options['espera'])
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de rendimiento y de negocio.
+
+``MetricasMiddleware`` mide cada petición: consultas y tiempo de base de datos
+(un ``execute_wrapper`` instalado en cada conexión), tiempo de render de plantillas (backend
+``PlantillasMedidas``) y latencia total. Lo manda al navegador en el
+encabezado ``Server-Timing`` y lo acumula en histogramas por vista que
+``exportar()`` entrega en formato de texto de Prometheus (vista ``metricas``).
+
+El middleware sirve igual bajo WSGI y ASGI (las vistas async no se
+degradan a un hilo por su culpa). Las conexiones son por hilo y bajo ASGI
+las consultas corren en los hilos de ``sync_to_async``: por eso el wrapper
+va en todas las conexiones y la medición en un ``ContextVar``, que
+``sync_to_async`` propaga a esos hilos.
+
+Todo vive en memoria del proceso, protegido por un solo ``Lock``; medir
+cuesta unos cuantos ``perf_counter()`` por petición y por consulta. Con
+varios workers de gunicorn cada uno lleva sus propios contadores, como el
+cliente oficial de Prometheus sin modo multiproceso.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+PREFIJO = 'fabricatextil'
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CUBETAS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# Métodos con etiqueta propia; cualquier otro cuenta como 'otro' (cardinalidad acotada).
+_METODOS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+_candado = threading.Lock()
+_registro = []
+
+# Medición de la petición en curso: [consultas, segundos de BD, segundos de plantillas]
+_peticion = ContextVar('metricas_peticion', default=None)
+
+
+# --- Tipos de métrica ---
+
+class _Metrica:
+    tipo = ''
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = f'{PREFIJO}_{nombre}'
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.series = {}
+        _registro.append(self)
+
+    def _etiquetas(self, valores, extra=''):
+        pares = [f'{n}="{_escapar(v)}"' for n, v in zip(self.etiquetas, valores)]
+        if extra:
+            pares.append(extra)
+        return '{' + ','.join(pares) + '}' if pares else ''
+
+    def lineas(self):
+        yield f'# HELP {self.nombre} {self.ayuda}'
+        yield f'# TYPE {self.nombre} {self.tipo}'
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def sumar(self, *valores, n=1):
+        with _candado:
+            self.series[valores] = self.series.get(valores, 0) + n
+
+    def lineas(self):
+        yield from super().lineas()
+        for valores, total in sorted(self.series.items()):
+            yield f'{self.nombre}_total{self._etiquetas(valores)} {total}'
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubetas = cubetas
+
+    def observar(self, valor, *valores):
+        # Conteos por cubeta (no acumulados), +Inf, suma y total.
+        indice = bisect_left(self.cubetas, valor)
+        with _candado:
+            serie = self.series.get(valores)
+            if serie is None:
+                serie = self.series[valores] = [0] * (len(self.cubetas) + 1) + [0.0]
+            serie[indice] += 1
+            serie[-1] += valor
+
+    def lineas(self):
+        yield from super().lineas()
+        for valores, serie in sorted(self.series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas, serie):
+                acumulado += conteo
+                etiquetas = self._etiquetas(valores, f'le="{limite}"')
+                yield f'{self.nombre}_bucket{etiquetas} {acumulado}'
+            total = acumulado + serie[len(self.cubetas)]
+            etiquetas = self._etiquetas(valores, 'le="+Inf"')
+            yield f'{self.nombre}_bucket{etiquetas} {total}'
+            yield f'{self.nombre}_sum{self._etiquetas(valores)} {serie[-1]:.6f}'
+            yield f'{self.nombre}_count{self._etiquetas(valores)} {total}'
+
+
+class VentanaPorMinuto(_Metrica):
+    """Gauge con lo ocurrido en los últimos 60 s (60 cubetas de un segundo)."""
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda):
+        super().__init__(nombre, ayuda)
+        self.conteos = [0] * 60
+        self.segundos = [0] * 60
+
+    def sumar(self, n=1, ahora=None):
+        segundo = int(ahora if ahora is not None else time.time())
+        with _candado:
+            i = segundo % 60
+            if self.segundos[i] != segundo:
+                self.segundos[i], self.conteos[i] = segundo, 0
+            self.conteos[i] += n
+
+    def valor(self, ahora=None):
+        segundo = int(ahora if ahora is not None else time.time())
+        with _candado:
+            return sum(c for c, s in zip(self.conteos, self.segundos) if segundo - s < 60)
+
+    def lineas(self):
+        yield from super().lineas()
+        yield f'{self.nombre} {self.valor()}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+# --- Métricas de la app ---
+
+PETICION_SEGUNDOS = Histograma('peticion_segundos', 'Latencia total por vista.', ('vista', 'metodo'))
+BD_SEGUNDOS = Histograma('bd_segundos', 'Tiempo en la base de datos por petición.', ('vista',))
+BD_CONSULTAS = Histograma(
+    'bd_consultas', 'Consultas SQL por petición.', ('vista',), cubetas=CUBETAS_CONSULTAS,
+)
+PLANTILLA_SEGUNDOS = Histograma('plantilla_segundos', 'Tiempo de render de plantillas por petición.', ('vista',))
+RESPUESTAS = Contador('respuestas', 'Respuestas por vista y código HTTP.', ('vista', 'codigo'))
+
+ESCANEOS = Contador('escaneos', 'Escaneos recibidos (kiosco y lotes del escáner).', ('origen',))
+ESCANEOS_MINUTO = VentanaPorMinuto('escaneos_por_minuto', 'Escaneos en los últimos 60 segundos.')
+MOVIMIENTOS = Contador('movimientos_stock', 'Movimientos de stock confirmados por tipo.', ('tipo',))
+SALIDAS_RECHAZADAS = Contador(
+    'salidas_rechazadas', 'Salidas rechazadas por stock insuficiente.', ('origen',),
+)
+
+
+def escaneos(origen, n=1):
+    ESCANEOS.sumar(origen, n=n)
+    ESCANEOS_MINUTO.sumar(n)
+
+
+def salida_rechazada(origen, n=1):
+    SALIDAS_RECHAZADAS.sumar(origen, n=n)
+
+
+def movimientos_registrados(tipos):
+    """Como ``kpis.movimientos_registrados``: cuenta solo si la transacción se confirma."""
+    tipos = list(tipos)
+    transaction.on_commit(lambda: [MOVIMIENTOS.sumar(tipo) for tipo in tipos], robust=True)
+
+
+def exportar():
+    """Todas las métricas en el formato de texto de Prometheus."""
+    return '\n'.join(linea for metrica in _registro for linea in metrica.lineas()) + '\n'
+
+
+# --- Medición por petición ---
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _peticion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion[0] += 1
+        medicion[1] += time.perf_counter() - inicio
+
+
+def _instalar(conexion):
+    if _medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(_medir_consulta)
+
+
+def _conexion_creada(sender, connection, **kwargs):
+    _instalar(connection)
+
+
+connection_created.connect(_conexion_creada)
+
+
+class MetricasMiddleware:
+    """Va primero en ``MIDDLEWARE`` para que la latencia incluya a los demás."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # La conexión de este hilo pudo abrirse antes de conectar la señal.
+        _instalar(connection)
+        medicion = [0, 0.0, 0.0]
+        ficha = _peticion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _peticion.reset(ficha)
+        return _registrar(request, response, medicion, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        medicion = [0, 0.0, 0.0]
+        ficha = _peticion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _peticion.reset(ficha)
+        return _registrar(request, response, medicion, time.perf_counter() - inicio)
+
+
+def _registrar(request, response, medicion, total):
+    consultas, bd, plantillas = medicion
+    coincidencia = request.resolver_match
+    vista = coincidencia.view_name if coincidencia else 'sin_ruta'
+    metodo = request.method if request.method in _METODOS else 'otro'
+    PETICION_SEGUNDOS.observar(total, vista, metodo)
+    BD_SEGUNDOS.observar(bd, vista)
+    BD_CONSULTAS.observar(consultas, vista)
+    PLANTILLA_SEGUNDOS.observar(plantillas, vista)
+    RESPUESTAS.sumar(vista, response.status_code)
+
+    response['Server-Timing'] = (
+        f'db;dur={bd * 1000:.1f};desc="{consultas} consultas", '
+        f'tpl;dur={plantillas * 1000:.1f}, total;dur={total * 1000:.1f}'
+    )
+    return response
+
+
+# --- Backend de plantillas con tiempo de render ---
+
+class _PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        medicion = _peticion.get()
+        if medicion is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicion[2] += time.perf_counter() - inicio
+
+
+class PlantillasMedidas(DjangoTemplates):
+    """``DjangoTemplates`` que suma el render de cada plantilla a la petición en curso."""
+
+    def from_string(self, template_code):
+        return _PlantillaMedida(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return _PlantillaMedida(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_movimientoinventario_usuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimientoinventario',
+            name='clave_idempotencia',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Clave de Idempotencia'),
+        ),
+    ]
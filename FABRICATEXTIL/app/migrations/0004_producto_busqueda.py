@@ -0,0 +1,95 @@
+# Índice de búsqueda de productos: FTS5 en SQLite, trigram en PostgreSQL.
+
+from django.db import migrations
+
+CAMPOS_BUSQUEDA = ('sku', 'nombre_tela', 'color', 'composicion', 'ubicacion', 'tipo')
+
+# SQL copiado aquí (y no importado de app/busqueda.py) para que la migración no
+# cambie con el código. Los triggers los repiten 0010, 0011 y 0012.
+SQL_TRIGGERS_FTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ai AFTER INSERT ON app_producto BEGIN
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ad AFTER DELETE ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_au
+    AFTER UPDATE OF sku, nombre_tela, color, composicion, ubicacion, tipo ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+]
+
+SQL_CREAR_FTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS app_producto_fts USING fts5(
+        sku, nombre_tela, color, composicion, ubicacion, tipo,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    *SQL_TRIGGERS_FTS,
+    """
+    INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+    SELECT sku, nombre_tela, color, composicion, ubicacion, tipo FROM app_producto
+    """,
+]
+
+SQL_BORRAR_FTS = [
+    "DROP TRIGGER IF EXISTS app_producto_fts_ai",
+    "DROP TRIGGER IF EXISTS app_producto_fts_ad",
+    "DROP TRIGGER IF EXISTS app_producto_fts_au",
+    "DROP TABLE IF EXISTS app_producto_fts",
+]
+
+
+def crear_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            for sql in SQL_CREAR_FTS:
+                schema_editor.execute(sql)
+        except Exception:
+            # SQLite sin FTS5: la búsqueda usa el fallback icontains.
+            for sql in SQL_BORRAR_FTS:
+                schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for campo in CAMPOS_BUSQUEDA:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS app_producto_{campo}_trgm "
+                f"ON app_producto USING gin (upper({campo}) gin_trgm_ops)"
+            )
+
+
+def borrar_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQL_BORRAR_FTS:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        for campo in CAMPOS_BUSQUEDA:
+            schema_editor.execute(f"DROP INDEX IF EXISTS app_producto_{campo}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_movimientoinventario_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def llenar_resumen(apps, schema_editor):
+    # Carga inicial del resumen a partir del historial existente.
+    MovimientoInventario = apps.get_model('app', 'MovimientoInventario')
+    MovimientoDiario = apps.get_model('app', 'MovimientoDiario')
+    filas = (
+        MovimientoInventario.objects.annotate(dia=TruncDate('fecha')).order_by()
+        .values('dia', 'producto_id', 'tipo_movimiento')
+        .annotate(total=Sum('cantidad'), numero=Count('id'))
+    )
+    MovimientoDiario.objects.bulk_create(
+        [
+            MovimientoDiario(
+                dia=f['dia'], producto_id=f['producto_id'], tipo_movimiento=f['tipo_movimiento'],
+                cantidad=f['total'], movimientos=f['numero'],
+            )
+            for f in filas.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_producto_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo_movimiento', models.CharField(choices=[('ENTRADA', 'Entrada'), ('SALIDA', 'Salida')], max_length=10)),
+                ('cantidad', models.IntegerField(default=0, verbose_name='Piezas')),
+                ('movimientos', models.IntegerField(default=0, verbose_name='Número de Movimientos')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='app.producto')),
+            ],
+            options={
+                'ordering': ['-dia'],
+                'indexes': [models.Index(fields=['dia', 'tipo_movimiento'], name='movdiario_dia_tipo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dia', 'producto', 'tipo_movimiento'), name='movimientodiario_unico')],
+            },
+        ),
+        migrations.RunPython(llenar_resumen, migrations.RunPython.noop),
+    ]
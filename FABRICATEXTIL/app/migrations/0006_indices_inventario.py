@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_movimientodiario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='movimientodiario',
+            name='movdiario_dia_tipo_idx',
+        ),
+        migrations.AddIndex(
+            model_name='movimientodiario',
+            index=models.Index(fields=['dia', 'tipo_movimiento', 'cantidad', 'movimientos'], name='movdiario_dia_totales_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['fecha'], name='movimiento_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientoinventario',
+            index=models.Index(fields=['tipo_movimiento', 'fecha'], name='movimiento_tipo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['nombre_tela', 'sku'], name='producto_nombre_sku_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['pz'], name='producto_pz_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_indices_inventario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RespuestaIA',
+            fields=[
+                ('clave', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('modelo', models.CharField(max_length=100)),
+                ('respuesta', models.TextField()),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('ultimo_uso', models.DateTimeField(default=django.utils.timezone.now)),
+                ('aciertos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ultimo_uso'], name='respuestaia_ultimo_uso_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Trabajo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('TERMINADO', 'Terminado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=12)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('max_intentos', models.PositiveIntegerField(default=3)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('trabajador', models.CharField(blank=True, default='', max_length=100)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-creado'],
+                'indexes': [models.Index(fields=['estado', 'disponible_desde'], name='trabajo_estado_disp_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_trabajos_y_respuestas_ia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControlStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(verbose_name='Fecha del Corte')),
+                ('pz', models.IntegerField(verbose_name='Piezas según el Historial')),
+                ('ultimo_movimiento', models.BigIntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='puntos_control', to='app.producto')),
+            ],
+            options={
+                'ordering': ['-fecha'],
+                'constraints': [models.UniqueConstraint(fields=('producto', 'fecha'), name='puntocontrol_producto_fecha_unico')],
+            },
+        ),
+    ]
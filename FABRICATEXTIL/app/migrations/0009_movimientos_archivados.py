@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_puntos_control_stock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoArchivado',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('tipo_movimiento', models.CharField(choices=[('ENTRADA', 'Entrada'), ('SALIDA', 'Salida')], max_length=10)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('fecha', models.DateTimeField()),
+                ('notas', models.CharField(blank=True, max_length=255, null=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_archivados', to='app.producto')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['fecha'], name='archivado_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+TABLA_FTS = 'app_producto_fts'
+
+# Los mismos triggers de la migración 0004, copiados para no depender del código.
+SQL_TRIGGERS_FTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ai AFTER INSERT ON app_producto BEGIN
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ad AFTER DELETE ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_au
+    AFTER UPDATE OF sku, nombre_tela, color, composicion, ubicacion, tipo ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+]
+
+
+def restaurar_triggers_fts(apps, schema_editor):
+    # Agregar una columna NOT NULL reconstruye app_producto en SQLite y se pierden
+    # los triggers del índice de búsqueda (migración 0004); la tabla FTS sigue al día.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    if TABLA_FTS not in schema_editor.connection.introspection.table_names():
+        return
+    for sql in SQL_TRIGGERS_FTS:
+        schema_editor.execute(sql)
+
+
+def marcar_bajo_minimo(apps, schema_editor):
+    # Igual que alertas.recalcular() con el mínimo por tipo (aún no hay mínimos por SKU).
+    Producto = apps.get_model('app', 'Producto')
+    por_tipo = getattr(settings, 'STOCK_MINIMO_POR_TIPO', {})
+    for tipo, minimo in por_tipo.items():
+        Producto.objects.filter(tipo=tipo, pz__lte=minimo).update(bajo_minimo=True)
+    Producto.objects.exclude(tipo__in=list(por_tipo)).filter(pz__lte=5).update(bajo_minimo=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_movimientos_archivados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='bajo_minimo',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Bajo el Mínimo'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='stock_minimo',
+            field=models.PositiveIntegerField(blank=True, help_text='Vacío: el mínimo de su tipo.', null=True, verbose_name='Stock Mínimo'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('bajo_minimo', True)), fields=['pz'], name='producto_bajo_minimo_idx'),
+        ),
+        migrations.RunPython(restaurar_triggers_fts, migrations.RunPython.noop),
+        migrations.RunPython(marcar_bajo_minimo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+TABLA_FTS = 'app_producto_fts'
+
+# Los mismos triggers de la migración 0004, copiados para no depender del código.
+SQL_TRIGGERS_FTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ai AFTER INSERT ON app_producto BEGIN
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ad AFTER DELETE ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_au
+    AFTER UPDATE OF sku, nombre_tela, color, composicion, ubicacion, tipo ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+]
+
+
+def restaurar_triggers_fts(apps, schema_editor):
+    # Igual que en 0010: las columnas NOT NULL reconstruyen app_producto en SQLite.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    if TABLA_FTS not in schema_editor.connection.introspection.table_names():
+        return
+    for sql in SQL_TRIGGERS_FTS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_stock_minimo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='modificado',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(restaurar_triggers_fts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLA_FTS = 'app_producto_fts'
+
+# Los mismos triggers de la migración 0004, copiados para no depender del código.
+SQL_TRIGGERS_FTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ai AFTER INSERT ON app_producto BEGIN
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_ad AFTER DELETE ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_producto_fts_au
+    AFTER UPDATE OF sku, nombre_tela, color, composicion, ubicacion, tipo ON app_producto BEGIN
+        DELETE FROM app_producto_fts
+        WHERE app_producto_fts MATCH 'sku:"' || replace(old.sku, '"', '""') || '"'
+          AND sku = old.sku;
+        INSERT INTO app_producto_fts (sku, nombre_tela, color, composicion, ubicacion, tipo)
+        VALUES (new.sku, new.nombre_tela, new.color, new.composicion, new.ubicacion, new.tipo);
+    END
+    """,
+]
+
+
+def restaurar_triggers_fts(apps, schema_editor):
+    # Igual que en 0010: las columnas NOT NULL reconstruyen app_producto en SQLite.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    if TABLA_FTS not in schema_editor.connection.introspection.table_names():
+        return
+    for sql in SQL_TRIGGERS_FTS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_version_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='fracciones',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Fracciones del Contador'),
+        ),
+        migrations.CreateModel(
+            name='FraccionStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indice', models.PositiveSmallIntegerField()),
+                ('pz', models.PositiveIntegerField(default=0, verbose_name='Piezas')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fracciones_stock', to='app.producto')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('producto', 'indice'), name='fraccionstock_unica')],
+            },
+        ),
+        migrations.RunPython(restaurar_triggers_fts, migrations.RunPython.noop),
+    ]
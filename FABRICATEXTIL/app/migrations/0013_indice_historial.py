@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_fracciones_stock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientodiario',
+            index=models.Index(fields=['producto', 'dia'], name='movdiario_producto_dia_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Tabla del caché compartido (CACHES en settings): así basta con `migrate` al desplegar.
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def crear_tabla_cache(apps, schema_editor):
+    # Solo crea las tablas de los cachés DatabaseCache que falten; con Redis no hace nada.
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_indice_historial'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tabla_cache, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.functions import Now
 from django.utils import timezone
 
 # --- Choices (Listas de Opciones) ---
@@ -41,12 +42,83 @@ class Producto(models.Model):
 
     # --- Stock y Logística ---
     pz = models.IntegerField(default=0, verbose_name="Piezas (Stock Actual)")
+    # Vacío: se usa el mínimo de su tipo (settings.STOCK_MINIMO_POR_TIPO); ver app/alertas.py
+    stock_minimo = models.PositiveIntegerField(
+        blank=True, null=True, verbose_name="Stock Mínimo",
+        help_text="Vacío: el mínimo de su tipo.",
+    )
+    # pz <= mínimo; la mantiene el servicio de stock en el mismo UPDATE que pz
+    bajo_minimo = models.BooleanField(default=False, editable=False, verbose_name="Bajo el Mínimo")
+    # 0: el stock vive en pz. N > 0: en N filas de FraccionStock y pz es la suma del
+    # último pliegue (ver app/fracciones.py); solo lo cambia fracciones.configurar.
+    fracciones = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="Fracciones del Contador")
     ubicacion = models.CharField(max_length=100, blank=True, null=True, verbose_name="Ubicación")
     descripcion = models.TextField(blank=True, null=True, verbose_name="Descripción / Notas")
 
+    # --- Sello de versión ---
+    # Sube con cada cambio (save, stock, importación, IA); da el ETag / Last-Modified
+    # de las vistas del producto y la clave de sus fragmentos en caché.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    modificado = models.DateTimeField(default=timezone.now, editable=False)
+
     def __str__(self):
         return f"{self.nombre_tela} ({self.sku})"
 
+    def save(self, *args, **kwargs):
+        actualizando = not self._state.adding and not args and not kwargs.get('force_insert')
+        campos = kwargs.get('update_fields')
+        if actualizando and campos is None:
+            # bajo_minimo y fracciones solo se escriben con UPDATE en SQL (stock, alertas,
+            # fracciones): guardar una instancia leída antes no debe pisarlas con un valor viejo.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('bajo_minimo', 'fracciones')
+            ]
+        elif actualizando and campos:
+            kwargs['update_fields'] = [*campos, 'version', 'modificado']
+        else:
+            actualizando = False
+        if actualizando:
+            self.version = models.F('version') + 1
+            self.modificado = timezone.now()
+        super().save(*args, **kwargs)
+        if actualizando:
+            self.refresh_from_db(fields=['version'])
+
+    class Meta:
+        indexes = [
+            # Listado paginado por cursor: ORDER BY nombre_tela, sku
+            models.Index(fields=['nombre_tela', 'sku'], name='producto_nombre_sku_idx'),
+            # Top por stock (ORDER BY pz)
+            models.Index(fields=['pz'], name='producto_pz_idx'),
+            # Alertas de stock bajo: solo los productos marcados, ordenados por pz
+            models.Index(fields=['pz'], condition=models.Q(bajo_minimo=True), name='producto_bajo_minimo_idx'),
+        ]
+
+
+def nueva_version():
+    """Campos extra para un ``UPDATE`` que cambia el producto (ver ``Producto.version``)."""
+    return {'version': models.F('version') + 1, 'modificado': Now()}
+
+
+class FraccionStock(models.Model):
+    """
+    Una parte del stock de un producto con contador fraccionado
+    (``Producto.fracciones``). Ninguna parte baja de cero, así que el total
+    tampoco; ver ``app/fracciones.py``.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name="fracciones_stock")
+    indice = models.PositiveSmallIntegerField()
+    pz = models.PositiveIntegerField(default=0, verbose_name="Piezas")
+
+    def __str__(self):
+        return f"{self.producto_id} #{self.indice}: {self.pz}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'indice'], name='fraccionstock_unica'),
+        ]
+
 
 # --- Modelo de Historial: MovimientoInventario ---
 
@@ -79,9 +151,198 @@ class MovimientoInventario(models.Model):
     # Notas
     notas = models.CharField(max_length=255, blank=True, null=True)
 
+    # Clave generada por el cliente (kiosco/escáner) para que un reintento
+    # o una resincronización offline no duplique el movimiento.
+    clave_idempotencia = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Clave de Idempotencia"
+    )
+
     def __str__(self):
-        user_name = self.usuario.username if self.usuario else "Sistema"
+        # usuario_id primero: sin usuario no se consulta la tabla de usuarios
+        user_name = self.usuario.username if self.usuario_id else "Sistema"
         return f"{self.get_tipo_movimiento_display()} ({self.cantidad}) - {user_name}"
 
     class Meta:
-        ordering = ['-fecha']
\ No newline at end of file
+        ordering = ['-fecha']
+        indexes = [
+            # Historial general (reportes, paginación por (fecha, id))
+            models.Index(fields=['fecha'], name='movimiento_fecha_idx'),
+            # Actividad reciente de un producto
+            models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha_idx'),
+            # Filtros por tipo dentro de un rango de fechas
+            models.Index(fields=['tipo_movimiento', 'fecha'], name='movimiento_tipo_fecha_idx'),
+        ]
+
+
+
+# --- Archivo de Movimientos Viejos ---
+
+class MovimientoArchivado(models.Model):
+    """
+    Movimiento más viejo que el horizonte de ``settings.ARCHIVO_HORIZONTE_DIAS``,
+    movido fuera de ``MovimientoInventario`` por ``manage.py archivar_movimientos``.
+    Conserva el ``id`` original y los mismos nombres de campo, así reportes y
+    exportaciones lo leen igual que la tabla caliente (ver ``app/archivo.py``).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    producto = models.ForeignKey(
+        Producto,
+        on_delete=models.CASCADE,
+        related_name="movimientos_archivados"
+    )
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    tipo_movimiento = models.CharField(max_length=10, choices=TIPO_MOVIMIENTO_CHOICES)
+    cantidad = models.IntegerField(default=0)
+    fecha = models.DateTimeField()
+    notas = models.CharField(max_length=255, blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_movimiento_display()} ({self.cantidad}) - archivado"
+
+    class Meta:
+        ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['fecha'], name='archivado_fecha_idx'),
+        ]
+
+# --- Modelo de Resumen: MovimientoDiario ---
+
+class MovimientoDiario(models.Model):
+    """
+    Acumulado por (día, producto, tipo de movimiento). Lo mantiene el servicio
+    de stock en la misma transacción que cada movimiento, para que reportes y
+    dashboard no tengan que agregar sobre todo el historial.
+    """
+    dia = models.DateField()
+    producto = models.ForeignKey(
+        Producto,
+        on_delete=models.CASCADE,
+        related_name="resumenes_diarios"
+    )
+    tipo_movimiento = models.CharField(
+        max_length=10,
+        choices=TIPO_MOVIMIENTO_CHOICES
+    )
+    cantidad = models.IntegerField(default=0, verbose_name="Piezas")
+    movimientos = models.IntegerField(default=0, verbose_name="Número de Movimientos")
+
+    def __str__(self):
+        return f"{self.dia} {self.producto_id} {self.tipo_movimiento}: {self.cantidad}"
+
+    class Meta:
+        ordering = ['-dia']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'producto', 'tipo_movimiento'],
+                name='movimientodiario_unico'
+            ),
+        ]
+        indexes = [
+            # Cubre los totales por rango de días sin tocar la tabla
+            models.Index(
+                fields=['dia', 'tipo_movimiento', 'cantidad', 'movimientos'],
+                name='movdiario_dia_totales_idx'
+            ),
+            # Series de stock por SKU (app/historial.py): solo los días pedidos de cada producto
+            models.Index(fields=['producto', 'dia'], name='movdiario_producto_dia_idx'),
+        ]
+
+
+# --- Cola de Trabajos en Segundo Plano ---
+
+ESTADO_TRABAJO_CHOICES = [
+    ('PENDIENTE', 'Pendiente'),
+    ('EN_PROCESO', 'En proceso'),
+    ('TERMINADO', 'Terminado'),
+    ('FALLIDO', 'Fallido'),
+]
+
+
+class Trabajo(models.Model):
+    """
+    Tarea encolada en la base de datos. La ejecuta el comando ``trabajador``
+    fuera del ciclo de la petición (ver ``app/trabajos.py``).
+    """
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=12, choices=ESTADO_TRABAJO_CHOICES, default='PENDIENTE')
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=3)
+
+    creado = models.DateTimeField(auto_now_add=True)
+    # No se toma antes de esta hora (reintentos con espera)
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    trabajador = models.CharField(max_length=100, blank=True, default='')
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.get_estado_display()})"
+
+    class Meta:
+        ordering = ['-creado']
+        indexes = [
+            # El trabajador busca: estado = PENDIENTE AND disponible_desde <= ahora
+            models.Index(fields=['estado', 'disponible_desde'], name='trabajo_estado_disp_idx'),
+        ]
+
+
+# --- Caché de Respuestas de IA ---
+
+class RespuestaIA(models.Model):
+    """
+    Respuesta del modelo de IA guardada por hash del prompt. Se comparte
+    entre el sitio y el trabajador; al pasar del límite se borran las menos
+    usadas recientemente (LRU por ``ultimo_uso``).
+    """
+    clave = models.CharField(max_length=64, primary_key=True)
+    modelo = models.CharField(max_length=100)
+    respuesta = models.TextField()
+    creado = models.DateTimeField(auto_now_add=True)
+    ultimo_uso = models.DateTimeField(default=timezone.now)
+    aciertos = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.modelo} {self.clave[:12]}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ultimo_uso'], name='respuestaia_ultimo_uso_idx'),
+        ]
+
+
+# --- Puntos de Control de Stock ---
+
+class PuntoControlStock(models.Model):
+    """
+    Stock de un producto según el libro de movimientos al momento de un
+    corte. Conciliar solo necesita sumar los movimientos posteriores a
+    ``ultimo_movimiento`` (ver ``app/conciliacion.py``).
+    """
+    producto = models.ForeignKey(
+        Producto,
+        on_delete=models.CASCADE,
+        related_name="puntos_control"
+    )
+    fecha = models.DateTimeField(verbose_name="Fecha del Corte")
+    pz = models.IntegerField(verbose_name="Piezas según el Historial")
+    # id del último MovimientoInventario incluido en ``pz``
+    ultimo_movimiento = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.producto_id} @ {self.fecha:%Y-%m-%d %H:%M}: {self.pz}"
+
+    class Meta:
+        ordering = ['-fecha']
+        constraints = [
+            # También es el índice para "último corte de este producto (antes de X)"
+            models.UniqueConstraint(fields=['producto', 'fecha'], name='puntocontrol_producto_fecha_unico'),
+        ]
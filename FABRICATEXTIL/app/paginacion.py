@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Paginación por cursor (keyset).
+
+En lugar de ``OFFSET`` se filtra por la última fila vista, por ejemplo
+``(nombre_tela, sku) > ('Popelina', 'POP-010')``, así la página N cuesta lo
+mismo que la primera y nunca hace falta un ``COUNT(*)``. El orden debe
+terminar en un campo único (``sku``, ``id``) para que no haya empates.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+TAMANO_PAGINA = 50
+
+
+class PaginaKeyset:
+    """Una página de resultados con los cursores para moverse a los lados."""
+
+    def __init__(self, items, siguiente=None, anterior=None):
+        self.items = items
+        self.siguiente = siguiente
+        self.anterior = anterior
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _querystring(self, request, parametro, cursor):
+        params = request.GET.copy()
+        params.pop('despues', None)
+        params.pop('antes', None)
+        params[parametro] = cursor
+        return '?' + params.urlencode()
+
+    def url_siguiente(self, request):
+        if self.siguiente:
+            return self._querystring(request, 'despues', self.siguiente)
+        return None
+
+    def url_anterior(self, request):
+        if self.anterior:
+            return self._querystring(request, 'antes', self.anterior)
+        return None
+
+
+def _codificar(obj, nombres):
+    valores = []
+    for nombre in nombres:
+        valor = getattr(obj, nombre)
+        valores.append(valor.isoformat() if hasattr(valor, 'isoformat') else valor)
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+
+def _decodificar(cursor, modelo, nombres):
+    """Devuelve los valores del cursor ya convertidos, o ``None`` si no es válido."""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if len(valores) != len(nombres):
+            return None
+        return [modelo._meta.get_field(n).to_python(v) for n, v in zip(nombres, valores)]
+    except Exception:
+        return None
+
+
+def _filtro(campos, valores, hacia_adelante):
+    """
+    Arma ``(a, b) > (x, y)`` como ``a >= x AND (a > x OR (a = x AND b > y))``,
+    respetando si cada campo va ascendente o descendente. El ``a >= x`` de
+    fuera es redundante pero deja que el motor busque directo en el índice
+    en vez de recorrerlo desde el principio.
+    """
+    filtro = Q()
+    iguales = {}
+    for campo, valor in zip(campos, valores):
+        nombre = campo.lstrip('-')
+        descendente = campo.startswith('-')
+        operador = 'gt' if hacia_adelante != descendente else 'lt'
+        filtro |= Q(**iguales, **{f'{nombre}__{operador}': valor})
+        iguales[nombre] = valor
+
+    primero = campos[0].lstrip('-')
+    operador = 'gte' if hacia_adelante != campos[0].startswith('-') else 'lte'
+    return Q(**{f'{primero}__{operador}': valores[0]}) & filtro
+
+
+def _invertir(campos):
+    return [c[1:] if c.startswith('-') else '-' + c for c in campos]
+
+
+def _leer(querysets, filtro, orden, limite):
+    """Lee hasta ``limite`` filas pasando al siguiente queryset solo si hace falta."""
+    filas = []
+    for queryset in querysets:
+        if filtro is not None:
+            queryset = queryset.filter(filtro)
+        filas += queryset.order_by(*orden)[:limite - len(filas)]
+        if len(filas) >= limite:
+            break
+    return filas
+
+
+def paginar(queryset, campos, despues=None, antes=None, tamano=TAMANO_PAGINA):
+    """
+    Pagina ``queryset`` ordenado por ``campos`` (p. ej. ``['-fecha', '-id']``).
+
+    ``despues`` / ``antes`` son los cursores que vienen en la URL; sin ninguno
+    se devuelve la primera página. Se lee una fila de más para saber si hay
+    otra página en esa dirección.
+
+    ``queryset`` también puede ser una lista de querysets con los mismos
+    campos que, en ese orden, van uno después del otro (p. ej. la tabla
+    caliente y el archivo): se leen como si fueran uno solo.
+    """
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    nombres = [c.lstrip('-') for c in campos]
+    modelo = querysets[0].model
+
+    valores = _decodificar(antes, modelo, nombres) if antes else None
+    if valores is not None:
+        filas = _leer(
+            querysets[::-1], _filtro(campos, valores, hacia_adelante=False),
+            _invertir(campos), tamano + 1,
+        )
+        hay_mas = len(filas) > tamano
+        items = filas[:tamano][::-1]
+        if not items:
+            return PaginaKeyset([])
+        return PaginaKeyset(
+            items,
+            siguiente=_codificar(items[-1], nombres),
+            anterior=_codificar(items[0], nombres) if hay_mas else None,
+        )
+
+    valores = _decodificar(despues, modelo, nombres) if despues else None
+    filtro = _filtro(campos, valores, hacia_adelante=True) if valores is not None else None
+    filas = _leer(querysets, filtro, campos, tamano + 1)
+    items = filas[:tamano]
+    return PaginaKeyset(
+        items,
+        siguiente=_codificar(items[-1], nombres) if len(filas) > tamano else None,
+        anterior=_codificar(items[0], nombres) if items and valores is not None else None,
+    )
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Resumen diario de movimientos (``MovimientoDiario``).
+
+``acumular`` se llama desde el servicio de stock dentro de la misma
+transacción que inserta los movimientos, con un upsert
+``INSERT ... ON CONFLICT DO UPDATE SET cantidad = cantidad + excluded.cantidad``
+(SQLite 3.24+ y PostgreSQL). ``reconstruir`` y ``diferencias`` recalculan el
+resumen desde el historial crudo; los usa el comando ``resumen_diario``.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import MovimientoArchivado, MovimientoDiario, MovimientoInventario
+
+
+def acumular(movimientos):
+    """Suma ``movimientos`` (ya guardados, con ``fecha``) al resumen diario."""
+    grupos = defaultdict(lambda: [0, 0])
+    for mov in movimientos:
+        clave = (timezone.localdate(mov.fecha), mov.producto_id, mov.tipo_movimiento)
+        grupos[clave][0] += mov.cantidad
+        grupos[clave][1] += 1
+    if not grupos:
+        return
+
+    tabla = connection.ops.quote_name(MovimientoDiario._meta.db_table)
+    filas, params = [], []
+    for (dia, sku, tipo), (cantidad, numero) in grupos.items():
+        filas.append('(%s, %s, %s, %s, %s)')
+        params += [connection.ops.adapt_datefield_value(dia), sku, tipo, cantidad, numero]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {tabla} (dia, producto_id, tipo_movimiento, cantidad, movimientos) "
+            f"VALUES {', '.join(filas)} "
+            f"ON CONFLICT (dia, producto_id, tipo_movimiento) DO UPDATE SET "
+            f"cantidad = {tabla}.cantidad + excluded.cantidad, "
+            f"movimientos = {tabla}.movimientos + excluded.movimientos",
+            params,
+        )
+
+
+def _agregado_crudo(desde=None, hasta=None):
+    """
+    Agrega el historial crudo por (día, producto, tipo), sumando la tabla
+    caliente y la de movimientos archivados (un día puede quedar partido).
+    """
+    grupos = defaultdict(lambda: [0, 0])
+    for modelo in (MovimientoInventario, MovimientoArchivado):
+        movimientos = modelo.objects.annotate(dia=TruncDate('fecha'))
+        if desde:
+            movimientos = movimientos.filter(dia__gte=desde)
+        if hasta:
+            movimientos = movimientos.filter(dia__lte=hasta)
+        filas = (
+            movimientos.order_by()
+            .values_list('dia', 'producto_id', 'tipo_movimiento')
+            .annotate(cantidad=Sum('cantidad'), movimientos=Count('id'))
+        )
+        for dia, sku, tipo, cantidad, numero in filas.iterator():
+            grupos[dia, sku, tipo][0] += cantidad
+            grupos[dia, sku, tipo][1] += numero
+    for (dia, sku, tipo), (cantidad, numero) in grupos.items():
+        yield {
+            'dia': dia, 'producto_id': sku, 'tipo_movimiento': tipo,
+            'cantidad': cantidad, 'movimientos': numero,
+        }
+
+
+def _filtrar_resumen(desde=None, hasta=None):
+    resumen = MovimientoDiario.objects.all()
+    if desde:
+        resumen = resumen.filter(dia__gte=desde)
+    if hasta:
+        resumen = resumen.filter(dia__lte=hasta)
+    return resumen
+
+
+def reconstruir(desde=None, hasta=None, tamano_lote=1000):
+    """Borra y recalcula el resumen del rango indicado. Devuelve las filas creadas."""
+    with transaction.atomic():
+        _filtrar_resumen(desde, hasta).delete()
+        nuevos = [
+            MovimientoDiario(
+                dia=fila['dia'],
+                producto_id=fila['producto_id'],
+                tipo_movimiento=fila['tipo_movimiento'],
+                cantidad=fila['cantidad'],
+                movimientos=fila['movimientos'],
+            )
+            for fila in _agregado_crudo(desde, hasta)
+        ]
+        MovimientoDiario.objects.bulk_create(nuevos, batch_size=tamano_lote)
+    return len(nuevos)
+
+
+def diferencias(desde=None, hasta=None):
+    """
+    Compara el resumen contra el historial crudo. Devuelve una lista de
+    ``(clave, esperado, guardado)`` donde cada valor es ``(cantidad, movimientos)``
+    o ``None`` si la fila falta.
+    """
+    esperado = {
+        (f['dia'], f['producto_id'], f['tipo_movimiento']): (f['cantidad'], f['movimientos'])
+        for f in _agregado_crudo(desde, hasta)
+    }
+    guardado = {
+        (r.dia, r.producto_id, r.tipo_movimiento): (r.cantidad, r.movimientos)
+        for r in _filtrar_resumen(desde, hasta).iterator()
+    }
+    return [
+        (clave, esperado.get(clave), guardado.get(clave))
+        for clave in sorted(set(esperado) | set(guardado), key=str)
+        if esperado.get(clave) != guardado.get(clave)
+    ]
+
+
+def totales_por_tipo(desde=None, hasta=None):
+    """
+    Totales de piezas y movimientos por tipo en el rango (días locales,
+    inclusivos), leídos del resumen: ``{'ENTRADA': {'cantidad', 'movimientos'}, ...}``.
+    """
+    # Un solo agregado con SUM(... FILTER ...) por tipo en lugar de GROUP BY:
+    # así el rango de días se lee directo del índice, sin ordenar por tipo.
+    agregados = {}
+    for tipo in ('ENTRADA', 'SALIDA'):
+        agregados[f'{tipo}_cantidad'] = Sum('cantidad', filter=Q(tipo_movimiento=tipo))
+        agregados[f'{tipo}_movimientos'] = Sum('movimientos', filter=Q(tipo_movimiento=tipo))
+    fila = _filtrar_resumen(desde, hasta).order_by().aggregate(**agregados)
+    return {
+        tipo: {
+            'cantidad': fila[f'{tipo}_cantidad'] or 0,
+            'movimientos': fila[f'{tipo}_movimientos'] or 0,
+        }
+        for tipo in ('ENTRADA', 'SALIDA')
+    }
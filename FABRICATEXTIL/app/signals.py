@@ -0,0 +1,35 @@
+"""
+Señales de los modelos del inventario.
+
+Los cambios de stock del servicio (``app.stock``) usan ``UPDATE`` directo y
+avisan por su cuenta; aquí solo llegan altas, ediciones y bajas de
+``Producto`` hechas con ``save()`` / ``delete()`` (formularios y admin), y
+los cruces del stock mínimo (``alertas.umbral_cruzado``).
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import alertas, kpis
+from .models import Producto
+
+
+@receiver(post_save, sender=Producto)
+def producto_guardado(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        kpis.producto_creado(instance)
+    else:
+        kpis.producto_editado()
+    # El tipo o el stock mínimo pudieron cambiar: la marca de stock bajo se revisa en SQL.
+    alertas.recalcular([instance.pk])
+
+
+@receiver(post_delete, sender=Producto)
+def producto_borrado(sender, instance, **kwargs):
+    kpis.producto_eliminado(instance)
+
+
+@receiver(alertas.umbral_cruzado)
+def umbral_cruzado(sender, sku, bajo, **kwargs):
+    kpis.cruce_umbral(bajo)
@@ -0,0 +1,136 @@
+/*
+ * Cola local de escaneos (modo offline).
+ *
+ * Cada escaneo se guarda en localStorage con una clave única generada en el
+ * teléfono. Cuando hay conexión la cola se envía en lotes al endpoint de
+ * sincronización; el servidor ignora las claves que ya aplicó, así que
+ * reenviar un lote (por un corte a media respuesta) nunca duplica stock.
+ *
+ * Solo se reintenta lo que puede salir distinto la próxima vez (sin red o
+ * error 5xx). Un lote que el servidor rechaza con 4xx (sesión vencida,
+ * datos inválidos) se aparta a otra lista para no tapar a los que siguen;
+ * ``reintentarApartados`` lo regresa a la cola.
+ */
+(function (window) {
+    'use strict';
+
+    var STORAGE_KEY = 'fabricatextil.cola_escaneos';
+    var STORAGE_KEY_APARTADOS = 'fabricatextil.cola_escaneos.apartados';
+    var TAMANO_LOTE = 200;
+    var INTERVALO_MS = 15000;
+
+    function generarClave() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        // randomUUID solo existe en contextos seguros (https); en la red local
+        // del almacén usamos getRandomValues, que sí está disponible.
+        var bytes = new Uint8Array(16);
+        window.crypto.getRandomValues(bytes);
+        return Array.prototype.map.call(bytes, function (b) {
+            return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+    }
+
+    function leer(llave) {
+        try {
+            return JSON.parse(window.localStorage.getItem(llave || STORAGE_KEY)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function guardar(cola, llave) {
+        window.localStorage.setItem(llave || STORAGE_KEY, JSON.stringify(cola));
+    }
+
+    function sinLote(lote) {
+        var enviadas = {};
+        lote.forEach(function (item) { enviadas[item.clave] = true; });
+        var cola = leer().filter(function (item) { return !enviadas[item.clave]; });
+        guardar(cola);
+        return cola;
+    }
+
+    function ColaEscaneos(opciones) {
+        this.url = opciones.url;
+        this.csrfToken = opciones.csrfToken;
+        this.onCambio = opciones.onCambio || function () {};
+        this.onRechazo = opciones.onRechazo || function () {};
+        this.enviando = false;
+
+        var self = this;
+        window.addEventListener('online', function () { self.sincronizar(); });
+        window.setInterval(function () { self.sincronizar(); }, INTERVALO_MS);
+        this.onCambio(this.pendientes());
+    }
+
+    ColaEscaneos.generarClave = generarClave;
+
+    ColaEscaneos.prototype.pendientes = function () {
+        return leer().length;
+    };
+
+    ColaEscaneos.prototype.apartados = function () {
+        return leer(STORAGE_KEY_APARTADOS).length;
+    };
+
+    ColaEscaneos.prototype.reintentarApartados = function () {
+        var apartados = leer(STORAGE_KEY_APARTADOS);
+        guardar(leer().concat(apartados));
+        guardar([], STORAGE_KEY_APARTADOS);
+        this.onCambio(this.pendientes());
+        return this.sincronizar();
+    };
+
+    ColaEscaneos.prototype.encolar = function (sku, tipo, cantidad) {
+        var cola = leer();
+        cola.push({ sku: sku, tipo: tipo, cantidad: cantidad || 1, clave: generarClave() });
+        guardar(cola);
+        this.onCambio(cola.length);
+        this.sincronizar();
+    };
+
+    ColaEscaneos.prototype.sincronizar = function () {
+        var self = this;
+        if (self.enviando || !navigator.onLine) return Promise.resolve();
+        var lote = leer().slice(0, TAMANO_LOTE);
+        if (!lote.length) return Promise.resolve();
+
+        self.enviando = true;
+        return fetch(self.url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': self.csrfToken },
+            credentials: 'same-origin',
+            body: JSON.stringify({ escaneos: lote })
+        }).then(function (respuesta) {
+            // 409: el lote se aplicó, pero alguna clave venía con otros datos.
+            if (respuesta.ok || respuesta.status === 409) {
+                return respuesta.json().then(function (data) {
+                    var cola = sinLote(lote);
+                    data.resultados.forEach(function (resultado, i) {
+                        if (!resultado.ok) self.onRechazo(lote[i], resultado);
+                    });
+                    return cola;
+                });
+            }
+            if (respuesta.status >= 400 && respuesta.status < 500) {
+                // Reenviarlo daría lo mismo: se aparta y sigue el siguiente lote.
+                guardar(leer(STORAGE_KEY_APARTADOS).concat(lote), STORAGE_KEY_APARTADOS);
+                var error = { ok: false, error: 'HTTP ' + respuesta.status };
+                lote.forEach(function (item) { self.onRechazo(item, error); });
+                return sinLote(lote);
+            }
+            throw new Error('HTTP ' + respuesta.status);
+        }).then(function (cola) {
+            self.enviando = false;
+            self.onCambio(cola.length);
+            if (cola.length) return self.sincronizar();
+        }).catch(function () {
+            // Sin red o servidor caído (5xx): la cola se conserva para el próximo intento.
+            self.enviando = false;
+        });
+    };
+
+    window.ColaEscaneos = ColaEscaneos;
+})(window);
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Capa única de mutación de stock.
+
+Todas las vistas que mueven inventario (kiosco, entradas/salidas manuales y
+ajustes) pasan por aquí. El cambio se aplica con un UPDATE condicional
+(``pz = pz ± n WHERE pz >= n``) y el ``MovimientoInventario`` se escribe en
+la misma transacción, así dos escaneos simultáneos del mismo SKU nunca se
+pisan entre sí. El resumen diario (``MovimientoDiario``) también se
+actualiza dentro de esa transacción, y la marca de stock bajo
+(``bajo_minimo``, ver ``app/alertas.py``) en el mismo UPDATE que ``pz``.
+
+Los SKUs con contador fraccionado (``Producto.fracciones``) mueven una de sus
+fracciones en lugar de ``pz``; ver ``app/fracciones.py``.
+
+Las vistas async llaman al servicio con ``en_fila`` (ver abajo).
+"""
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from . import alertas, fracciones, kpis, metricas, resumenes
+from .models import Producto, MovimientoInventario, nueva_version
+
+
+class StockInsuficiente(Exception):
+    """Se intentó sacar más piezas de las que hay en existencia."""
+
+    def __init__(self, sku, disponible, solicitado):
+        self.sku = sku
+        self.disponible = disponible
+        self.solicitado = solicitado
+        super().__init__(
+            f"Stock insuficiente para {sku}: hay {disponible}, se pidieron {solicitado}."
+        )
+
+
+class ClaveReutilizada(Exception):
+    """La clave de idempotencia ya se usó para un movimiento distinto."""
+
+    def __init__(self, clave, movimiento):
+        self.clave = clave
+        self.movimiento = movimiento
+        super().__init__(f"La clave {clave} ya se usó para otro movimiento.")
+
+
+def _sku(producto):
+    return producto.pk if isinstance(producto, Producto) else producto
+
+
+def _mismo_movimiento(movimiento, sku, tipo_movimiento, cantidad):
+    return (movimiento.producto_id, movimiento.tipo_movimiento, movimiento.cantidad) == (
+        sku, tipo_movimiento, cantidad,
+    )
+
+
+def _aplicar_en_fracciones(sku, tipo_movimiento, cantidad, fracciones_sku):
+    # Devuelve False si el SKU ya no está fraccionado.
+    if fracciones.mover(sku, tipo_movimiento, cantidad, fracciones_sku):
+        return True
+    # Ninguna fracción alcanzó sola (o cambió cuántas hay): se bloquean todas.
+    partes = fracciones.bloquear(sku)
+    if not partes:
+        return False
+    disponible = sum(parte.pz for parte in partes)
+    delta = cantidad if tipo_movimiento == 'ENTRADA' else -cantidad
+    if disponible + delta < 0:
+        raise StockInsuficiente(sku, disponible, cantidad)
+    fracciones.cambiar(partes, delta)
+    return True
+
+
+def _aplicar_delta(sku, tipo_movimiento, cantidad, fracciones_sku=0):
+    """
+    Ejecuta el UPDATE atómico sobre ``pz``. Debe llamarse dentro de una
+    transacción. Lanza ``StockInsuficiente`` si la salida no cabe.
+
+    Devuelve ``True`` si el SKU está fraccionado y el movimiento cayó en sus
+    fracciones: ``pz`` no cambia hasta el siguiente pliegue.
+    ``fracciones_sku`` es ``Producto.fracciones`` si el llamador ya lo tiene.
+    """
+    if fracciones_sku and _aplicar_en_fracciones(sku, tipo_movimiento, cantidad, fracciones_sku):
+        return True
+    productos = Producto.objects.filter(pk=sku)
+    sin_fracciones = productos.filter(fracciones=0)
+    if tipo_movimiento == 'ENTRADA':
+        filas = sin_fracciones.update(
+            pz=F('pz') + cantidad, bajo_minimo=alertas.bajo(F('pz') + cantidad), **nueva_version(),
+        )
+    else:
+        filas = sin_fracciones.filter(pz__gte=cantidad).update(
+            pz=F('pz') - cantidad, bajo_minimo=alertas.bajo(F('pz') - cantidad), **nueva_version(),
+        )
+
+    if not filas:
+        # O el SKU no existe, o no alcanzó el stock, o está fraccionado.
+        fila = productos.values_list('pz', 'fracciones').first()
+        if fila is None:
+            raise Producto.DoesNotExist(f"No existe el producto {sku}")
+        disponible, fracciones_sku = fila
+        if fracciones_sku:
+            return (
+                _aplicar_en_fracciones(sku, tipo_movimiento, cantidad, fracciones_sku)
+                or _aplicar_delta(sku, tipo_movimiento, cantidad)
+            )
+        raise StockInsuficiente(sku, disponible, cantidad)
+    return False
+
+
+def registrar_movimiento(producto, tipo_movimiento, cantidad, usuario=None, notas=None, clave=None):
+    """
+    Aplica una ENTRADA o SALIDA y devuelve el ``MovimientoInventario`` creado.
+
+    ``producto`` puede ser la instancia o su SKU. Si se pasa la instancia, su
+    ``pz`` queda actualizado con el valor real después del movimiento.
+
+    ``clave`` es la clave de idempotencia del cliente: si ya existe un
+    movimiento con esa clave se devuelve ése y el stock no se toca. Si ese
+    movimiento es de otro SKU, tipo o cantidad se lanza ``ClaveReutilizada``.
+    """
+    if tipo_movimiento not in ('ENTRADA', 'SALIDA'):
+        raise ValueError(f"Tipo de movimiento inválido: {tipo_movimiento}")
+    if cantidad is None or cantidad <= 0:
+        raise ValueError("La cantidad debe ser mayor a cero.")
+
+    sku = _sku(producto)
+    fracciones_sku = producto.fracciones if isinstance(producto, Producto) else 0
+    if clave:
+        previo = MovimientoInventario.objects.filter(clave_idempotencia=clave).first()
+        if previo is not None:
+            return _repeticion(previo, clave, sku, tipo_movimiento, cantidad)
+
+    try:
+        with transaction.atomic():
+            en_fracciones = _aplicar_delta(sku, tipo_movimiento, cantidad, fracciones_sku)
+            movimiento = MovimientoInventario.objects.create(
+                producto_id=sku,
+                tipo_movimiento=tipo_movimiento,
+                cantidad=cantidad,
+                notas=notas,
+                usuario=usuario,
+                clave_idempotencia=clave or None,
+            )
+            resumenes.acumular([movimiento])
+            if en_fracciones:
+                # KPIs y avisos siguen a la suma en caché: se ponen al día al plegar.
+                pz_actual = fracciones.total(sku)
+            else:
+                pz_actual, minimo = (
+                    alertas.con_minimo(Producto.objects.filter(pk=sku)).values_list('pz', 'minimo').get()
+                )
+                delta = cantidad if tipo_movimiento == 'ENTRADA' else -cantidad
+                kpis.cambio_stock(sku, pz_actual - delta, pz_actual)
+                alertas.cambio_stock(sku, pz_actual - delta, pz_actual, minimo)
+            kpis.movimientos_registrados([tipo_movimiento])
+            metricas.movimientos_registrados([tipo_movimiento])
+    except IntegrityError:
+        # Un reintento simultáneo con la misma clave ganó la carrera; el
+        # UPDATE de este intento ya se deshizo junto con la transacción.
+        if not clave:
+            raise
+        previo = MovimientoInventario.objects.get(clave_idempotencia=clave)
+        return _repeticion(previo, clave, sku, tipo_movimiento, cantidad)
+
+    if isinstance(producto, Producto):
+        producto.pz = pz_actual
+    return movimiento
+
+
+def _repeticion(previo, clave, sku, tipo_movimiento, cantidad):
+    if not _mismo_movimiento(previo, sku, tipo_movimiento, cantidad):
+        raise ClaveReutilizada(clave, previo)
+    return previo
+
+
+def ajustar_stock(producto, nueva_cantidad, usuario=None):
+    """
+    Lleva el stock a ``nueva_cantidad`` registrando la diferencia como
+    movimiento. Usa compare-and-set sobre ``pz`` y reintenta si otro proceso
+    cambió el stock entre la lectura y la escritura (un SKU fraccionado
+    bloquea sus fracciones, ver ``fracciones.fijar``). Devuelve el movimiento
+    creado o ``None`` si no hubo diferencia.
+    """
+    if nueva_cantidad < 0:
+        raise ValueError("El stock no puede ser negativo.")
+
+    sku = _sku(producto)
+    while True:
+        with transaction.atomic():
+            cantidad_actual, minimo, fracciones_sku = (
+                alertas.con_minimo(Producto.objects.filter(pk=sku))
+                .values_list('pz', 'minimo', 'fracciones').get()
+            )
+            if fracciones_sku:
+                cantidad_actual = fracciones.fijar(sku, nueva_cantidad)
+                if cantidad_actual is None:
+                    continue
+            elif cantidad_actual != nueva_cantidad:
+                filas = Producto.objects.filter(pk=sku, pz=cantidad_actual, fracciones=0).update(
+                    pz=nueva_cantidad, bajo_minimo=alertas.bajo(nueva_cantidad), **nueva_version(),
+                )
+                if not filas:
+                    continue
+                kpis.cambio_stock(sku, cantidad_actual, nueva_cantidad)
+                alertas.cambio_stock(sku, cantidad_actual, nueva_cantidad, minimo)
+            diferencia = nueva_cantidad - cantidad_actual
+            if diferencia == 0:
+                movimiento = None
+                break
+            movimiento = MovimientoInventario.objects.create(
+                producto_id=sku,
+                tipo_movimiento='ENTRADA' if diferencia > 0 else 'SALIDA',
+                cantidad=abs(diferencia),
+                notas=f"Ajuste manual. Anterior: {cantidad_actual}",
+                usuario=usuario,
+            )
+            resumenes.acumular([movimiento])
+            kpis.movimientos_registrados([movimiento.tipo_movimiento])
+            metricas.movimientos_registrados([movimiento.tipo_movimiento])
+            break
+
+    if isinstance(producto, Producto):
+        producto.pz = nueva_cantidad
+    return movimiento
+
+
+def _simular(pz_inicial, lineas):
+    """
+    Recorre las líneas de un SKU en orden partiendo de ``pz_inicial``.
+    Devuelve ``(aceptadas, rechazadas, pz_final)``; una salida se rechaza si
+    en ese punto no hay piezas suficientes.
+    """
+    pz = pz_inicial
+    aceptadas, rechazadas = [], []
+    for linea in lineas:
+        if linea['tipo_movimiento'] == 'ENTRADA':
+            pz += linea['cantidad']
+            aceptadas.append((linea, pz))
+        elif pz >= linea['cantidad']:
+            pz -= linea['cantidad']
+            aceptadas.append((linea, pz))
+        else:
+            rechazadas.append((linea, pz))
+    return aceptadas, rechazadas, pz
+
+
+def registrar_lote(lineas, usuario=None, notas='Escaneo en Lote'):
+    """
+    Aplica muchos escaneos de una sola vez.
+
+    ``lineas`` es una lista de dicts con ``sku``, ``tipo_movimiento``,
+    ``cantidad`` y opcionalmente ``clave`` (idempotencia), ya validados. Los
+    SKUs y las claves ya registradas se resuelven en una consulta cada uno, se
+    aplica un UPDATE (compare-and-set) por SKU con el delta neto (un SKU
+    fraccionado bloquea sus fracciones y les suma el delta) y los movimientos
+    se insertan con ``bulk_create``; todo en una transacción.
+
+    Devuelve un resultado por línea, en el mismo orden de entrada. Las líneas
+    cuya clave ya existía regresan ``duplicado=True`` y no mueven stock; si la
+    clave era de un movimiento distinto, ``error='clave_reutilizada'``.
+    """
+    while True:
+        try:
+            return _registrar_lote(lineas, usuario, notas)
+        except IntegrityError:
+            # Otro lote con alguna de nuestras claves se confirmó primero;
+            # repetimos y esas líneas saldrán como duplicadas.
+            if not any(linea.get('clave') for linea in lineas):
+                raise
+
+
+def _registrar_lote(lineas, usuario, notas):
+    resultados = [None] * len(lineas)
+
+    claves = {linea['clave'] for linea in lineas if linea.get('clave')}
+    previos = {}
+    if claves:
+        previos = {
+            m.clave_idempotencia: m
+            for m in MovimientoInventario.objects.filter(clave_idempotencia__in=claves).order_by()
+        }
+
+    por_sku = {}
+    vistas = {}
+    for indice, linea in enumerate(lineas):
+        clave = linea.get('clave')
+        datos = (linea['sku'], linea['tipo_movimiento'], linea['cantidad'])
+        if clave in previos:
+            movimiento = previos[clave]
+            if _mismo_movimiento(movimiento, *datos):
+                resultados[indice] = {'ok': True, 'duplicado': True, 'movimiento': movimiento}
+            else:
+                resultados[indice] = {'ok': False, 'error': 'clave_reutilizada'}
+            continue
+        if clave and clave in vistas:
+            if vistas[clave] == datos:
+                resultados[indice] = {'ok': True, 'duplicado': True}
+            else:
+                resultados[indice] = {'ok': False, 'error': 'clave_reutilizada'}
+            continue
+        vistas[clave] = datos
+        por_sku.setdefault(linea['sku'], []).append(dict(linea, indice=indice))
+
+    existentes = Producto.objects.in_bulk(list(por_sku), field_name='sku')
+    for sku in list(por_sku):
+        if sku not in existentes:
+            for linea in por_sku.pop(sku):
+                resultados[linea['indice']] = {'ok': False, 'error': 'sku_inexistente'}
+
+    nuevos = []
+    with transaction.atomic():
+        # Siempre en orden de SKU: dos lotes con los mismos SKUs toman los candados
+        # de sus filas en el mismo orden y no se bloquean mutuamente (PostgreSQL).
+        for sku in sorted(por_sku):
+            lineas_sku = por_sku[sku]
+            pz_leido, fracciones_sku = existentes[sku].pz, existentes[sku].fracciones
+            partes = []
+            while True:
+                if fracciones_sku:
+                    partes = fracciones.bloquear(sku)
+                    pz_leido = sum(parte.pz for parte in partes)
+                aceptadas, rechazadas, pz_final = _simular(pz_leido, lineas_sku)
+                if partes:
+                    fracciones.cambiar(partes, pz_final - pz_leido)
+                    break
+                filas = Producto.objects.filter(pk=sku, pz=pz_leido, fracciones=0).update(
+                    pz=pz_final, bajo_minimo=alertas.bajo(pz_final), **nueva_version(),
+                )
+                if filas:
+                    break
+                # Otro kiosco movió este SKU entre la lectura y el UPDATE (o lo fraccionaron).
+                pz_leido, fracciones_sku = Producto.objects.values_list('pz', 'fracciones').get(pk=sku)
+            if not partes:
+                kpis.cambio_stock(sku, pz_leido, pz_final)
+                alertas.cambio_stock(sku, pz_leido, pz_final, alertas.minimo_de(existentes[sku]))
+
+            for linea, pz in aceptadas:
+                movimiento = MovimientoInventario(
+                    producto_id=sku,
+                    tipo_movimiento=linea['tipo_movimiento'],
+                    cantidad=linea['cantidad'],
+                    notas=notas,
+                    usuario=usuario,
+                    clave_idempotencia=linea.get('clave') or None,
+                )
+                nuevos.append(movimiento)
+                resultados[linea['indice']] = {'ok': True, 'pz': pz, 'movimiento': movimiento}
+            for linea, pz in rechazadas:
+                resultados[linea['indice']] = {
+                    'ok': False, 'error': 'stock_insuficiente', 'disponible': pz,
+                }
+
+        MovimientoInventario.objects.bulk_create(nuevos)
+        resumenes.acumular(nuevos)
+        kpis.movimientos_registrados([m.tipo_movimiento for m in nuevos])
+        metricas.movimientos_registrados([m.tipo_movimiento for m in nuevos])
+
+    return resultados
+
+
+# --- Llamadas desde vistas async ---
+
+_filas = weakref.WeakKeyDictionary()
+
+
+def _escrituras_concurrentes():
+    # SQLite admite un solo escritor: más transacciones a la vez solo pelean el candado.
+    por_defecto = 1 if connection.vendor == 'sqlite' else None
+    return getattr(settings, 'ESCRITURAS_CONCURRENTES', por_defecto)
+
+
+async def en_fila(funcion, *args, **kwargs):
+    """
+    Corre ``funcion`` del servicio (síncrona, con transacciones) en el hilo
+    de la petición. Con un límite de ``ESCRITURAS_CONCURRENTES`` las
+    escrituras del proceso hacen fila en el event loop, sin ocupar hilos, en
+    vez de esperar el candado de SQLite hasta vencer su ``timeout``.
+    """
+    limite = _escrituras_concurrentes()
+    if not limite:
+        return await sync_to_async(funcion)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    fila = _filas.get(loop)
+    if fila is None:
+        fila = _filas[loop] = asyncio.Semaphore(limite)
+    async with fila:
+        return await sync_to_async(funcion)(*args, **kwargs)
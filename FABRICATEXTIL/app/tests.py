@@ -3,10 +3,48 @@ This file demonstrates writing tests using the unittest module. These will pass
 when you run "manage.py test".
 """
 
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from datetime import datetime, time as hora, timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 import django
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.http import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app import (
+    alertas, archivo, bd, busqueda, carga, conciliacion, etiquetas, exportar, fracciones, historial, ia, importar,
+    kpis, metricas, paginacion, resumenes, stock, trabajos,
+)
+from app.models import (
+    Producto, FraccionStock, MovimientoArchivado, MovimientoInventario, MovimientoDiario, PuntoControlStock,
+    RespuestaIA, Trabajo,
+)
 
-# TODO: Configure your database in settings.py and sync before running tests.
+# Los presupuestos de consultas cuentan la base, no el caché: esas pruebas usan
+# uno en memoria en vez de la tabla de caché de settings.
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
 
 class ViewTest(TestCase):
     """Tests for the application views."""
@@ -20,15 +58,1725 @@ class ViewTest(TestCase):
 
     def test_home(self):
         """Tests the home page."""
-        response = self.client.get('/')
-        self.assertContains(response, 'Home Page', 1, 200)
+        response = self.client.get(reverse('app:index'))
+        self.assertContains(response, 'Panel de Control', status_code=200)
 
     def test_contact(self):
         """Tests the contact page."""
-        response = self.client.get('/contact')
-        self.assertContains(response, 'Contact', 3, 200)
+        response = self.client.get(reverse('app:contact'))
+        self.assertContains(response, 'Contacto', status_code=200)
 
     def test_about(self):
         """Tests the about page."""
-        response = self.client.get('/about')
-        self.assertContains(response, 'About', 3, 200)
+        response = self.client.get(reverse('app:about'))
+        self.assertContains(response, 'Acerca de Fabricatextil', 1, 200)
+
+
+# --- Pruebas del servicio de stock ---
+
+class StockServiceTest(TestCase):
+    """Pruebas de la capa de mutación de stock."""
+
+    def setUp(self):
+        self.producto = Producto.objects.create(sku='TEL-001', nombre_tela='Popelina', pz=10)
+
+    def test_entrada_y_salida(self):
+        stock.registrar_movimiento(self.producto, 'ENTRADA', 5)
+        self.assertEqual(self.producto.pz, 15)
+        stock.registrar_movimiento(self.producto, 'SALIDA', 15)
+        self.assertEqual(Producto.objects.get(pk='TEL-001').pz, 0)
+        self.assertEqual(MovimientoInventario.objects.count(), 2)
+
+    def test_salida_sin_stock_no_escribe(self):
+        with self.assertRaises(stock.StockInsuficiente) as ctx:
+            stock.registrar_movimiento(self.producto, 'SALIDA', 11)
+        self.assertEqual(ctx.exception.disponible, 10)
+        self.assertEqual(Producto.objects.get(pk='TEL-001').pz, 10)
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+    def test_cantidad_invalida(self):
+        with self.assertRaises(ValueError):
+            stock.registrar_movimiento(self.producto, 'ENTRADA', 0)
+
+    def test_ajuste_registra_diferencia(self):
+        movimiento = stock.ajustar_stock(self.producto, 4)
+        self.assertEqual(movimiento.tipo_movimiento, 'SALIDA')
+        self.assertEqual(movimiento.cantidad, 6)
+        self.assertEqual(Producto.objects.get(pk='TEL-001').pz, 4)
+        self.assertIsNone(stock.ajustar_stock(self.producto, 4))
+
+    def test_kiosco_usa_el_servicio(self):
+        url = reverse('app:kiosco_movimiento', args=['TEL-001'])
+        self.client.post(url, {'tipo': 'salida', 'cantidad': 3})
+        self.assertEqual(Producto.objects.get(pk='TEL-001').pz, 7)
+        self.client.post(url, {'tipo': 'salida', 'cantidad': 30})
+        self.assertEqual(Producto.objects.get(pk='TEL-001').pz, 7)
+        self.assertEqual(MovimientoInventario.objects.count(), 1)
+
+    def test_kiosco_json(self):
+        url = reverse('app:kiosco_movimiento', args=['TEL-001'])
+        etag = self.client.get(url)['ETag']
+        response = self.client.post(url + '?formato=json', {'tipo': 'salida', 'cantidad': 3})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['ok'])
+        self.assertEqual(data['pz'], 7)
+        self.assertEqual(data['movimiento_id'], MovimientoInventario.objects.get().pk)
+        self.assertEqual(data['nivel'], 'warning')
+
+        data = self.client.post(url + '?formato=json', {'tipo': 'salida', 'cantidad': 30}).json()
+        self.assertFalse(data['ok'])
+        self.assertEqual((data['error'], data['disponible']), ('stock_insuficiente', 7))
+        response = self.client.post(url + '?formato=json', {'tipo': 'regalo'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'linea_invalida')
+
+        # Sin mensajes en la sesión: la ficha solo cambia por la versión del producto.
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Stock insuficiente')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class StockConcurrenciaTest(TransactionTestCase):
+    """Cientos de escaneos en paralelo sobre el mismo SKU no deben perder cambios."""
+
+    KIOSCOS = 20
+    ESCANEOS_POR_KIOSCO = 15
+
+    def setUp(self):
+        Producto.objects.create(sku='TOA-HOT', nombre_tela='Toalla Hotel', pz=100)
+
+    def _kiosco(self, indice, errores):
+        try:
+            for n in range(self.ESCANEOS_POR_KIOSCO):
+                tipo = 'ENTRADA' if (indice + n) % 3 == 0 else 'SALIDA'
+                try:
+                    stock.registrar_movimiento('TOA-HOT', tipo, 1, notas=f'kiosco {indice}')
+                except stock.StockInsuficiente:
+                    pass
+        except Exception as e:
+            errores.append(e)
+        finally:
+            connection.close()
+
+    def _correr_kioscos(self):
+        errores = []
+        hilos = [
+            threading.Thread(target=self._kiosco, args=(i, errores))
+            for i in range(self.KIOSCOS)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return errores
+
+    def test_pz_coincide_con_el_historial(self):
+        self.assertEqual(self._correr_kioscos(), [])
+        totales = dict(
+            MovimientoInventario.objects.values_list('tipo_movimiento')
+            .annotate(total=Sum('cantidad'))
+        )
+        esperado = 100 + totales.get('ENTRADA', 0) - totales.get('SALIDA', 0)
+        pz = Producto.objects.get(pk='TOA-HOT').pz
+        self.assertEqual(pz, esperado)
+        self.assertGreaterEqual(pz, 0)
+
+
+class FraccionesTest(TestCase):
+    """Contador fraccionado: el stock vive en las fracciones y pz se pone al día al plegar."""
+
+    def setUp(self):
+        Producto.objects.create(sku='TOA-HOT', nombre_tela='Toalla Hotel', stock_minimo=5)
+        stock.registrar_movimiento('TOA-HOT', 'ENTRADA', 10)
+
+    def _partes(self):
+        return list(FraccionStock.objects.filter(producto_id='TOA-HOT').order_by('indice').values_list('pz', flat=True))
+
+    def test_configurar_mover_y_plegar(self):
+        self.assertEqual(fracciones.configurar('TOA-HOT', 4), 10)
+        self.assertEqual(self._partes(), [3, 3, 2, 2])
+        version = Producto.objects.get(pk='TOA-HOT').version
+
+        stock.registrar_movimiento('TOA-HOT', 'ENTRADA', 5)
+        producto = Producto.objects.get(pk='TOA-HOT')
+        stock.registrar_movimiento(producto, 'SALIDA', 12)
+        self.assertEqual(producto.pz, 3)
+        self.assertEqual(fracciones.total('TOA-HOT'), 3)
+        # La fila del producto no se tocó: pz, marca y versión esperan al pliegue.
+        producto.refresh_from_db()
+        self.assertEqual((producto.pz, producto.bajo_minimo, producto.version), (10, False, version))
+        self.assertEqual(conciliacion.diferencias(), [])
+
+        self.assertEqual(fracciones.plegar(), 1)
+        producto.refresh_from_db()
+        self.assertEqual((producto.pz, producto.bajo_minimo), (3, True))
+        self.assertGreater(producto.version, version)
+        self.assertEqual(self._partes(), [1, 1, 1, 0])
+        self.assertEqual(fracciones.plegar(), 0)
+
+        self.assertEqual(fracciones.configurar('TOA-HOT', 0), 3)
+        self.assertEqual(self._partes(), [])
+        stock.registrar_movimiento('TOA-HOT', 'ENTRADA', 1)
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, 4)
+        self.assertEqual(conciliacion.diferencias(), [])
+
+    def test_vistas_y_exportacion_antes_de_plegar(self):
+        fracciones.configurar('TOA-HOT', 4)
+        self.client.force_login(User.objects.create_user('fracc', password='x'))
+        lista = reverse('app:lista_productos')
+        etag = self.client.get(lista)['ETag']
+        stock.registrar_movimiento('TOA-HOT', 'ENTRADA', 5)
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, 10)
+
+        texto = b''.join(self.client.get(reverse('app:exportar_stock')).streaming_content).decode('utf-8-sig')
+        self.assertEqual(texto.splitlines()[1].split(',')[-1], '15')
+        self.assertEqual(self.client.get(lista, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertContains(self.client.get(lista), '15 pz')
+        self.assertEqual(self.client.get(lista + '?formato=json').json()['productos'][0]['pz'], 15)
+        respuesta = self.client.get(reverse('app:kiosco_movimiento', args=['TOA-HOT']))
+        self.assertEqual(respuesta.context['producto'].pz, 15)
+        respuesta = self.client.get(reverse('app:ajustar_stock', args=['TOA-HOT']))
+        self.assertEqual(respuesta.context['form'].initial['nueva_cantidad'], 15)
+        respuesta = self.client.get(reverse('app:detalle_producto', args=['TOA-HOT']))
+        self.assertEqual(respuesta.context['producto'].pz, 15)
+
+    def test_salida_entre_varias_fracciones(self):
+        fracciones.configurar('TOA-HOT', 4)
+        # Ninguna fracción tiene 7 sola: se bloquean todas y se reparte.
+        stock.registrar_movimiento('TOA-HOT', 'SALIDA', 7)
+        self.assertEqual(sum(self._partes()), 3)
+        with self.assertRaises(stock.StockInsuficiente) as error:
+            stock.registrar_movimiento('TOA-HOT', 'SALIDA', 4)
+        self.assertEqual(error.exception.disponible, 3)
+        self.assertEqual(sum(self._partes()), 3)
+        self.assertEqual(MovimientoInventario.objects.filter(tipo_movimiento='SALIDA').count(), 1)
+
+    def test_ajuste_lote_y_conciliacion(self):
+        fracciones.configurar('TOA-HOT', 3)
+        stock.ajustar_stock('TOA-HOT', 20)
+        self.assertEqual(sum(self._partes()), 20)
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, 20)
+
+        resultados = stock.registrar_lote([
+            {'sku': 'TOA-HOT', 'tipo_movimiento': 'SALIDA', 'cantidad': 15},
+            {'sku': 'TOA-HOT', 'tipo_movimiento': 'SALIDA', 'cantidad': 8},
+            {'sku': 'TOA-HOT', 'tipo_movimiento': 'ENTRADA', 'cantidad': 2},
+        ])
+        self.assertEqual([r['ok'] for r in resultados], [True, False, True])
+        self.assertEqual(resultados[1]['disponible'], 5)
+        self.assertEqual(sum(self._partes()), 7)
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(resumenes.diferencias(), [])
+
+        FraccionStock.objects.filter(producto_id='TOA-HOT', indice=0).update(pz=F('pz') + 4)
+        faltantes = conciliacion.diferencias()
+        self.assertEqual(faltantes, [('TOA-HOT', 11, 7)])
+        self.assertEqual(conciliacion.reparar(faltantes, 'contador'), 1)
+        self.assertEqual(sum(self._partes()), 7)
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, 7)
+
+    def test_comando(self):
+        salida = io.StringIO()
+        call_command('plegar_fracciones', '--sku', 'TOA-HOT', '--fracciones', '2', stdout=salida)
+        self.assertEqual(self._partes(), [5, 5])
+        stock.registrar_movimiento('TOA-HOT', 'SALIDA', 4)
+        call_command('plegar_fracciones', stdout=salida)
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, 6)
+        with self.assertRaises(CommandError):
+            call_command('plegar_fracciones', '--fracciones', '2', stdout=salida)
+
+
+class FraccionesConcurrenciaTest(StockConcurrenciaTest):
+    """Lo mismo con el SKU fraccionado y poco stock: las salidas compiten por las fracciones."""
+
+    def setUp(self):
+        Producto.objects.create(sku='TOA-HOT', nombre_tela='Toalla Hotel', pz=20)
+        fracciones.configurar('TOA-HOT', 4)
+
+    def test_pz_coincide_con_el_historial(self):
+        self.assertEqual(self._correr_kioscos(), [])
+        totales = dict(
+            MovimientoInventario.objects.values_list('tipo_movimiento')
+            .annotate(total=Sum('cantidad'))
+        )
+        esperado = 20 + totales.get('ENTRADA', 0) - totales.get('SALIDA', 0)
+        self.assertEqual(fracciones.total('TOA-HOT'), esperado)
+        self.assertFalse(FraccionStock.objects.filter(pz__lt=0).exists())
+        fracciones.plegar()
+        self.assertEqual(Producto.objects.get(pk='TOA-HOT').pz, esperado)
+
+
+class EscaneoLoteTest(TestCase):
+    """Pruebas del endpoint de escaneo en lote."""
+
+    def setUp(self):
+        Producto.objects.create(sku='A', nombre_tela='Tela A', pz=2)
+        Producto.objects.create(sku='B', nombre_tela='Tela B', pz=0)
+        self.url = reverse('app:escaneo_lote')
+
+    def _post(self, escaneos):
+        return self.client.post(self.url, data=json.dumps({'escaneos': escaneos}),
+                                content_type='application/json')
+
+    def test_lote_con_rechazos(self):
+        escaneos = [
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 2},
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 1},
+            {'sku': 'B', 'tipo': 'entrada', 'cantidad': 5},
+            {'sku': 'A', 'tipo': 'entrada', 'cantidad': 1},
+            {'sku': 'NOPE', 'tipo': 'entrada', 'cantidad': 1},
+            {'sku': 'B', 'tipo': 'mover', 'cantidad': 1},
+        ]
+        respuesta = self._post(escaneos)
+        data = respuesta.json()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([r['ok'] for r in data['resultados']], [True, False, True, True, False, False])
+        self.assertEqual(data['resultados'][1]['error'], 'stock_insuficiente')
+        self.assertEqual(data['resultados'][4]['error'], 'sku_inexistente')
+        self.assertEqual(data['resultados'][5]['error'], 'linea_invalida')
+        self.assertEqual(data['resultados'][3]['pz'], 1)
+        self.assertEqual(Producto.objects.get(pk='A').pz, 1)
+        self.assertEqual(Producto.objects.get(pk='B').pz, 5)
+        self.assertEqual(MovimientoInventario.objects.count(), 3)
+
+    def test_json_invalido(self):
+        respuesta = self.client.post(self.url, data='no-json', content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+
+
+class IdempotenciaTest(TestCase):
+    """Reintentos y resincronizaciones no deben duplicar movimientos."""
+
+    def setUp(self):
+        Producto.objects.create(sku='A', nombre_tela='Tela A', pz=5)
+
+    def test_kiosco_reintento_con_misma_clave(self):
+        url = reverse('app:kiosco_movimiento', args=['A'])
+        for _ in range(3):
+            self.client.post(url, {'tipo': 'salida', 'cantidad': 1, 'clave': 'k-1'})
+        self.assertEqual(Producto.objects.get(pk='A').pz, 4)
+        self.assertEqual(MovimientoInventario.objects.count(), 1)
+
+    def test_kiosco_json_reintento_con_misma_clave(self):
+        url = reverse('app:kiosco_movimiento', args=['A']) + '?formato=json'
+        respuestas = [
+            self.client.post(url, {'tipo': 'entrada', 'cantidad': 2, 'clave': 'k-2'}).json()
+            for _ in range(2)
+        ]
+        self.assertEqual(Producto.objects.get(pk='A').pz, 7)
+        self.assertEqual(respuestas[0]['movimiento_id'], respuestas[1]['movimiento_id'])
+        self.assertEqual(respuestas[1]['pz'], 7)
+
+    def test_sincronizacion_deduplica(self):
+        url = reverse('app:sincronizar_escaneos')
+        lote = [
+            {'sku': 'A', 'tipo': 'entrada', 'cantidad': 2, 'clave': 'c1'},
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 1, 'clave': 'c2'},
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 1, 'clave': 'c2'},
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 1},
+        ]
+        for _ in range(2):
+            data = self.client.post(url, data=json.dumps({'escaneos': lote}),
+                                    content_type='application/json').json()
+        self.assertEqual(Producto.objects.get(pk='A').pz, 6)
+        self.assertEqual(MovimientoInventario.objects.count(), 2)
+        self.assertTrue(data['resultados'][0]['duplicado'])
+        self.assertEqual(data['resultados'][3]['error'], 'linea_invalida')
+
+    def test_clave_con_otros_datos_es_409(self):
+        url = reverse('app:sincronizar_escaneos')
+        lote = [
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 1, 'clave': 'c1'},
+            {'sku': 'A', 'tipo': 'salida', 'cantidad': 3, 'clave': 'c1'},
+        ]
+        respuesta = self.client.post(url, data=json.dumps({'escaneos': lote}), content_type='application/json')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual([r['ok'] for r in respuesta.json()['resultados']], [True, False])
+        self.assertEqual(respuesta.json()['resultados'][1]['error'], 'clave_reutilizada')
+
+        otra = [{'sku': 'A', 'tipo': 'entrada', 'cantidad': 1, 'clave': 'c1'}]
+        respuesta = self.client.post(url, data=json.dumps({'escaneos': otra}), content_type='application/json')
+        self.assertEqual(respuesta.status_code, 409)
+        kiosco = reverse('app:kiosco_movimiento', args=['A']) + '?formato=json'
+        respuesta = self.client.post(kiosco, {'tipo': 'entrada', 'cantidad': 1, 'clave': 'c1'})
+        self.assertEqual((respuesta.status_code, respuesta.json()['error']), (409, 'clave_reutilizada'))
+        with self.assertRaises(stock.ClaveReutilizada):
+            stock.registrar_movimiento('A', 'SALIDA', 2, clave='c1')
+        self.assertEqual(Producto.objects.get(pk='A').pz, 4)
+        self.assertEqual(MovimientoInventario.objects.count(), 1)
+
+
+class BusquedaTest(TestCase):
+    """Pruebas del índice de búsqueda de productos."""
+
+    def setUp(self):
+        Producto.objects.create(sku='POP-010', nombre_tela='Popelina Lisa', color='Azul Marino',
+                                composicion='100% Algodón', ubicacion='Rack A3')
+        Producto.objects.create(sku='TOA-200', nombre_tela='Toalla Hotel', tipo='Toalla',
+                                color='Blanco', composicion='Algodón peinado', ubicacion='Rack B1')
+        Producto.objects.create(sku='GAB-300', nombre_tela='Gabardina', color='Azul',
+                                composicion='Poliéster', ubicacion='Rack A3')
+
+    def _skus(self, texto):
+        return [p.sku for p in busqueda.buscar_productos(texto)]
+
+    def test_prefijo_en_campos_descriptivos(self):
+        self.assertEqual(self._skus('popel'), ['POP-010'])
+        self.assertEqual(sorted(self._skus('algodon')), ['POP-010', 'TOA-200'])
+        self.assertEqual(sorted(self._skus('rack a3')), ['GAB-300', 'POP-010'])
+        self.assertEqual(self._skus('azul gabar'), ['GAB-300'])
+
+    def test_sku_pesa_mas_que_la_descripcion(self):
+        Producto.objects.create(sku='AZUL-1', nombre_tela='Manta', color='Crudo')
+        self.assertEqual(self._skus('azul')[0], 'AZUL-1')
+
+    def test_indice_sigue_a_save_y_delete(self):
+        producto = Producto.objects.get(pk='GAB-300')
+        producto.color = 'Verde Olivo'
+        producto.save()
+        self.assertEqual(self._skus('olivo'), ['GAB-300'])
+        self.assertEqual(self._skus('azul'), ['POP-010'])
+        producto.delete()
+        self.assertEqual(self._skus('olivo'), [])
+
+    def test_vista_lista_productos(self):
+        respuesta = self.client.get(reverse('app:lista_productos'), {'q': 'toalla'})
+        self.assertEqual([p.sku for p in respuesta.context['productos']], ['TOA-200'])
+
+
+class PaginacionKeysetTest(TestCase):
+    """Pruebas de la paginación por cursor."""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('almacen', password='x')
+        for i in range(7):
+            Producto.objects.create(sku=f'S{i}', nombre_tela='Igual' if i < 4 else f'Tela {i}')
+
+    def test_recorre_todo_sin_repetir(self):
+        vistos, cursor = [], None
+        while True:
+            pagina = paginacion.paginar(Producto.objects.all(), ['nombre_tela', 'sku'],
+                                        despues=cursor, tamano=3)
+            vistos += [p.sku for p in pagina]
+            cursor = pagina.siguiente
+            if not cursor:
+                break
+        esperado = list(Producto.objects.order_by('nombre_tela', 'sku').values_list('sku', flat=True))
+        self.assertEqual(vistos, esperado)
+
+    def test_regresar_con_antes(self):
+        qs = Producto.objects.all()
+        primera = paginacion.paginar(qs, ['nombre_tela', 'sku'], tamano=3)
+        segunda = paginacion.paginar(qs, ['nombre_tela', 'sku'], despues=primera.siguiente, tamano=3)
+        de_vuelta = paginacion.paginar(qs, ['nombre_tela', 'sku'], antes=segunda.anterior, tamano=3)
+        self.assertEqual([p.sku for p in de_vuelta], [p.sku for p in primera])
+        self.assertIsNone(de_vuelta.anterior)
+
+    def test_reportes_json(self):
+        for _ in range(3):
+            stock.registrar_movimiento('S0', 'ENTRADA', 1)
+        self.client.force_login(self.usuario)
+        url = reverse('app:ver_reportes')
+        data = self.client.get(url, {'formato': 'json'}).json()
+        ids = [m['id'] for m in data['movimientos']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertIsNone(data['siguiente'])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_cursor_invalido_da_primera_pagina(self):
+        respuesta = self.client.get(reverse('app:lista_productos'), {'despues': '%%%', 'formato': 'json'})
+        self.assertEqual(len(respuesta.json()['productos']), 7)
+
+
+class ResumenDiarioTest(TestCase):
+    """El resumen diario se mantiene junto con cada movimiento."""
+
+    def setUp(self):
+        Producto.objects.create(sku='A', nombre_tela='Tela A', pz=10)
+        Producto.objects.create(sku='B', nombre_tela='Tela B', pz=10)
+
+    def test_se_acumula_en_cada_camino(self):
+        stock.registrar_movimiento('A', 'ENTRADA', 3)
+        stock.registrar_movimiento('A', 'ENTRADA', 2)
+        stock.registrar_movimiento('A', 'SALIDA', 4)
+        stock.ajustar_stock('B', 7)
+        stock.registrar_lote([
+            {'sku': 'B', 'tipo_movimiento': 'SALIDA', 'cantidad': 1},
+            {'sku': 'A', 'tipo_movimiento': 'ENTRADA', 'cantidad': 5},
+        ])
+        hoy = timezone.localdate()
+        entrada_a = MovimientoDiario.objects.get(dia=hoy, producto_id='A', tipo_movimiento='ENTRADA')
+        self.assertEqual((entrada_a.cantidad, entrada_a.movimientos), (10, 3))
+        salida_b = MovimientoDiario.objects.get(dia=hoy, producto_id='B', tipo_movimiento='SALIDA')
+        self.assertEqual((salida_b.cantidad, salida_b.movimientos), (4, 2))
+        self.assertEqual(resumenes.diferencias(), [])
+        self.assertEqual(resumenes.totales_por_tipo()['SALIDA'], {'cantidad': 8, 'movimientos': 3})
+
+    def test_admin_no_escribe_movimientos(self):
+        movimiento = stock.registrar_movimiento('A', 'ENTRADA', 3)
+        self.client.force_login(User.objects.create_superuser('adm', 'a@x.com', 'x'))
+        for nombre, args in (
+            ('admin:app_movimientoinventario_add', []),
+            ('admin:app_movimientoinventario_delete', [movimiento.pk]),
+        ):
+            self.assertEqual(self.client.post(reverse(nombre, args=args), {}).status_code, 403)
+        self.client.post(reverse('admin:app_movimientoinventario_change', args=[movimiento.pk]), {'cantidad': 30})
+        self.assertEqual(MovimientoInventario.objects.get(pk=movimiento.pk).cantidad, 3)
+        self.assertEqual(Producto.objects.get(pk='A').pz, 13)
+
+    def test_comando_detecta_y_reconstruye(self):
+        stock.registrar_movimiento('A', 'ENTRADA', 3)
+        MovimientoDiario.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('resumen_diario', stdout=io.StringIO())
+        call_command('resumen_diario', '--reconstruir', stdout=io.StringIO())
+        self.assertEqual(resumenes.diferencias(), [])
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class KpisCacheTest(TestCase):
+    """El caché de KPIs se parcha con cada cambio en lugar de recalcularse."""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('tv', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(sku='A', nombre_tela='Tela A', pz=10)
+            Producto.objects.create(sku='B', nombre_tela='Tela B', pz=3)
+
+    def _dashboard(self):
+        return self.client.get(reverse('app:dashboard')).context
+
+    def test_recarga_sin_consultas(self):
+        self.client.force_login(self.usuario)
+        self._dashboard()
+        with self.assertNumQueries(2):
+            # Solo la sesión y el usuario autenticado
+            contexto = self._dashboard()
+        self.assertEqual(contexto['total_piezas'], 13)
+        self.assertEqual(contexto['productos_bajo_stock'], 1)
+
+    def test_parches_por_movimiento(self):
+        kpis.total_piezas(), kpis.productos_bajo_stock(), kpis.movimientos_por_tipo()
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.registrar_movimiento('A', 'SALIDA', 6)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.registrar_lote([{'sku': 'B', 'tipo_movimiento': 'ENTRADA', 'cantidad': 7}])
+        with self.assertNumQueries(0):
+            self.assertEqual(kpis.total_piezas(), 14)
+            self.assertEqual(kpis.productos_bajo_stock(), 1)
+            self.assertEqual(kpis.movimientos_por_tipo(), {'ENTRADA': 1, 'SALIDA': 1})
+
+    def test_alta_y_baja_de_producto(self):
+        kpis.total_productos(), kpis.productos_bajo_stock()
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(sku='C', nombre_tela='Tela C', pz=0)
+        self.assertEqual((kpis.total_productos(), kpis.productos_bajo_stock()), (3, 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.get(pk='B').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual((kpis.total_productos(), kpis.productos_bajo_stock()), (2, 1))
+
+    def test_stock_por_modelo_completo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.bulk_create(
+                Producto(sku=f'M{i}', nombre_tela=f'Modelo {i}', pz=1) for i in range(kpis.TAMANO_TOP)
+            )
+        self.assertEqual(len(kpis.stock_por_modelo()), kpis.TAMANO_TOP + 2)
+
+    def test_rollback_no_toca_el_cache(self):
+        kpis.total_piezas()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(stock.StockInsuficiente):
+                stock.registrar_movimiento('B', 'SALIDA', 50)
+        self.assertEqual(kpis.total_piezas(), 13)
+
+
+class PlanConsultasTest(TestCase):
+    """
+    Corre ``EXPLAIN QUERY PLAN`` sobre cada SELECT de las vistas principales.
+    Falla si alguna recorre una tabla completa sin índice o necesita un
+    ordenamiento temporal que no esté en la lista de excepciones.
+    """
+
+    # (fragmento del SQL, motivo) de los planes que se aceptan a propósito.
+    EXCEPCIONES = [
+        ('bm25(', 'el ranking de la búsqueda solo se conoce después del MATCH'),
+        ('AS "total_pz"', 'stock por modelo ordena por un agregado; se sirve del caché de KPIs'),
+    ]
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Los planes esperados son los de SQLite')
+        cache.clear()
+        self.usuario = User.objects.create_superuser('plan', 'plan@x.com', 'x')
+        self.client.force_login(self.usuario)
+        Producto.objects.bulk_create([
+            Producto(sku=f'P{i:03}', nombre_tela=f'Tela {i % 20}', tipo='Algodón', pz=i % 9)
+            for i in range(80)
+        ])
+        for i in range(40):
+            stock.registrar_movimiento(f'P{i:03}', 'ENTRADA', 3, usuario=self.usuario)
+
+    def _planes(self, consultas):
+        malos = []
+        for consulta in consultas:
+            sql = consulta['sql']
+            if not sql.startswith('SELECT') or '"app_' not in sql:
+                continue
+            if any(fragmento in sql for fragmento, _ in self.EXCEPCIONES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                pasos = [fila[3] for fila in cursor.fetchall()]
+            for paso in pasos:
+                recorre_tabla = paso.startswith('SCAN app_') and ' USING ' not in paso
+                if recorre_tabla or 'USE TEMP B-TREE' in paso:
+                    malos.append(f'{paso}\n    {sql}')
+        return malos
+
+    def _revisar(self, metodo, url, datos=None):
+        with CaptureQueriesContext(connection) as ctx:
+            if metodo == 'post':
+                respuesta = self.client.post(url, datos, content_type='application/json')
+            else:
+                respuesta = self.client.get(url)
+        self.assertLess(respuesta.status_code, 400, url)
+        malos = self._planes(ctx.captured_queries)
+        self.assertFalse(malos, f'{url}:\n' + '\n'.join(malos))
+
+    def test_planes_de_las_vistas(self):
+        productos = paginacion.paginar(Producto.objects.all(), ['nombre_tela', 'sku'])
+        historial = paginacion.paginar(MovimientoInventario.objects.all(), ['-fecha', '-id'], tamano=10)
+        hoy = timezone.localdate().isoformat()
+        urls = [
+            reverse('app:lista_productos'),
+            reverse('app:lista_productos') + '?despues=' + productos.siguiente,
+            reverse('app:lista_productos') + '?q=tela',
+            reverse('app:detalle_producto', args=['P001']),
+            reverse('app:kiosco_movimiento', args=['P001']),
+            reverse('app:ver_reportes'),
+            reverse('app:ver_reportes') + '?despues=' + historial.siguiente,
+            reverse('app:ver_reportes') + f'?fecha_inicio={hoy}&fecha_fin={hoy}',
+            reverse('app:dashboard'),
+            reverse('app:index'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self._revisar('get', url)
+
+    def test_plan_del_lote(self):
+        lineas = [
+            {'sku': f'P{i:03}', 'tipo': 'SALIDA', 'cantidad': 1, 'clave': f'plan-{i}'}
+            for i in range(10)
+        ]
+        self._revisar('post', reverse('app:escaneo_lote'), json.dumps({'escaneos': lineas}))
+
+
+class ExportacionTest(TestCase):
+    """Las exportaciones salen en streaming y respetan los filtros."""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('exporta', password='x')
+        self.otro = User.objects.create_user('otro', password='x')
+        self.client.force_login(self.usuario)
+        Producto.objects.create(sku='EX1', nombre_tela='Lino', pz=10)
+        Producto.objects.create(sku='EX2', nombre_tela='Denim', pz=4)
+        stock.registrar_movimiento('EX1', 'ENTRADA', 5, usuario=self.usuario, notas='=SUM(A1)')
+        stock.registrar_movimiento('EX1', 'SALIDA', 2, usuario=self.otro)
+        stock.registrar_movimiento('EX2', 'SALIDA', 1, usuario=self.usuario)
+
+    def _csv(self, url):
+        respuesta = self.client.get(url)
+        self.assertTrue(respuesta.streaming)
+        texto = b''.join(respuesta.streaming_content).decode('utf-8-sig')
+        return [linea.split(',') for linea in texto.splitlines()]
+
+    def test_csv_movimientos_filtrado(self):
+        url = reverse('app:exportar_movimientos')
+        self.assertEqual(len(self._csv(url)), 4)
+        filas = self._csv(url + '?sku=EX1&tipo=salida')
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1][2:7], ['EX1', 'Lino', 'SALIDA', '2', 'otro'])
+        filas = self._csv(url + '?usuario=exporta')
+        self.assertEqual({f[2] for f in filas[1:]}, {'EX1', 'EX2'})
+        # Las notas que parecen fórmula no se ejecutan al abrir en Excel
+        self.assertIn("'=SUM(A1)", [f[7] for f in filas])
+
+    def test_consultas_no_crecen_con_las_filas(self):
+        respuesta = self.client.get(reverse('app:exportar_movimientos'))
+        with self.assertNumQueries(1):
+            b''.join(respuesta.streaming_content)
+
+    def test_xlsx(self):
+        respuesta = self.client.get(reverse('app:exportar_stock') + '?formato=xlsx')
+        self.assertIn('attachment;', respuesta['Content-Disposition'])
+        archivo = zipfile.ZipFile(io.BytesIO(b''.join(respuesta.streaming_content)))
+        self.assertIn('xl/workbook.xml', archivo.namelist())
+        hoja = archivo.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(hoja.count('<row '), 3)
+        self.assertIn('Denim', hoja)
+
+    def test_xlsx_parte_en_varias_hojas(self):
+        filas = ([i, f'fila {i}'] for i in range(5))
+        datos = b''.join(exportar.xlsx_streaming(['n', 'texto'], filas, 'Datos', max_filas=3))
+        archivo = zipfile.ZipFile(io.BytesIO(datos))
+        self.assertIn('Datos (3)', archivo.read('xl/workbook.xml').decode())
+        self.assertEqual(archivo.read('xl/worksheets/sheet3.xml').decode().count('<row '), 2)
+
+
+class ImportarCatalogoTest(TestCase):
+    """Alta/actualización masiva del catálogo con diff en modo simulación."""
+
+    CSV = (
+        'sku,nombre_tela,tipo,color,pz\n'
+        'IMP1,Lino Nuevo,Tela,Azul,12\n'
+        'IMP2,Gabardina,Tela,Negro,0\n'
+        'EXI,Popelina Renombrada,Tela,Blanco,99\n'
+        'IGUAL,Manta,Tela,,3\n'
+        'IMP1,Lino Repetido,Tela,Rojo,1\n'
+        'MALO,,Tela,,1\n'
+        'MALO2,Toalla rara,Cobija,,1\n'
+    )
+
+    def setUp(self):
+        Producto.objects.create(sku='EXI', nombre_tela='Popelina', color='Blanco', pz=5)
+        Producto.objects.create(sku='IGUAL', nombre_tela='Manta', pz=3)
+
+    def _importar(self, **opciones):
+        filas = importar.leer_filas(io.BytesIO(self.CSV.encode()), 'catalogo.csv')
+        return importar.importar_catalogo(filas, tamano_lote=3, **opciones)
+
+    def test_simulacion_no_escribe(self):
+        resultado = self._importar(simular=True, stock_inicial=True)
+        self.assertEqual(
+            (resultado.insertados, resultado.actualizados, resultado.sin_cambios, resultado.movimientos),
+            (2, 1, 1, 1),
+        )
+        self.assertEqual({c[1] for c in resultado.conflictos}, {'IMP1', 'EXI'})
+        self.assertEqual([e[0] for e in resultado.errores], [7, 8])
+        self.assertEqual(Producto.objects.count(), 2)
+        self.assertEqual(Producto.objects.get(pk='EXI').nombre_tela, 'Popelina')
+
+    def test_importacion_con_stock_inicial(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._importar(stock_inicial=True)
+        self.assertEqual(Producto.objects.get(pk='IMP1').nombre_tela, 'Lino Nuevo')
+        exi = Producto.objects.get(pk='EXI')
+        # Se actualiza la descripción, pero el stock solo cambia con movimientos
+        self.assertEqual((exi.nombre_tela, exi.pz), ('Popelina Renombrada', 5))
+        movimiento = MovimientoInventario.objects.get()
+        self.assertEqual((movimiento.producto_id, movimiento.cantidad), ('IMP1', 12))
+        self.assertEqual(resumenes.diferencias(), [])
+        self.assertEqual(busqueda.buscar_productos('gabardina')[0].sku, 'IMP2')
+
+    def test_reimporta_la_exportacion_xlsx(self):
+        datos = b''.join(exportar.xlsx_streaming(exportar.ENCABEZADOS_STOCK, exportar.filas_stock()))
+        Producto.objects.filter(pk='EXI').update(color='Verde')
+        resultado = importar.importar_catalogo(importar.leer_filas(io.BytesIO(datos), 'stock.xlsx'))
+        self.assertEqual((resultado.actualizados, resultado.sin_cambios), (1, 1))
+        self.assertEqual(resultado.errores, [])
+        self.assertEqual(Producto.objects.get(pk='EXI').color, 'Blanco')
+
+    def test_carga_desde_el_admin(self):
+        admin = User.objects.create_superuser('admin_imp', 'a@x.com', 'x')
+        self.client.force_login(admin)
+        archivo = SimpleUploadedFile('catalogo.csv', self.CSV.encode(), content_type='text/csv')
+        respuesta = self.client.post(
+            reverse('admin:app_producto_importar'), {'archivo': archivo, 'simular': 'on'}
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['resultado'].simulado)
+        self.assertFalse(Producto.objects.filter(pk='IMP1').exists())
+
+        # Un XLSX dañado es un error del formulario, no un 500.
+        for contenido in (b'no es un zip', self._xlsx_con_hoja(b'<sheetData><row>')):
+            archivo = SimpleUploadedFile('catalogo.xlsx', contenido)
+            respuesta = self.client.post(reverse('admin:app_producto_importar'), {'archivo': archivo})
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertIn('El XLSX no se pudo leer', str(respuesta.context['form'].errors['archivo']))
+
+    @staticmethod
+    def _xlsx_con_hoja(xml):
+        datos = io.BytesIO()
+        with zipfile.ZipFile(datos, 'w') as libro:
+            libro.writestr('xl/worksheets/sheet1.xml', xml)
+        return datos.getvalue()
+
+    def test_comando(self):
+        salida = io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write(self.CSV)
+        try:
+            call_command('importar_catalogo', f.name, '--simular', stdout=salida)
+        finally:
+            os.remove(f.name)
+        self.assertIn('[SIMULACIÓN] 2 nuevos', salida.getvalue())
+
+
+class ClienteLento(ia.ClienteFalso):
+    """Cliente falso que tarda y registra cuántas llamadas hubo a la vez."""
+    activos = 0
+    maximo = 0
+    candado = threading.Lock()
+
+    def generar(self, prompt):
+        with self.candado:
+            ClienteLento.activos += 1
+            ClienteLento.maximo = max(ClienteLento.maximo, ClienteLento.activos)
+        time.sleep(0.05)
+        with self.candado:
+            ClienteLento.activos -= 1
+        return super().generar(prompt)
+
+
+class ClienteRoto(ia.ClienteFalso):
+    def generar(self, prompt):
+        raise RuntimeError('sin cuota')
+
+
+@override_settings(IA_CLIENTE='app.ia.ClienteFalso')
+class TrabajosIATest(TestCase):
+    """La IA corre en el trabajador; la petición solo encola o lee el caché."""
+
+    def setUp(self):
+        ia._clientes.clear()
+        self.usuario = User.objects.create_user('ia', password='x')
+        self.client.force_login(self.usuario)
+        Producto.objects.create(sku='IA1', nombre_tela='Satín', composicion='Poliéster')
+
+    def test_encola_y_despues_sirve_del_cache(self):
+        url = reverse('app:generar_descripcion')
+        respuesta = self.client.post(url, {'sku': 'IA1'}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual(ia.obtener_cliente().llamadas, 0)
+
+        self.assertEqual(trabajos.procesar_pendientes('prueba'), 1)
+        estado = self.client.get(respuesta.json()['estado_url']).json()
+        self.assertEqual(estado['estado'], 'TERMINADO')
+        self.assertIn('Satín', estado['resultado']['descripcion'])
+
+        respuesta = self.client.post(url, {'sku': 'IA1'}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['descripcion'], estado['resultado']['descripcion'])
+        self.assertEqual(ia.obtener_cliente().llamadas, 1)
+
+    def test_estado_solo_para_quien_lo_encolo(self):
+        trabajo = trabajos.encolar('descripcion', usuario=self.usuario, prompt='x')
+        url = reverse('app:estado_trabajo', args=[trabajo.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_login(User.objects.create_user('otro', password='x'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.create_user('jefe', password='x', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(IA_CACHE_MAX=2)
+    def test_cache_lru(self):
+        ia.generar('uno')
+        ia.generar('dos')
+        ia.generar('uno')  # ahora 'dos' es el menos usado
+        ia.generar('tres')
+        cliente = ia.obtener_cliente()
+        guardadas = set(RespuestaIA.objects.values_list('clave', flat=True))
+        self.assertEqual(guardadas, {ia._hash(cliente.modelo, p) for p in ('uno', 'tres')})
+        self.assertEqual(cliente.llamadas, 3)
+
+    @override_settings(IA_CLIENTE=f'{__name__}.ClienteRoto')
+    def test_reintentos_y_fallo(self):
+        trabajo = trabajos.encolar('descripcion', prompt='x')
+        with self.assertLogs('app.trabajos', 'ERROR'):
+            trabajos.procesar_pendientes('prueba')
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('PENDIENTE', 1))
+        self.assertGreater(trabajo.disponible_desde, timezone.now())
+        # Con la espera pendiente no se vuelve a tomar
+        self.assertIsNone(trabajos.tomar('prueba'))
+
+        Trabajo.objects.filter(pk=trabajo.pk).update(disponible_desde=timezone.now(), max_intentos=2)
+        with self.assertLogs('app.trabajos', 'ERROR'):
+            trabajos.procesar_pendientes('prueba')
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'FALLIDO')
+        self.assertIn('sin cuota', trabajo.error)
+
+    def test_un_trabajo_lo_toma_un_solo_trabajador(self):
+        trabajos.encolar('descripcion', prompt='x')
+        self.assertIsNotNone(trabajos.tomar('a'))
+        self.assertIsNone(trabajos.tomar('b'))
+
+
+@override_settings(IA_CLIENTE=f'{__name__}.ClienteLento')
+class DescribirFaltantesTest(TransactionTestCase):
+    """El trabajo masivo respeta el límite de llamadas simultáneas."""
+
+    def setUp(self):
+        ia._clientes.clear()
+        ClienteLento.maximo = 0
+        for i in range(8):
+            Producto.objects.create(sku=f'DF{i}', nombre_tela=f'Tela {i}',
+                                    descripcion='Ya escrita' if i < 2 else None)
+
+    def test_describe_solo_los_faltantes(self):
+        trabajos.encolar('describir_faltantes', concurrencia=3)
+        call_command('trabajador', '--una-vez', stdout=io.StringIO())
+        trabajo = Trabajo.objects.get()
+        self.assertEqual(trabajo.estado, 'TERMINADO')
+        self.assertEqual(trabajo.resultado, {'pendientes': 6, 'actualizados': 6})
+        self.assertLessEqual(ClienteLento.maximo, 3)
+        self.assertGreater(ClienteLento.maximo, 1)
+        self.assertEqual(Producto.objects.get(pk='DF0').descripcion, 'Ya escrita')
+        self.assertFalse(Producto.objects.filter(descripcion__isnull=True).exists())
+
+
+class ArranqueTest(TestCase):
+    """El SDK de Gemini se carga solo al usarlo, nunca al arrancar."""
+
+    def setUp(self):
+        ia._clientes.clear()
+        self.usuario = User.objects.create_user('arranque', password='x')
+        self.client.force_login(self.usuario)
+
+    def test_benchmark_sin_modulos_prohibidos(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, 'arranque.json')
+            call_command('benchmark_arranque', '--repeticiones', '1', '--json', ruta, stdout=io.StringIO())
+            with open(ruta, encoding='utf-8') as f:
+                resultado = json.load(f)
+        self.assertEqual(resultado['errores'], [])
+        self.assertEqual(resultado['estado'], '200 OK')
+
+    def test_benchmark_detecta_regresion(self):
+        with self.assertRaisesMessage(CommandError, 'se cargó django.contrib.admin'):
+            call_command('benchmark_arranque', '--repeticiones', '1',
+                         '--prohibidos', 'django.contrib.admin', stdout=io.StringIO())
+
+    @override_settings(IA_CLIENTE='gemini')
+    def test_sin_sdk_el_sitio_sigue_y_el_trabajo_falla_sin_reintentos(self):
+        with mock.patch.dict(sys.modules, {'google.generativeai': None}):
+            respuesta = self.client.post(
+                reverse('app:generar_descripcion'), {'prompt': 'hola'}, content_type='application/json'
+            )
+            self.assertEqual(respuesta.status_code, 202)
+            with self.assertLogs('app.trabajos', 'ERROR'):
+                trabajos.procesar_pendientes('prueba')
+        trabajo = Trabajo.objects.get()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('FALLIDO', 1))
+        self.assertIn('google-generativeai', trabajo.error)
+
+
+@unittest.skipUnless(importlib.util.find_spec('segno'), 'requiere segno')
+class EtiquetasQRTest(TestCase):
+    """QR renderizados en el servidor y hoja de etiquetas en PDF."""
+
+    def setUp(self):
+        self.carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.carpeta)
+        ajuste = override_settings(ETIQUETAS_CACHE_DIR=self.carpeta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.usuario = User.objects.create_user('etiquetas', password='x')
+        self.client.force_login(self.usuario)
+        Producto.objects.bulk_create([
+            Producto(sku=f'ET{i:03}', nombre_tela=f'Rollo Toalla {i}', tipo='Toalla' if i % 2 else 'Tela')
+            for i in range(30)
+        ])
+
+    def test_qr_png_y_svg_cacheados(self):
+        url = reverse('app:qr_producto', args=['ET001', 'accion', 'svg'])
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', b''.join(respuesta.streaming_content))
+        archivos = os.listdir(self.carpeta)
+        self.assertEqual(len(archivos), 1)
+        self.assertTrue(archivos[0].startswith('ET001-accion-'))
+
+        with mock.patch('app.etiquetas._qr') as generar:
+            b''.join(self.client.get(url).streaming_content)
+        generar.assert_not_called()
+
+        respuesta = self.client.get(reverse('app:qr_producto', args=['ET001', 'info', 'png']))
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'\x89PNG'))
+        self.assertEqual(self.client.get(reverse('app:qr_producto', args=['ET001', 'otro', 'png'])).status_code, 404)
+
+    def test_hoja_pdf_por_lista_y_por_filtro(self):
+        respuesta = self.client.post(reverse('app:etiquetas_pdf'), {'skus': 'ET003,ET001\nET999', 'qr': 'ambos'})
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        pdf = respuesta.content
+        self.assertTrue(pdf.startswith(b'%PDF-1.4') and pdf.rstrip().endswith(b'%%EOF'))
+        self.assertIn(b'/Count 1', pdf)
+
+        respuesta = self.client.get(reverse('app:etiquetas_pdf'), {'tipo': 'Toalla', 'qr': 'ambos'})
+        # 15 productos x 2 QR = 30 etiquetas -> 2 hojas de 21
+        self.assertIn(b'/Count 2', respuesta.content)
+        self.assertEqual(self.client.get(reverse('app:etiquetas_pdf')).status_code, 400)
+
+    def test_paginas_en_procesos_igual_que_en_serie(self):
+        productos = list(Producto.objects.order_by('sku'))
+        base = 'http://bodega.local/'
+        self.assertEqual(
+            etiquetas.hoja_etiquetas(productos, base, procesos=1),
+            etiquetas.hoja_etiquetas(productos, base, procesos=2),
+        )
+
+
+class ConciliacionTest(TestCase):
+    """El contador pz se concilia contra el historial, con puntos de control."""
+
+    def setUp(self):
+        Producto.objects.bulk_create([
+            Producto(sku='A', nombre_tela='Tela A'),
+            Producto(sku='B', nombre_tela='Tela B'),
+            Producto(sku='C', nombre_tela='Tela C'),
+        ])
+        stock.registrar_movimiento('A', 'ENTRADA', 10)
+        stock.registrar_movimiento('A', 'SALIDA', 3)
+        stock.registrar_movimiento('B', 'ENTRADA', 5)
+
+    def test_detecta_y_repara_el_contador(self):
+        self.assertEqual(conciliacion.diferencias(), [])
+        Producto.objects.filter(pk='A').update(pz=9)
+        Producto.objects.filter(pk='C').update(pz=4)
+        faltantes = conciliacion.diferencias()
+        self.assertEqual(faltantes, [('A', 9, 7), ('C', 4, 0)])
+
+        self.assertEqual(conciliacion.reparar(faltantes, 'contador'), 2)
+        self.assertEqual(Producto.objects.get(pk='A').pz, 7)
+        self.assertEqual(conciliacion.diferencias(), [])
+
+    def test_repara_el_libro_con_un_ajuste(self):
+        Producto.objects.filter(pk='C').update(pz=4)
+        faltantes = conciliacion.diferencias()
+        # Un escaneo entre la auditoría y la reparación: ese SKU se omite.
+        Producto.objects.filter(pk='C').update(pz=6)
+        self.assertEqual(conciliacion.reparar(faltantes, 'libro'), 0)
+
+        self.assertEqual(conciliacion.reparar(conciliacion.diferencias(), 'libro'), 1)
+        ajuste = MovimientoInventario.objects.get(producto_id='C')
+        self.assertEqual((ajuste.tipo_movimiento, ajuste.cantidad), ('ENTRADA', 6))
+        self.assertEqual(Producto.objects.get(pk='C').pz, 6)
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(resumenes.diferencias(), [])
+
+    def test_puntos_de_control_y_stock_a_una_fecha(self):
+        ayer = timezone.now() - timedelta(days=1)
+        MovimientoInventario.objects.update(fecha=ayer)
+        self.assertEqual(conciliacion.crear_puntos_control(), 2)
+        # Sin movimientos nuevos no hay corte que hacer.
+        self.assertEqual(conciliacion.crear_puntos_control(), 0)
+
+        stock.registrar_movimiento('A', 'SALIDA', 2)
+        stock.registrar_movimiento('C', 'ENTRADA', 1)
+        # Lo anterior al corte ya no se lee: puede archivarse.
+        MovimientoInventario.objects.filter(fecha=ayer).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(conciliacion.diferencias(), [])
+
+        self.assertEqual(conciliacion.stock_al(ayer - timedelta(hours=1)), {'A': 0, 'B': 0, 'C': 0})
+        self.assertEqual(conciliacion.stock_al(timezone.now(), ['A', 'C']), {'A': 5, 'C': 1})
+        punto = PuntoControlStock.objects.get(producto_id='A')
+        self.assertEqual(conciliacion.stock_al(punto.fecha), {'A': 7, 'B': 5, 'C': 0})
+
+    def test_corte_con_ids_fuera_de_orden(self):
+        # Un id menor con fecha posterior (en PostgreSQL, un movimiento que confirmó después).
+        ayer = timezone.now() - timedelta(days=1)
+        reciente = stock.registrar_movimiento('C', 'ENTRADA', 4)
+        viejo = stock.registrar_movimiento('C', 'SALIDA', 1)
+        MovimientoInventario.objects.exclude(pk=reciente.pk).update(fecha=ayer - timedelta(hours=1))
+        self.assertEqual(conciliacion.corte_movimientos(ayer), reciente.pk - 1)
+        self.assertLess(reciente.pk, viejo.pk)
+        conciliacion.crear_puntos_control(fecha=ayer)
+        # La salida vieja de C queda fuera del corte y se cuenta después, no se pierde.
+        self.assertFalse(PuntoControlStock.objects.filter(producto_id='C').exists())
+        self.assertEqual(conciliacion.diferencias(), [])
+        conciliacion.crear_puntos_control()
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(conciliacion.stock_al(timezone.now(), ['C']), {'C': 3})
+
+    def test_formularios_no_pisan_el_contador(self):
+        usuario = User.objects.create_user('conciliar', password='x')
+        self.client.force_login(usuario)
+        datos = {'sku': 'D', 'nombre_tela': 'Tela D', 'tipo': 'Tela', 'pz': 12}
+        self.client.post(reverse('app:crear_producto'), datos)
+        datos.update(sku='OTRO', pz=8, color='Rojo')
+        self.client.post(reverse('app:editar_producto', args=['D']), datos)
+
+        producto = Producto.objects.get(pk='D')
+        self.assertEqual((producto.pz, producto.color), (8, 'Rojo'))
+        self.assertFalse(Producto.objects.filter(pk='OTRO').exists())
+        self.assertEqual(
+            list(MovimientoInventario.objects.filter(producto=producto).order_by('id')
+                 .values_list('tipo_movimiento', 'cantidad')),
+            [('ENTRADA', 12), ('SALIDA', 4)],
+        )
+        self.assertEqual(conciliacion.diferencias(), [])
+
+        # Un escaneo mientras el formulario estaba abierto: guardar sin tocar pz no lo pisa.
+        stock.registrar_movimiento('D', 'SALIDA', 3)
+        datos.update(pz=8, pz_mostrado=8, color='Azul')
+        self.client.post(reverse('app:editar_producto', args=['D']), datos)
+        self.assertEqual(Producto.objects.get(pk='D').pz, 5)
+        datos.update(pz=10, pz_mostrado=5)
+        self.client.post(reverse('app:editar_producto', args=['D']), datos)
+        self.assertEqual(Producto.objects.get(pk='D').pz, 10)
+        self.assertEqual(conciliacion.diferencias(), [])
+
+    def test_comando(self):
+        Producto.objects.filter(pk='B').update(pz=1)
+        with self.assertRaises(CommandError):
+            call_command('conciliar_stock', stdout=io.StringIO())
+        salida = io.StringIO()
+        call_command('conciliar_stock', '--reparar', 'libro', '--punto-control', stdout=salida)
+        self.assertIn('Corregidos: 1 de 1', salida.getvalue())
+        self.assertEqual(PuntoControlStock.objects.count(), 2)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class HistorialStockTest(TestCase):
+    """Series de stock desde el libro: base + suma acumulada del resumen diario, con caché de lo cerrado."""
+
+    def setUp(self):
+        cache.clear()
+        self.hoy = timezone.localdate()
+        Producto.objects.create(sku='A', nombre_tela='Tela A', tipo='Tela', ubicacion='R1')
+        Producto.objects.create(sku='B', nombre_tela='Toalla B', tipo='Toalla', ubicacion='R1')
+        for sku, tipo, cantidad, dias in (('A', 'ENTRADA', 10, 10), ('A', 'SALIDA', 3, 5), ('B', 'ENTRADA', 4, 8)):
+            movimiento = stock.registrar_movimiento(sku, tipo, cantidad)
+            fecha = timezone.make_aware(datetime.combine(self.hoy - timedelta(days=dias), hora(12)))
+            MovimientoInventario.objects.filter(pk=movimiento.pk).update(fecha=fecha)
+        stock.registrar_movimiento('A', 'ENTRADA', 2)
+        resumenes.reconstruir()
+
+    def test_por_dia_desde_el_libro(self):
+        with self.assertNumQueries(2):
+            periodos, series = historial.serie('sku', 'dia', self.hoy - timedelta(days=10), sku__in=['A', 'B'])
+        self.assertEqual(len(periodos), 11)
+        self.assertEqual(series['A'], [10] * 5 + [7] * 5 + [9])
+        self.assertEqual(series['B'], [0, 0] + [4] * 9)
+
+        # La base sale de los puntos de control igual que del historial completo.
+        conciliacion.crear_puntos_control()
+        cache.clear()
+        _, desde_punto = historial.serie('sku', 'dia', self.hoy - timedelta(days=6), sku__in=['A'])
+        self.assertEqual(desde_punto['A'], [10, 7, 7, 7, 7, 7, 9])
+
+    def test_agrupado_y_cerrados_en_cache(self):
+        desde = self.hoy - timedelta(days=10)
+        _, por_tipo = historial.serie('tipo', 'dia', desde)
+        self.assertEqual(por_tipo['Toalla'][-1], 4)
+        _, por_ubicacion = historial.serie('ubicacion', 'dia', desde)
+        self.assertEqual(por_ubicacion['R1'][-1], 13)
+
+        # Lo cerrado ya está en caché: solo se consulta el resumen de ayer y hoy.
+        stock.registrar_movimiento('B', 'SALIDA', 1)
+        with self.assertNumQueries(1):
+            _, por_tipo = historial.serie('tipo', 'dia', desde)
+        self.assertEqual(por_tipo['Toalla'][-3:], [4, 4, 3])
+        cerrado = historial.serie('tipo', 'dia', desde, self.hoy - timedelta(days=3))
+        with self.assertNumQueries(0):
+            self.assertEqual(historial.serie('tipo', 'dia', desde, self.hoy - timedelta(days=3)), cerrado)
+
+        periodos, por_mes = historial.serie('sku', 'mes', self.hoy.replace(day=1) - timedelta(days=40), sku__in=['A'])
+        self.assertEqual([inicio.day for inicio, _ in periodos[1:]], [1] * (len(periodos) - 1))
+        self.assertEqual(por_mes['A'][-1], 9)
+        with self.assertRaises(ValueError):
+            historial.serie('color')
+
+    def test_api(self):
+        self.client.force_login(User.objects.create_user('ana', password='x'))
+        url = reverse('app:historial_stock')
+        datos = self.client.get(url, {'granularidad': 'semana', 'desde': (self.hoy - timedelta(days=10)).isoformat()}).json()
+        self.assertEqual([s['clave'] for s in datos['series']], ['A', 'B'])
+        self.assertEqual(datos['series'][0]['pz'][-1], 9)
+        self.assertEqual(len(datos['periodos']), len(datos['series'][1]['pz']))
+
+        datos = self.client.get(url, {'agrupar': 'tipo', 'skus': 'B'}).json()
+        self.assertEqual(datos['series'], [{'clave': 'Toalla', 'pz': datos['series'][0]['pz']}])
+        self.assertEqual(self.client.get(url, {'granularidad': 'hora'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'desde': 'ayer'}).status_code, 400)
+
+
+class ArchivoTest(TestCase):
+    """Los movimientos viejos pasan al archivo sin que cambien reportes ni stock."""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('archivo', password='x')
+        self.client.force_login(self.usuario)
+        Producto.objects.bulk_create([
+            Producto(sku='A', nombre_tela='Tela A'),
+            Producto(sku='B', nombre_tela='Tela B'),
+        ])
+        self.ahora = timezone.now()
+        for sku, tipo, cantidad, dias in [
+            ('A', 'ENTRADA', 10, 400), ('B', 'ENTRADA', 4, 200),
+            ('A', 'SALIDA', 3, 100), ('B', 'SALIDA', 1, 5), ('A', 'ENTRADA', 2, 1),
+        ]:
+            movimiento = stock.registrar_movimiento(sku, tipo, cantidad)
+            MovimientoInventario.objects.filter(pk=movimiento.pk).update(fecha=self.ahora - timedelta(days=dias))
+        resumenes.reconstruir()
+
+    def test_archiva_con_saldo_inicial(self):
+        salida = io.StringIO()
+        call_command('archivar_movimientos', '--simular', stdout=salida)
+        self.assertIn('Se archivarían 3', salida.getvalue())
+        self.assertEqual(archivo.archivar(tamano_lote=2), 3)
+        self.assertEqual(MovimientoInventario.objects.count(), 2)
+        self.assertEqual(MovimientoArchivado.objects.count(), 3)
+        self.assertEqual(
+            dict(PuntoControlStock.objects.values_list('producto_id', 'pz')), {'A': 7, 'B': 4}
+        )
+        # Sin movimientos viejos en la tabla caliente no hay nada más que archivar.
+        self.assertEqual(archivo.archivar(), 0)
+
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(resumenes.diferencias(), [])
+        self.assertEqual(conciliacion.stock_al(self.ahora - timedelta(days=150)), {'A': 10, 'B': 4})
+        self.assertEqual(conciliacion.stock_al(self.ahora - timedelta(days=50)), {'A': 7, 'B': 4})
+
+    def test_no_archiva_recientes_con_id_menor(self):
+        # La entrada de B (id 2) se registró ayer aunque su id sea menor que la salida vieja de A (id 3).
+        reciente = MovimientoInventario.objects.get(producto_id='B', tipo_movimiento='ENTRADA')
+        MovimientoInventario.objects.filter(pk=reciente.pk).update(fecha=self.ahora - timedelta(days=1))
+        resumenes.reconstruir()
+        self.assertEqual(archivo.archivar(), 1)
+        self.assertTrue(MovimientoInventario.objects.filter(pk=reciente.pk).exists())
+        self.assertEqual(list(MovimientoArchivado.objects.values_list('cantidad', flat=True)), [10])
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(conciliacion.stock_al(self.ahora - timedelta(days=50)), {'A': 7, 'B': 0})
+
+    def test_reportes_y_exportacion_leen_el_archivo(self):
+        archivo.archivar()
+        url = reverse('app:ver_reportes')
+        pagina = self.client.get(url, {'formato': 'json'}).json()
+        self.assertEqual([m['cantidad'] for m in pagina['movimientos']], [2, 1, 3, 4, 10])
+
+        # La página que cruza de la tabla caliente al archivo, y de regreso.
+        todos = archivo.historial()
+        primera = paginacion.paginar(todos, ['-fecha', '-id'], tamano=3)
+        segunda = paginacion.paginar(todos, ['-fecha', '-id'], despues=primera.siguiente, tamano=3)
+        self.assertEqual([m.cantidad for m in segunda], [4, 10])
+        de_vuelta = paginacion.paginar(todos, ['-fecha', '-id'], antes=segunda.anterior, tamano=3)
+        self.assertEqual([m.cantidad for m in de_vuelta], [2, 1, 3])
+
+        # Un rango que no llega al archivo no lo consulta.
+        reciente = (self.ahora - timedelta(days=10)).date().isoformat()
+        self.assertEqual(len(archivo.historial(desde=self.ahora - timedelta(days=10))), 1)
+        pagina = self.client.get(url, {'formato': 'json', 'fecha_inicio': reciente,
+                                       'fecha_fin': self.ahora.date().isoformat()}).json()
+        self.assertEqual([m['cantidad'] for m in pagina['movimientos']], [2, 1])
+
+        respuesta = self.client.get(reverse('app:exportar_movimientos'))
+        filas = b''.join(respuesta.streaming_content).decode('utf-8-sig').splitlines()[1:]
+        self.assertEqual([fila.split(',')[5] for fila in filas], ['10', '4', '3', '1', '2'])
+
+
+class CargaTest(TransactionTestCase):
+    """Datos sintéticos consistentes y arnés de carga con línea base."""
+
+    def test_sembrar_y_medir(self):
+        call_command('sembrar_datos', '--productos', '40', '--movimientos', '600', '--usuarios', '3',
+                     '--dias', '120', '--semilla', '7', stdout=io.StringIO())
+        self.assertEqual(Producto.objects.filter(sku__startswith=carga.SKU_PREFIJO).count(), 40)
+        self.assertEqual(MovimientoInventario.objects.count(), 600)
+        self.assertFalse(Producto.objects.filter(pz__lt=0).exists())
+        self.assertEqual(conciliacion.diferencias(), [])
+        self.assertEqual(resumenes.diferencias(), [])
+        with self.assertRaises(CommandError):
+            call_command('sembrar_datos', '--productos', '5', '--movimientos', '5', stdout=io.StringIO())
+
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        base = os.path.join(carpeta, 'base.json')
+        call_command('prueba_carga', '--kioscos', '2', '--escaneres', '1', '--oficina', '1',
+                     '--duracion', '0.5', '--json', base, stdout=io.StringIO())
+        with open(base, encoding='utf-8') as f:
+            reporte = json.load(f)
+        self.assertGreater(reporte['total']['peticiones'], 0)
+        self.assertEqual(reporte['total']['errores'], 0)
+        self.assertIn('kiosco_post', reporte['peticiones'])
+        self.assertIn('kiosco_json', reporte['peticiones'])
+
+        salida = io.StringIO()
+        call_command('prueba_carga', '--kioscos', '20', '--escaneres', '2', '--oficina', '1', '--asgi',
+                     '--duracion', '0.5', '--json', base, stdout=salida)
+        with open(base, encoding='utf-8') as f:
+            reporte = json.load(f)
+        self.assertEqual(reporte['servidor'], 'asgi')
+        self.assertGreater(reporte['peticiones']['kiosco_json']['peticiones'], 0)
+        self.assertEqual(reporte['total']['errores'], 0)
+        self.assertLessEqual(reporte['total']['p50_ms'], reporte['total']['p99_ms'])
+        # Los movimientos del kiosco pasaron por el servicio de stock.
+        self.assertEqual(conciliacion.diferencias(), [])
+
+        # Una línea base imposible de igualar marca regresión.
+        for estadisticas in reporte['peticiones'].values():
+            estadisticas['p95_ms'] = 0.001
+        with open(base, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f)
+        with self.assertRaises(CommandError):
+            call_command('prueba_carga', '--escaneres', '1', '--kioscos', '0', '--oficina', '0',
+                         '--duracion', '0.2', '--comparar', base, stdout=io.StringIO())
+
+        carga.limpiar()
+        self.assertFalse(MovimientoInventario.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith=carga.USUARIO_PREFIJO).exists())
+
+    def test_percentiles(self):
+        filas = [('x', ms / 1000, 200) for ms in range(1, 101)]
+        estadisticas = carga.resumen(filas, 2.0)['total']
+        self.assertEqual(
+            (estadisticas['p50_ms'], estadisticas['p95_ms'], estadisticas['p99_ms'], estadisticas['por_segundo']),
+            (50.0, 95.0, 99.0, 50.0),
+        )
+
+
+class MetricasTest(TestCase):
+    """Server-Timing por petición y endpoint de métricas en formato Prometheus."""
+
+    def setUp(self):
+        self.producto = Producto.objects.create(sku='MET-1', nombre_tela='Gabardina', color='Gris', pz=2)
+        self.staff = User.objects.create_user('metricas', password='x', is_staff=True)
+
+    def _valor(self, texto, linea):
+        for renglon in texto.splitlines():
+            if renglon.startswith(linea + ' '):
+                return float(renglon.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_server_timing_y_acceso(self):
+        response = self.client.get(reverse('app:kiosco_movimiento', args=['MET-1']))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ consultas", tpl;dur=[\d.]+, total;dur=')
+
+        url = reverse('app:metricas')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with override_settings(METRICAS_TOKEN='s3creto'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3creto')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = response.content.decode()
+        self.assertIn('# TYPE fabricatextil_peticion_segundos histogram', texto)
+        self.assertIn('fabricatextil_peticion_segundos_bucket{vista="app:kiosco_movimiento",metodo="GET",le="+Inf"}', texto)
+        self.assertIn('fabricatextil_respuestas_total{vista="app:metricas",codigo="403"}', texto)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_contadores_de_negocio(self):
+        antes = metricas.exportar()
+        url = reverse('app:kiosco_movimiento', args=['MET-1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'tipo': 'salida', 'cantidad': '1'})
+            self.client.post(url, {'tipo': 'salida', 'cantidad': '5'})
+            self.client.post(
+                reverse('app:escaneo_lote'),
+                data=json.dumps({'escaneos': [
+                    {'sku': 'MET-1', 'tipo': 'entrada', 'cantidad': 3},
+                    {'sku': 'MET-1', 'tipo': 'salida', 'cantidad': 99},
+                ]}),
+                content_type='application/json',
+            )
+        despues = metricas.exportar()
+
+        def diferencia(linea):
+            return self._valor(despues, linea) - self._valor(antes, linea)
+
+        self.assertEqual(diferencia('fabricatextil_escaneos_total{origen="kiosco"}'), 2)
+        self.assertEqual(diferencia('fabricatextil_escaneos_total{origen="lote"}'), 2)
+        self.assertEqual(diferencia('fabricatextil_salidas_rechazadas_total{origen="kiosco"}'), 1)
+        self.assertEqual(diferencia('fabricatextil_salidas_rechazadas_total{origen="lote"}'), 1)
+        self.assertEqual(diferencia('fabricatextil_movimientos_stock_total{tipo="SALIDA"}'), 1)
+        self.assertEqual(diferencia('fabricatextil_movimientos_stock_total{tipo="ENTRADA"}'), 1)
+        self.assertGreaterEqual(self._valor(despues, 'fabricatextil_escaneos_por_minuto'), 4)
+
+    def test_ventana_por_minuto(self):
+        ventana = metricas.VentanaPorMinuto('prueba_ventana', 'Solo para la prueba.')
+        metricas._registro.remove(ventana)
+        ventana.sumar(3, ahora=1000)
+        ventana.sumar(2, ahora=1030)
+        self.assertEqual(ventana.valor(ahora=1059), 5)
+        self.assertEqual(ventana.valor(ahora=1061), 2)
+        # La cubeta del segundo 1060 reutiliza la de 1000 y empieza en cero.
+        ventana.sumar(1, ahora=1060)
+        self.assertEqual(ventana.valor(ahora=1060), 3)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PresupuestoConsultasTest(TestCase):
+    """
+    Cada vista y changelist del admin hace el mismo número de consultas sin
+    importar cuántas filas muestre, y nunca más que su presupuesto. Si una
+    plantilla nueva lee una relación por fila, la cuenta crece y esto falla.
+    """
+
+    PRESUPUESTOS = {
+        'app:index': 3,
+        'app:about': 0,
+        'app:contact': 0,
+        'app:lista_productos': 1,
+        'app:lista_productos?formato=json': 1,
+        'app:detalle_producto': 2,
+        'app:kiosco_movimiento': 1,
+        'app:dashboard': 8,
+        'app:ver_reportes': 9,
+        'app:ver_reportes?formato=json': 5,
+        'app:exportar_movimientos': 5,
+        'app:exportar_stock': 3,
+        'admin:app_producto_changelist': 8,
+        'admin:app_movimientoinventario_changelist': 7,
+        'admin:app_movimientoarchivado_changelist': 4,
+        'admin:app_trabajo_changelist': 6,
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('presupuesto', 'p@x.com', 'x')
+        self.client.force_login(self.admin)
+        self.producto = Producto.objects.create(sku='PRE-0', nombre_tela='Loneta', color='Crudo', pz=0)
+        self.filas = 0
+        self._agregar(2)
+
+    def _agregar(self, n):
+        """``n`` productos, movimientos (calientes y archivados) y trabajos, cada uno con su propio usuario."""
+        hace_un_anio = timezone.now() - timedelta(days=365)
+        for _ in range(n):
+            self.filas += 1
+            usuario = User.objects.create_user(f'operador-{self.filas}', password='x')
+            producto = Producto.objects.create(
+                sku=f'PRE-{self.filas}', nombre_tela=f'Tela {self.filas}', color='Azul', pz=3,
+            )
+            for p in (producto, self.producto):
+                MovimientoInventario.objects.create(
+                    producto=p, usuario=usuario, tipo_movimiento='ENTRADA', cantidad=1, notas='Presupuesto',
+                )
+            MovimientoArchivado.objects.create(
+                id=10_000 + self.filas, producto=producto, usuario=usuario,
+                tipo_movimiento='SALIDA', cantidad=1, fecha=hace_un_anio,
+            )
+            Trabajo.objects.create(tipo='describir_faltantes', usuario=usuario)
+
+    def _url(self, nombre):
+        nombre, _, consulta = nombre.partition('?')
+        args = ['PRE-0'] if nombre in ('app:detalle_producto', 'app:kiosco_movimiento') else []
+        return reverse(nombre, args=args) + (f'?{consulta}' if consulta else '')
+
+    def _consultas(self, nombre):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(self._url(nombre))
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, nombre)
+        return len(consultas)
+
+    def test_consultas_fijas_por_vista(self):
+        pocas = {nombre: self._consultas(nombre) for nombre in self.PRESUPUESTOS}
+        self._agregar(20)
+        for nombre, presupuesto in self.PRESUPUESTOS.items():
+            with self.subTest(vista=nombre):
+                muchas = self._consultas(nombre)
+                self.assertEqual(muchas, pocas[nombre], f'{nombre}: {pocas[nombre]} con 2 filas, {muchas} con 22')
+                self.assertLessEqual(muchas, presupuesto)
+
+    def test_str_sin_usuario_no_consulta(self):
+        movimiento = MovimientoInventario.objects.create(producto=self.producto, tipo_movimiento='SALIDA', cantidad=1)
+        movimiento = MovimientoInventario.objects.get(pk=movimiento.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(movimiento), 'Salida (1) - Sistema')
+
+
+@override_settings(STOCK_MINIMO_POR_TIPO={'Tela': 5, 'Toalla': 24}, CACHES=CACHE_LOCAL)
+class AlertasStockTest(TestCase):
+    """Stock mínimo por tipo o por SKU, marca bajo_minimo y avisos de cruce."""
+
+    def setUp(self):
+        cache.clear()
+        self.cruces = []
+        alertas.umbral_cruzado.connect(self._recibir)
+        self.addCleanup(alertas.umbral_cruzado.disconnect, self._recibir)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tela = Producto.objects.create(sku='TEL-1', nombre_tela='Manta', tipo='Tela', pz=20)
+            self.toalla = Producto.objects.create(sku='TOA-1', nombre_tela='Toalla baño', tipo='Toalla', pz=20)
+        self.cruces.clear()
+
+    def _recibir(self, sender, sku, pz, minimo, bajo, **kwargs):
+        self.cruces.append((sku, pz, minimo, bajo))
+
+    def _marcados(self):
+        return set(Producto.objects.filter(bajo_minimo=True).values_list('sku', flat=True))
+
+    def test_minimo_por_tipo_y_por_sku(self):
+        # 20 toallas están bajo el mínimo de su tipo; 20 rollos de tela no.
+        self.assertEqual(self._marcados(), {'TOA-1'})
+        self.assertEqual(kpis.productos_bajo_stock(), 1)
+        self.assertEqual(kpis.alerta_stock(), [{'sku': 'TOA-1', 'nombre_tela': 'Toalla baño', 'pz': 20, 'minimo': 24}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.toalla.stock_minimo = 10
+            self.toalla.save()
+            self.tela.stock_minimo = 30
+            self.tela.save()
+        self.assertEqual(self._marcados(), {'TEL-1'})
+        self.assertCountEqual(self.cruces, [('TOA-1', 20, 10, False), ('TEL-1', 20, 30, True)])
+        self.assertEqual(kpis.productos_bajo_stock(), 1)
+
+    def test_cruces_en_el_servicio_de_stock(self):
+        kpis.productos_bajo_stock(), kpis.alerta_stock()
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.registrar_movimiento('TEL-1', 'SALIDA', 15)   # 5: cruza
+            stock.registrar_movimiento('TEL-1', 'SALIDA', 2)    # 3: ya estaba abajo
+            stock.registrar_lote([{'sku': 'TOA-1', 'tipo_movimiento': 'ENTRADA', 'cantidad': 10}])  # 30: se repone
+        self.assertEqual(self.cruces, [('TEL-1', 5, 5, True), ('TOA-1', 30, 24, False)])
+        self.assertEqual(self._marcados(), {'TEL-1'})
+        with self.assertNumQueries(0):
+            self.assertEqual(kpis.productos_bajo_stock(), 1)
+
+        self.cruces.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.ajustar_stock('TEL-1', 40)
+            conciliacion.reparar([('TOA-1', 30, 2)], modo='contador')
+        self.assertEqual(self.cruces, [('TEL-1', 40, 5, False), ('TOA-1', 2, 24, True)])
+        self.assertEqual(self._marcados(), {'TOA-1'})
+        self.assertEqual([p['sku'] for p in kpis.alerta_stock()], ['TOA-1'])
+
+    def test_rollback_no_avisa(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    stock.registrar_movimiento('TEL-1', 'SALIDA', 20)
+                    raise RuntimeError
+        self.assertEqual(self.cruces, [])
+        self.assertEqual(self._marcados(), {'TOA-1'})
+
+    def test_recalcular_tras_cambiar_minimos(self):
+        with override_settings(STOCK_MINIMO_POR_TIPO={'Tela': 25, 'Toalla': 5}):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('recalcular_alertas', stdout=io.StringIO())
+            self.assertEqual(self._marcados(), {'TEL-1'})
+        self.assertEqual(len(self.cruces), 2)
+
+    def test_importacion_con_minimo(self):
+        archivo = io.BytesIO('sku,nombre_tela,tipo,Stock Mínimo,pz\nTOA-2,Toalla mano,Toalla,,30\nTEL-2,Lino,Tela,40,30\n'.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            importar.importar_catalogo(importar.leer_filas(archivo, 'catalogo.csv'))
+        self.assertEqual(self._marcados(), {'TOA-1', 'TEL-2'})
+        self.assertEqual(Producto.objects.get(pk='TEL-2').stock_minimo, 40)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class GetCondicionalTest(TestCase):
+    """ETag / Last-Modified por versión del producto y fragmentos en caché."""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('tableta', password='x')
+        self.client.force_login(self.usuario)
+        self.producto = Producto.objects.create(sku='CND-1', nombre_tela='Popelina', color='Blanco', pz=4)
+
+    def test_version_sube_con_save_y_stock(self):
+        version = Producto.objects.get(pk='CND-1').version
+        stock.registrar_movimiento('CND-1', 'ENTRADA', 2)
+        stock.registrar_lote([{'sku': 'CND-1', 'tipo_movimiento': 'SALIDA', 'cantidad': 1}])
+        stock.ajustar_stock('CND-1', 10)
+        producto = Producto.objects.get(pk='CND-1')
+        self.assertEqual(producto.version, version + 3)
+        producto.color = 'Crema'
+        producto.save()
+        self.assertEqual(producto.version, version + 4)
+        producto.save(update_fields=['ubicacion'])
+        self.assertEqual(Producto.objects.get(pk='CND-1').version, version + 5)
+
+    def test_detalle_304_hasta_que_cambia(self):
+        url = reverse('app:detalle_producto', args=['CND-1'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Un acierto: solo la lectura del producto, sin sesión ni render.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        stock.registrar_movimiento('CND-1', 'SALIDA', 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Otra cookie CSRF (p. ej. después de iniciar sesión) es otro ETag.
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 32
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_fragmentos_por_version(self):
+        url = reverse('app:detalle_producto', args=['CND-1'])
+        stock.registrar_movimiento('CND-1', 'ENTRADA', 3, notas='Primera')
+        self.assertContains(self.client.get(url), 'Primera')
+        # Ficha y actividad salen del caché: falta la consulta de movimientos.
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        stock.registrar_movimiento('CND-1', 'SALIDA', 2, notas='Segunda')
+        self.assertContains(self.client.get(url), 'Segunda')
+
+        lista = reverse('app:lista_productos')
+        self.assertContains(self.client.get(lista), '5 pz')
+        stock.registrar_movimiento('CND-1', 'ENTRADA', 4)
+        self.assertContains(self.client.get(lista), '9 pz')
+        self.producto.refresh_from_db()
+        self.producto.ubicacion = 'Pasillo 9'
+        self.producto.save()
+        self.assertContains(self.client.get(lista), 'Pasillo 9')
+
+    def test_fraccionado_sin_304_ni_actividad_en_cache(self):
+        url = reverse('app:detalle_producto', args=['CND-1'])
+        fracciones.configurar('CND-1', 2)
+        response = self.client.get(url)
+        self.assertNotIn('ETag', response)
+        # La versión no sube con el escaneo, pero la actividad lo muestra.
+        stock.registrar_movimiento('CND-1', 'SALIDA', 1, notas='En fracciones')
+        self.assertContains(self.client.get(url), 'En fracciones')
+
+    def test_lista_304(self):
+        url = reverse('app:lista_productos')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url + '?formato=json', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Producto.objects.create(sku='CND-2', nombre_tela='Organza', pz=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_kiosco_con_mensaje_no_responde_304(self):
+        url = reverse('app:kiosco_movimiento', args=['CND-1'])
+        etag = self.client.get(url)['ETag']
+        # Salida rechazada: el stock (y la versión) no cambian, pero el aviso se debe ver.
+        self.client.post(url, {'tipo': 'salida', 'cantidad': '50'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Stock insuficiente')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('app:kiosco_movimiento', args=['NO-EXISTE'])).status_code, 404)
+
+
+@override_settings(IA_CLIENTE='app.ia.ClienteFalso')
+class AsgiTest(TestCase):
+    """Las vistas async del escaneo y de la IA, por la pila ASGI."""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('asgi', password='x')
+        Producto.objects.create(sku='ASG-1', nombre_tela='Gabardina', pz=5)
+
+    async def test_kiosco(self):
+        url = reverse('app:kiosco_movimiento', args=['ASG-1'])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        response = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        data = (await self.async_client.post(url + '?formato=json', {'tipo': 'entrada', 'cantidad': 2})).json()
+        self.assertEqual((data['ok'], data['pz']), (True, 7))
+        response = await self.async_client.post(url, {'tipo': 'salida', 'cantidad': 50})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual((await Producto.objects.aget(pk='ASG-1')).pz, 7)
+        self.assertEqual((await self.async_client.get(reverse('app:kiosco_movimiento', args=['NO']))).status_code, 404)
+
+    async def test_lote_y_sincronizacion(self):
+        lote = {'escaneos': [{'sku': 'ASG-1', 'tipo': 'salida', 'cantidad': 2, 'clave': 'a1'}]}
+        for nombre in ('app:escaneo_lote', 'app:sincronizar_escaneos'):
+            data = (await self.async_client.post(
+                reverse(nombre), json.dumps(lote), content_type='application/json',
+            )).json()
+            self.assertEqual(data['aceptadas'], 1)
+        self.assertEqual((await Producto.objects.aget(pk='ASG-1')).pz, 3)
+        self.assertEqual(await MovimientoInventario.objects.acount(), 1)
+
+    async def test_descripcion(self):
+        url = reverse('app:generar_descripcion')
+        response = await self.async_client.post(url, {'sku': 'ASG-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 302)  # login_required
+
+        await self.async_client.aforce_login(self.usuario)
+        response = await self.async_client.post(url, {'sku': 'ASG-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        estado = await self.async_client.get(response.json()['estado_url'])
+        self.assertEqual(estado.json()['estado'], 'PENDIENTE')
+        trabajo = await Trabajo.objects.aget()
+        self.assertEqual(trabajo.usuario_id, self.usuario.pk)
+
+        await sync_to_async(trabajos.ejecutar)(trabajo)
+        response = await self.async_client.post(url, {'sku': 'ASG-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Gabardina', response.json()['descripcion'])
+        response = await self.async_client.post(url, {'sku': 'NO'}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ReplicaTest(TransactionTestCase):
+    """Perfil SQLite y lecturas de reportes en la réplica."""
+
+    def setUp(self):
+        self.router = bd.RouterReportes()
+        self.con_replica = mock.patch.object(bd, 'hay_replica', return_value=True)
+
+    def test_perfil_sqlite(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertGreater(cursor.fetchone()[0], 0)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_base_incluida_sin_wal(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, 'incluida.sqlite3')
+            for forzar, esperado in (('', 'delete'), ('1', 'wal')):
+                crudo = sqlite3.connect(ruta)
+                falsa = mock.Mock(vendor='sqlite', alias=bd.PRINCIPAL, settings_dict={'NAME': ruta}, connection=crudo)
+                with self.settings(SQLITE_INCLUIDA=ruta, SQLITE_WAL=forzar):
+                    bd.activar_wal(None, falsa)
+                self.assertEqual(crudo.execute('PRAGMA journal_mode').fetchone()[0], esperado)
+                crudo.close()
+
+    def test_router(self):
+        with self.con_replica:
+            self.assertEqual(self.router.db_for_read(MovimientoInventario), bd.PRINCIPAL)
+            with bd.en_replica():
+                self.assertEqual(self.router.db_for_read(MovimientoInventario), bd.REPLICA)
+                self.assertEqual(self.router.db_for_write(MovimientoInventario), bd.PRINCIPAL)
+                # Sesión y usuarios nunca salen de la principal.
+                self.assertEqual(self.router.db_for_read(User), bd.PRINCIPAL)
+                with bd.en_principal():
+                    self.assertEqual(self.router.db_for_read(Producto), bd.PRINCIPAL)
+        with bd.en_replica():
+            self.assertEqual(self.router.db_for_read(Producto), bd.PRINCIPAL)
+        self.assertFalse(self.router.allow_migrate(bd.REPLICA, 'app'))
+
+    def test_streaming_lee_de_la_replica(self):
+        def vista(request):
+            destinos = (self.router.db_for_read(MovimientoInventario) for _ in range(3))
+            return StreamingHttpResponse(destinos)
+
+        with self.con_replica:
+            respuesta = bd.reportes(vista)(None)
+            self.assertEqual(self.router.db_for_read(MovimientoInventario), bd.PRINCIPAL)
+            self.assertEqual(b''.join(respuesta.streaming_content), b'replica' * 3)
+
+    def test_kpis_se_calculan_en_la_principal(self):
+        Producto.objects.create(sku='REP-1', nombre_tela='Lona', pz=3)
+        kpis.invalidar()
+        # Sin la réplica configurada de verdad, leer de ella fallaría.
+        with self.con_replica, bd.en_replica():
+            self.assertEqual(kpis.total_piezas(), 3)
+
+    def test_copiar_replica(self):
+        Producto.objects.create(sku='REP-2', nombre_tela='Manta', pz=1)
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        destino = os.path.join(carpeta, 'replica.sqlite3')
+        self.assertGreater(bd.copiar_replica(connection.settings_dict['NAME'], destino), 0)
+        copia = sqlite3.connect(destino)
+        self.addCleanup(copia.close)
+        self.assertEqual(copia.execute('SELECT sku FROM app_producto').fetchall(), [('REP-2',)])
+        with self.assertRaises(CommandError):
+            call_command('copiar_replica', stdout=io.StringIO())
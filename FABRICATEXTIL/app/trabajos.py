@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajos en la base de datos.
+
+``encolar`` guarda un ``Trabajo`` PENDIENTE y el comando ``trabajador`` los
+toma uno a uno con un UPDATE condicional (``WHERE estado = 'PENDIENTE'``):
+si dos trabajadores eligen el mismo, solo uno gana y el otro busca el
+siguiente. Un fallo se reintenta con espera creciente hasta ``max_intentos``;
+un trabajo que quedó EN_PROCESO porque su trabajador murió se libera pasado
+``VENCIMIENTO``.
+
+Los tipos de trabajo se registran con ``@manejador('tipo')``.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ia
+from .models import Producto, Trabajo, nueva_version
+
+logger = logging.getLogger(__name__)
+
+VENCIMIENTO = timedelta(minutes=15)
+ESPERA_REINTENTO = timedelta(seconds=30)
+CONCURRENCIA_IA = 4
+# Fallos que no se arreglan reintentando: el trabajo pasa directo a FALLIDO.
+ERRORES_PERMANENTES = (ia.ProveedorNoDisponible,)
+
+_manejadores = {}
+
+
+def manejador(tipo):
+    """Registra la función que ejecuta los trabajos de ``tipo``."""
+    def registrar(funcion):
+        _manejadores[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(tipo, usuario=None, **parametros):
+    if tipo not in _manejadores:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    return Trabajo.objects.create(tipo=tipo, parametros=parametros, usuario=usuario)
+
+
+async def aencolar(tipo, usuario=None, **parametros):
+    """``encolar`` con el ORM asíncrono (vistas async)."""
+    if tipo not in _manejadores:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    return await Trabajo.objects.acreate(tipo=tipo, parametros=parametros, usuario=usuario)
+
+
+def liberar_vencidos():
+    """Regresa a PENDIENTE los trabajos EN_PROCESO abandonados."""
+    limite = timezone.now() - VENCIMIENTO
+    return Trabajo.objects.filter(estado='EN_PROCESO', iniciado__lt=limite).update(
+        estado='PENDIENTE', trabajador=''
+    )
+
+
+def tomar(trabajador):
+    """Reclama el siguiente trabajo disponible, o ``None`` si no hay."""
+    while True:
+        candidato = (
+            Trabajo.objects.filter(estado='PENDIENTE', disponible_desde__lte=timezone.now())
+            .order_by('disponible_desde', 'id').values_list('pk', flat=True).first()
+        )
+        if candidato is None:
+            return None
+        ganado = Trabajo.objects.filter(pk=candidato, estado='PENDIENTE').update(
+            estado='EN_PROCESO', trabajador=trabajador, iniciado=timezone.now()
+        )
+        if ganado:
+            return Trabajo.objects.get(pk=candidato)
+
+
+def ejecutar(trabajo):
+    """Corre el trabajo ya reclamado y guarda el resultado o el error."""
+    trabajo.intentos += 1
+    try:
+        resultado = _manejadores[trabajo.tipo](trabajo, **trabajo.parametros)
+    except Exception as e:
+        logger.exception("Falló el trabajo %s", trabajo)
+        trabajo.error = f"{type(e).__name__}: {e}"
+        if trabajo.intentos < trabajo.max_intentos and not isinstance(e, ERRORES_PERMANENTES):
+            trabajo.estado = 'PENDIENTE'
+            trabajo.disponible_desde = timezone.now() + ESPERA_REINTENTO * 2 ** (trabajo.intentos - 1)
+            trabajo.trabajador = ''
+        else:
+            trabajo.estado = 'FALLIDO'
+            trabajo.terminado = timezone.now()
+    else:
+        trabajo.estado = 'TERMINADO'
+        trabajo.resultado = resultado
+        trabajo.error = ''
+        trabajo.terminado = timezone.now()
+    trabajo.save(update_fields=[
+        'estado', 'resultado', 'error', 'intentos', 'disponible_desde', 'terminado', 'trabajador',
+    ])
+    return trabajo
+
+
+def procesar_pendientes(trabajador, limite=None):
+    """Ejecuta trabajos hasta vaciar la cola (o hasta ``limite``). Devuelve cuántos corrió."""
+    hechos = 0
+    while limite is None or hechos < limite:
+        trabajo = tomar(trabajador)
+        if trabajo is None:
+            break
+        ejecutar(trabajo)
+        hechos += 1
+    return hechos
+
+
+# --- Trabajos de IA ---
+
+_SIN_DESCRIPCION = Q(descripcion__isnull=True) | Q(descripcion='')
+
+
+@manejador('descripcion')
+def _descripcion(trabajo, prompt=None, sku=None):
+    if prompt is None:
+        prompt = ia.prompt_descripcion(Producto.objects.get(pk=sku))
+    return {'descripcion': ia.generar(prompt)}
+
+
+def _describir_uno(producto):
+    try:
+        texto = ia.generar(ia.prompt_descripcion(producto))
+        # Solo si sigue vacía: no se pisa una descripción escrita mientras tanto.
+        return Producto.objects.filter(_SIN_DESCRIPCION, pk=producto.pk).update(
+            descripcion=texto, **nueva_version()
+        )
+    finally:
+        # Cada hilo abre su propia conexión; se cierra al terminar.
+        connection.close()
+
+
+@manejador('describir_faltantes')
+def _describir_faltantes(trabajo, skus=None, concurrencia=None, limite=None):
+    """
+    Genera la descripción de los productos que no tienen (todos, o solo los
+    de ``skus``). Las llamadas al modelo se hacen en paralelo, como máximo
+    ``concurrencia`` a la vez.
+    """
+    concurrencia = concurrencia or getattr(settings, 'IA_CONCURRENCIA', CONCURRENCIA_IA)
+    faltantes = (
+        Producto.objects.filter(_SIN_DESCRIPCION).order_by('sku')
+        .only('sku', 'nombre_tela', 'tipo', 'composicion', 'color', 'ancho')
+    )
+    if skus is not None:
+        faltantes = faltantes.filter(pk__in=skus)
+    if limite:
+        faltantes = faltantes[:limite]
+    productos = list(faltantes)
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as grupo:
+        actualizados = sum(grupo.map(_describir_uno, productos))
+    return {'pendientes': len(productos), 'actualizados': actualizados}
@@ -21,6 +21,8 @@ urlpatterns = [
     path('producto/<str:producto_sku>/registrar-entrada/', views.registrar_entrada, name='registrar_entrada'),
     path('producto/<str:producto_sku>/registrar-salida/', views.registrar_salida, name='registrar_salida'),
     path('producto/<str:sku>/ajustar/', views.ajustar_stock, name='ajustar_stock'),
+    path('producto/<str:sku>/qr/<str:tipo>.<str:formato>', views.qr_producto, name='qr_producto'),
+    path('etiquetas/', views.etiquetas_pdf, name='etiquetas_pdf'),
 
     # --- RUTA CLAVE (PIEZA POR PIEZA) ---
     path('producto/<str:sku>/accionar/', views.accion_producto, name='accion_producto'),
@@ -28,11 +30,20 @@ urlpatterns = [
     # Herramientas
     path('escaner/', views.escaner_view, name='escaner_view'),
     path('reportes/', views.ver_reportes, name='ver_reportes'),
+    path('reportes/exportar/movimientos/', views.exportar_movimientos, name='exportar_movimientos'),
+    path('reportes/exportar/stock/', views.exportar_stock, name='exportar_stock'),
 
     # AGREGA ESTA NUEVA LÍNEA:
     path('escaner/camara/', views.camara_view, name='camara_view'),
 
     path('kiosco/<str:sku>/', views.kiosco_movimiento, name='kiosco_movimiento'),
+    path('api/escaneos/lote/', views.escaneo_lote, name='escaneo_lote'),
+    path('api/escaneos/sincronizar/', views.sincronizar_escaneos, name='sincronizar_escaneos'),
+    path('api/descripcion/', views.generar_descripcion_api, name='generar_descripcion'),
+    path('api/descripcion/faltantes/', views.describir_faltantes_api, name='describir_faltantes'),
+    path('api/trabajos/<int:pk>/', views.estado_trabajo, name='estado_trabajo'),
+    path('api/stock/historial/', views.historial_stock, name='historial_stock'),
+    path('metricas/', views.metricas_view, name='metricas'),
 
     path('secreto-admin/', views.crear_superusuario_rapido, name='crear_admin'),
 
@@ -1,27 +1,26 @@
 # -*- coding: utf-8 -*-
+import hmac
 import json
-import os
-import google.generativeai as genai
-from datetime import datetime, timedelta
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponseRedirect, JsonResponse, HttpResponse
-# IMPORTANTE: Se agregaron Count y F para los gráficos del Dashboard
-from django.db.models import Sum, Count, F
+from datetime import date, datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Q
 from django.urls import reverse
 from django.contrib import messages
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 
-from .models import Producto, MovimientoInventario
+from .models import Producto, Trabajo
+from . import (
+    archivo, bd, busqueda, condicional, etiquetas, exportar, fracciones, historial, ia, kpis, metricas, paginacion,
+    resumenes, stock, trabajos,
+)
 from .forms import ProductoForm, MovimientoForm, AjustarStockForm
 
-# --- CONFIGURACIÓN DE IA (Gemini) ---
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', 'TU_API_KEY_AQUI') 
-genai.configure(api_key=GEMINI_API_KEY)
-
 # --- Vistas de Producto (CRUD) ---
 
 @login_required
@@ -29,7 +28,15 @@ def crear_producto(request):
     if request.method == 'POST':
         form = ProductoForm(request.POST)
         if form.is_valid():
-            producto_nuevo = form.save()
+            # El stock inicial entra como movimiento para que el historial cuadre con pz.
+            with transaction.atomic():
+                producto_nuevo = form.save(commit=False)
+                pz_inicial, producto_nuevo.pz = producto_nuevo.pz, 0
+                producto_nuevo.save()
+                if pz_inicial > 0:
+                    stock.registrar_movimiento(
+                        producto_nuevo, 'ENTRADA', pz_inicial, usuario=request.user, notas='Stock inicial'
+                    )
             return redirect('app:detalle_producto', sku=producto_nuevo.sku)
     else:
         form = ProductoForm()
@@ -37,8 +44,10 @@ def crear_producto(request):
     return render(request, 'app/producto_form.html', contexto)
 
 
+@condicional.producto
 def detalle_producto(request, sku):
-    producto = get_object_or_404(Producto, sku=sku)
+    producto = condicional.obtener(request, sku)
+    fracciones.al_dia([producto])
 
     url_info = request.build_absolute_uri(
         reverse('app:detalle_producto', args=[producto.sku])
@@ -48,8 +57,17 @@ def detalle_producto(request, sku):
         reverse('app:kiosco_movimiento', args=[producto.sku])
     )
 
+    # Últimos 10 con su usuario en la misma consulta (la plantilla muestra el nombre)
+    ultimos_movimientos = (
+        producto.movimientoinventario_set.select_related('usuario').order_by('-fecha', '-id')[:10]
+    )
+
     contexto = {
         'producto': producto,
+        'ultimos_movimientos': ultimos_movimientos,
+        # La actividad se guarda por versión; un SKU fraccionado no la sube con cada
+        # movimiento (ver app/fracciones.py), así que la suya no se guarda (0 = sin caché).
+        'cache_actividad': 0 if producto.fracciones else 3600,
         'url_qr_info': url_info,
         'url_qr_accion': url_accion
     }
@@ -61,11 +79,22 @@ def editar_producto(request, sku):
     producto = get_object_or_404(Producto, sku=sku)
     if request.method == 'POST':
         form = ProductoForm(request.POST, instance=producto)
+        form.fields['sku'].disabled = True
         if form.is_valid():
-            form.save()
+            # pz no se sobrescribe: el cambio pasa por el servicio de stock como ajuste,
+            # y solo si el usuario cambió el valor que se le mostró.
+            mostrado = form.cleaned_data['pz_mostrado']
+            cambio_pz = form.cleaned_data['pz'] != mostrado if mostrado is not None else 'pz' in form.changed_data
+            with transaction.atomic():
+                producto = form.save(commit=False)
+                producto.save(update_fields=[campo for campo in form.Meta.fields if campo not in ('sku', 'pz')])
+                if cambio_pz:
+                    stock.ajustar_stock(producto, producto.pz, usuario=request.user)
             return redirect('app:detalle_producto', sku=producto.sku)
     else:
-        form = ProductoForm(instance=producto)
+        fracciones.al_dia([producto])
+        form = ProductoForm(instance=producto, initial={'pz_mostrado': producto.pz})
+        form.fields['sku'].disabled = True
     contexto = { 'form': form, 'titulo': f'Editando: {producto.sku}', 'producto': producto }
     return render(request, 'app/producto_form.html', contexto)
 
@@ -80,16 +109,48 @@ def eliminar_producto(request, sku):
     return render(request, 'app/eliminar_producto.html', contexto)
 
 
+def _producto_json(p):
+    return {
+        'sku': p.sku, 'nombre_tela': p.nombre_tela, 'tipo': p.tipo,
+        'color': p.color, 'pz': p.pz, 'ubicacion': p.ubicacion,
+    }
+
+
 def lista_productos(request):
     query = request.GET.get('q')
+    pagina = None
     if query:
-        # Búsqueda básica por nombre o SKU
-        productos = Producto.objects.filter(nombre_tela__icontains=query) | Producto.objects.filter(sku__icontains=query)
+        # Búsqueda indexada (FTS5) por SKU, nombre, color, composición y ubicación,
+        # ordenada por relevancia
+        productos = busqueda.buscar_productos(query)
     else:
-        productos = Producto.objects.all()
-        
-    productos = productos.order_by('nombre_tela') 
-    contexto = { 'productos': productos, 'query': query }
+        # Paginación por cursor sobre (nombre_tela, sku): sin OFFSET ni COUNT(*)
+        pagina = paginacion.paginar(
+            Producto.objects.all(), ['nombre_tela', 'sku'],
+            despues=request.GET.get('despues'), antes=request.GET.get('antes'),
+        )
+        productos = pagina.items
+    # Stock exacto de los SKUs fraccionados (su pz es el del último pliegue)
+    fracciones.al_dia(productos)
+
+    # Si nada de la página cambió (SKUs y versiones), 304 sin renderizar.
+    return condicional.lista(request, productos, lambda: _lista_productos(request, productos, pagina, query))
+
+
+def _lista_productos(request, productos, pagina, query):
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'productos': [_producto_json(p) for p in productos],
+            'siguiente': pagina.siguiente if pagina else None,
+            'anterior': pagina.anterior if pagina else None,
+        })
+
+    contexto = {
+        'productos': productos,
+        'query': query,
+        'url_siguiente': pagina.url_siguiente(request) if pagina else None,
+        'url_anterior': pagina.url_anterior(request) if pagina else None,
+    }
     return render(request, 'app/lista_productos.html', contexto)
 
 
@@ -101,21 +162,19 @@ def registrar_entrada(request, producto_sku):
     if request.method == 'POST':
         form = MovimientoForm(request.POST)
         if form.is_valid():
-            movimiento = form.save(commit=False)
-            movimiento.producto = producto
-            movimiento.tipo_movimiento = 'ENTRADA'
-            # Asignar usuario si está disponible (mejora de auditoría)
-            if request.user.is_authenticated:
-                movimiento.usuario = request.user
-            movimiento.save()
-            
-            cantidad_entrada = form.cleaned_data.get('cantidad', 0)
-            producto.pz += cantidad_entrada
-            producto.save()
-            
-            return redirect('app:detalle_producto', sku=producto.sku)
+            try:
+                stock.registrar_movimiento(
+                    producto, 'ENTRADA',
+                    form.cleaned_data.get('cantidad', 0),
+                    usuario=request.user,
+                    notas=form.cleaned_data.get('notas'),
+                )
+                return redirect('app:detalle_producto', sku=producto.sku)
+            except ValueError as e:
+                form.add_error('cantidad', str(e))
     else:
         form = MovimientoForm()
+    fracciones.al_dia([producto])
     contexto = { 'form': form, 'producto': producto, 'titulo': 'Registrar Entrada' }
     return render(request, 'app/registrar_movimiento.html', contexto)
 
@@ -126,22 +185,21 @@ def registrar_salida(request, producto_sku):
     if request.method == 'POST':
         form = MovimientoForm(request.POST)
         if form.is_valid():
-            movimiento = form.save(commit=False)
-            movimiento.producto = producto
-            movimiento.tipo_movimiento = 'SALIDA'
-            cantidad_salida = form.cleaned_data.get('cantidad', 0)
-            
-            if producto.pz >= cantidad_salida:
-                if request.user.is_authenticated:
-                    movimiento.usuario = request.user
-                movimiento.save()
-                producto.pz -= cantidad_salida
-                producto.save()
+            try:
+                stock.registrar_movimiento(
+                    producto, 'SALIDA',
+                    form.cleaned_data.get('cantidad', 0),
+                    usuario=request.user,
+                    notas=form.cleaned_data.get('notas'),
+                )
                 return redirect('app:detalle_producto', sku=producto.sku)
-            else:
-                form.add_error(None, f"No hay stock suficiente ({producto.pz})")
+            except stock.StockInsuficiente as e:
+                form.add_error(None, f"No hay stock suficiente ({e.disponible})")
+            except ValueError as e:
+                form.add_error('cantidad', str(e))
     else:
         form = MovimientoForm()
+    fracciones.al_dia([producto])
     contexto = { 'form': form, 'producto': producto, 'titulo': 'Registrar Salida' }
     return render(request, 'app/registrar_movimiento.html', contexto)
 
@@ -149,52 +207,166 @@ def registrar_salida(request, producto_sku):
 # --- NUEVA VISTA: KIOSCO (Escaneo Rápido) ---
 # Esta vista NO requiere @login_required para agilidad en almacén
 
-def kiosco_movimiento(request, sku):
-    producto = get_object_or_404(Producto, sku=sku)
+# Estado HTTP de la vía JSON del kiosco cuando reintentar no arregla el error.
+ESTADO_ERROR = {'linea_invalida': 400, 'clave_reutilizada': 409}
+
+
+@condicional.producto
+async def kiosco_movimiento(request, sku):
+    producto = await condicional.aobtener(request, sku)
 
     if request.method == 'POST':
-        tipo = request.POST.get('tipo') # 'entrada' o 'salida'
-        try:
-            cantidad = int(request.POST.get('cantidad', 1))
-        except ValueError:
-            cantidad = 1
-        
         # Intentamos obtener usuario si hay sesión iniciada, si no, es anónimo (Sistema)
-        usuario_actual = request.user if request.user.is_authenticated else None
-
-        if tipo == 'entrada':
-            producto.pz += cantidad
-            producto.save()
-            
-            MovimientoInventario.objects.create(
-                producto=producto, 
-                tipo_movimiento='ENTRADA', 
-                cantidad=cantidad, 
-                notas='Escaneo Rápido (Kiosco)',
-                usuario=usuario_actual
-            )
-            messages.success(request, f'✅ Se agregaron {cantidad} pz a {producto.nombre_tela}')
-            
-        elif tipo == 'salida':
-            if producto.pz >= cantidad:
-                producto.pz -= cantidad
-                producto.save()
-                
-                MovimientoInventario.objects.create(
-                    producto=producto, 
-                    tipo_movimiento='SALIDA', 
-                    cantidad=cantidad, 
-                    notas='Escaneo Rápido (Kiosco)',
-                    usuario=usuario_actual
-                )
-                messages.warning(request, f'🔻 Se retiraron {cantidad} pz de {producto.nombre_tela}')
-            else:
-                messages.error(request, f'❌ Stock insuficiente. Tienes {producto.pz}, intentaste sacar {cantidad}.')
-
+        usuario = await request.auser()
+        # El servicio de stock usa transacciones: corre en un hilo, no en el event loop
+        resultado, nivel, mensaje = await stock.en_fila(
+            _escaneo_kiosco, request, producto, usuario if usuario.is_authenticated else None,
+        )
+
+        if request.GET.get('formato') == 'json':
+            # Vía rápida del kiosco (fetch): sin redirect, sin re-render y sin mensaje en la sesión.
+            # Como en la API de lotes, una salida rechazada es un 200 con ok=False.
+            estado = ESTADO_ERROR.get(resultado.get('error'), 200)
+            return JsonResponse({**resultado, 'nivel': nivel, 'mensaje': mensaje}, status=estado)
+
+        if mensaje:
+            getattr(messages, nivel)(request, mensaje)
         # Recargamos la misma página para ver el cambio instantáneo
         return redirect('app:kiosco_movimiento', sku=sku)
 
-    return render(request, 'app/kiosco_movimiento.html', {'producto': producto})
+    await sync_to_async(fracciones.al_dia)([producto])
+    return await sync_to_async(render)(request, 'app/kiosco_movimiento.html', {'producto': producto})
+
+
+def _escaneo_kiosco(request, producto, usuario):
+    """
+    Aplica el botón presionado en el kiosco. Devuelve ``(resultado, nivel,
+    mensaje)``: ``resultado`` con el formato de una línea de la API de lotes
+    y ``nivel`` el de ``messages`` ('success', 'warning' o 'error').
+    """
+    tipo = str(request.POST.get('tipo', '')).upper() # 'entrada' o 'salida'
+    try:
+        cantidad = int(request.POST.get('cantidad', 1))
+    except ValueError:
+        cantidad = 1
+    resultado = {'sku': producto.sku, 'tipo': tipo, 'cantidad': cantidad}
+    if tipo not in ('ENTRADA', 'SALIDA'):
+        return {**resultado, 'ok': False, 'error': 'linea_invalida'}, 'error', None
+
+    # Clave única del formulario: si el POST se reintenta no se duplica
+    clave = request.POST.get('clave') or None
+    metricas.escaneos('kiosco')
+
+    try:
+        movimiento = stock.registrar_movimiento(
+            producto, tipo, cantidad,
+            usuario=usuario, notas='Escaneo Rápido (Kiosco)', clave=clave
+        )
+    except stock.StockInsuficiente as e:
+        metricas.salida_rechazada('kiosco')
+        mensaje = f'❌ Stock insuficiente. Tienes {e.disponible}, intentaste sacar {cantidad}.'
+        return {**resultado, 'ok': False, 'error': 'stock_insuficiente', 'disponible': e.disponible}, 'error', mensaje
+    except stock.ClaveReutilizada:
+        return {**resultado, 'ok': False, 'error': 'clave_reutilizada'}, 'error', '❌ Escaneo repetido con otros datos.'
+    except ValueError as e:
+        return {**resultado, 'ok': False, 'error': 'linea_invalida'}, 'error', f'❌ {e}'
+
+    resultado.update(ok=True, pz=producto.pz, movimiento_id=movimiento.pk)
+    if tipo == 'ENTRADA':
+        return resultado, 'success', f'✅ Se agregaron {cantidad} pz a {producto.nombre_tela}'
+    return resultado, 'warning', f'🔻 Se retiraron {cantidad} pz de {producto.nombre_tela}'
+
+
+# --- API DE ESCANEO EN LOTE (Kioscos y Cámara) ---
+
+MAX_LINEAS_LOTE = 1000
+
+
+def _leer_lineas_lote(request, requerir_clave=False):
+    """
+    Valida el JSON ``{"escaneos": [{"sku", "tipo", "cantidad", "clave"}, ...]}``.
+    Devuelve ``(lineas_validas, resultados)``; las líneas mal formadas ya
+    llevan su error en ``resultados``.
+    """
+    data = json.loads(request.body)
+    escaneos = data.get('escaneos') if isinstance(data, dict) else None
+    if not isinstance(escaneos, list) or not escaneos:
+        raise ValueError('Se esperaba una lista "escaneos" con al menos una línea')
+    if len(escaneos) > MAX_LINEAS_LOTE:
+        raise ValueError(f'Máximo {MAX_LINEAS_LOTE} escaneos por lote')
+
+    lineas, resultados = [], [None] * len(escaneos)
+    for indice, escaneo in enumerate(escaneos):
+        try:
+            tipo = str(escaneo.get('tipo', '')).upper()
+            cantidad = int(escaneo.get('cantidad', 1))
+            sku = str(escaneo['sku'])
+            clave = str(escaneo.get('clave') or '')[:64] or None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            resultados[indice] = {'ok': False, 'error': 'linea_invalida'}
+            continue
+        if tipo not in ('ENTRADA', 'SALIDA') or cantidad <= 0 or (requerir_clave and not clave):
+            resultados[indice] = {'ok': False, 'error': 'linea_invalida'}
+            continue
+        lineas.append({
+            'indice': indice, 'sku': sku, 'tipo_movimiento': tipo,
+            'cantidad': cantidad, 'clave': clave,
+        })
+    return lineas, resultados
+
+
+def _resultado_json(linea, resultado):
+    salida = {'sku': linea['sku'], 'tipo': linea['tipo_movimiento'], 'cantidad': linea['cantidad']}
+    salida.update({k: v for k, v in resultado.items() if k != 'movimiento'})
+    if 'movimiento' in resultado:
+        salida['movimiento_id'] = resultado['movimiento'].pk
+    return salida
+
+
+async def _procesar_lote(request, requerir_clave, notas, origen):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    try:
+        lineas, resultados = _leer_lineas_lote(request, requerir_clave)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    usuario_actual = await request.auser()
+    if not usuario_actual.is_authenticated:
+        usuario_actual = None
+    aplicados = await stock.en_fila(stock.registrar_lote, lineas, usuario=usuario_actual, notas=notas)
+    for linea, resultado in zip(lineas, aplicados):
+        resultados[linea['indice']] = _resultado_json(linea, resultado)
+    metricas.escaneos(origen, len(resultados))
+    rechazadas = sum(1 for r in resultados if r.get('error') == 'stock_insuficiente')
+    if rechazadas:
+        metricas.salida_rechazada(origen, rechazadas)
+
+    aceptadas = sum(1 for r in resultados if r['ok'])
+    # Las demás líneas sí se aplicaron; el 409 avisa que alguna clave venía con otros datos.
+    reutilizadas = any(r.get('error') == 'clave_reutilizada' for r in resultados)
+    return JsonResponse({
+        'aceptadas': aceptadas,
+        'rechazadas': len(resultados) - aceptadas,
+        'resultados': resultados,
+    }, status=409 if reutilizadas else 200)
+
+
+async def escaneo_lote(request):
+    """
+    Recibe muchos escaneos en un solo POST JSON y responde un resultado por
+    línea (incluyendo las salidas rechazadas por falta de stock).
+    """
+    return await _procesar_lote(request, requerir_clave=False, notas='Escaneo en Lote', origen='lote')
+
+
+async def sincronizar_escaneos(request):
+    """
+    Reproduce la cola offline del escáner. Cada línea trae su ``clave`` y las
+    que ya se habían aplicado regresan como ``duplicado`` sin mover stock, así
+    que el cliente puede reenviar el mismo lote cuantas veces haga falta.
+    """
+    return await _procesar_lote(request, requerir_clave=True, notas='Sincronización Offline', origen='sincronizacion')
 
 
 # --- VISTA ANTIGUA DE ACCIÓN (Mantenida por compatibilidad) ---
@@ -211,21 +383,10 @@ def ajustar_stock(request, sku):
         form = AjustarStockForm(request.POST)
         if form.is_valid():
             nueva_cantidad = form.cleaned_data['nueva_cantidad']
-            cantidad_actual = producto.pz
-            diferencia = nueva_cantidad - cantidad_actual
-            if diferencia != 0:
-                tipo_mov = 'ENTRADA' if diferencia > 0 else 'SALIDA'
-                MovimientoInventario.objects.create(
-                    producto=producto,
-                    tipo_movimiento=tipo_mov,
-                    cantidad=abs(diferencia),
-                    notas=f"Ajuste manual. Anterior: {cantidad_actual}",
-                    usuario=request.user
-                )
-            producto.pz = nueva_cantidad
-            producto.save()
+            stock.ajustar_stock(producto, nueva_cantidad, usuario=request.user)
             return redirect('app:detalle_producto', sku=producto.sku)
     else:
+        fracciones.al_dia([producto])
         form = AjustarStockForm(initial={'nueva_cantidad': producto.pz})
     contexto = { 'form': form, 'producto': producto, 'titulo': 'Ajustar Stock' }
     return render(request, 'app/ajustar_stock.html', contexto)
@@ -236,30 +397,28 @@ def ajustar_stock(request, sku):
 
 @login_required
 def dashboard(request):
+    # Todos los KPIs salen del caché (app/kpis.py); el servicio de stock y las
+    # señales de Producto lo mantienen al día sin recalcular en cada recarga.
+
     # 1. DATOS PARA TARJETAS (KPIs)
-    total_productos = Producto.objects.count()
-    total_piezas = Producto.objects.aggregate(total=Sum('pz'))['total'] or 0
+    total_productos = kpis.total_productos()
+    total_piezas = kpis.total_piezas()
     # Stock bajo si hay menos de 5 piezas
-    productos_bajo_stock = Producto.objects.filter(pz__lte=5).count()
+    productos_bajo_stock = kpis.productos_bajo_stock()
 
     # 2. DATOS PARA GRÁFICO DE BARRAS (Top 10 productos con más stock)
-    top_productos = Producto.objects.order_by('-pz')[:10]
-    nombres_productos = [p.nombre_tela for p in top_productos]
-    stock_productos = [p.pz for p in top_productos]
+    top_productos = kpis.top_productos()
+    nombres_productos = [p['nombre_tela'] for p in top_productos]
+    stock_productos = [p['pz'] for p in top_productos]
 
     # 3. DATOS PARA GRÁFICO DE PASTEL (Entradas vs Salidas - Histórico)
-    movimientos_data = MovimientoInventario.objects.values('tipo_movimiento').annotate(total=Count('id'))
-    
-    entradas = 0
-    salidas = 0
-    for mov in movimientos_data:
-        if mov['tipo_movimiento'] == 'ENTRADA':
-            entradas = mov['total']
-        elif mov['tipo_movimiento'] == 'SALIDA':
-            salidas = mov['total']
+    # Se lee del resumen diario, no del historial crudo
+    movimientos = kpis.movimientos_por_tipo()
+    entradas = movimientos['ENTRADA']
+    salidas = movimientos['SALIDA']
 
     # 4. TABLA DE ALERTA (Productos con poco stock)
-    alerta_stock = Producto.objects.filter(pz__lte=5).order_by('pz')[:5]
+    alerta_stock = kpis.alerta_stock()
 
     contexto = {
         'titulo': 'Dashboard de Métricas',
@@ -276,10 +435,62 @@ def dashboard(request):
     return render(request, 'app/dashboard.html', contexto)
 
 
+@login_required
+@bd.reportes
+def historial_stock(request):
+    """
+    Series de stock en el tiempo para las gráficas (ver app/historial.py).
+    ``agrupar`` = sku | tipo | ubicacion, ``granularidad`` = dia | semana | mes,
+    ``desde`` / ``hasta`` (AAAA-MM-DD) y filtros ``sku`` (o ``skus=A,B``),
+    ``tipo`` y ``ubicacion``. Por SKU y sin lista se grafican los de más stock.
+    """
+    datos = request.GET
+    agrupar = datos.get('agrupar') or 'sku'
+    seleccion = {campo: datos[campo] for campo in ('tipo', 'ubicacion') if datos.get(campo)}
+    skus = [
+        sku.strip()
+        for valor in datos.getlist('sku') + datos.getlist('skus')
+        for sku in valor.split(',')
+        if sku.strip()
+    ]
+    skus = list(dict.fromkeys(skus))
+    if len(skus) > historial.MAX_SERIES:
+        return JsonResponse({'error': f'Máximo {historial.MAX_SERIES} SKUs'}, status=400)
+    if not skus and agrupar == 'sku':
+        if seleccion:
+            skus = list(
+                Producto.objects.filter(**seleccion).order_by('-pz', 'sku')
+                .values_list('sku', flat=True)[:historial.MAX_SERIES]
+            )
+        else:
+            skus = [p['sku'] for p in kpis.top_productos()]
+    if skus or agrupar == 'sku':
+        seleccion['sku__in'] = skus
+
+    try:
+        desde = date.fromisoformat(datos['desde']) if datos.get('desde') else None
+        hasta = date.fromisoformat(datos['hasta']) if datos.get('hasta') else None
+        periodos, series = historial.serie(agrupar, datos.get('granularidad') or 'dia', desde, hasta, **seleccion)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Por SKU en el orden pedido (o de más stock); los grupos, alfabéticos y los vacíos al final.
+    if agrupar == 'sku':
+        claves = [sku for sku in skus if sku in series]
+    else:
+        claves = sorted(series, key=lambda clave: (clave is None, clave or ''))
+    return JsonResponse({
+        'agrupar': agrupar,
+        'granularidad': datos.get('granularidad') or 'dia',
+        'periodos': [inicio.isoformat() for inicio, _ in periodos],
+        'series': [{'clave': clave, 'pz': series[clave]} for clave in claves],
+    })
+
+
 # --- Vistas Estáticas y Reportes ---
 
 def index(request):
-    num_productos = Producto.objects.count()
+    num_productos = kpis.total_productos()
     contexto = { 'titulo': 'Inicio', 'num_productos': num_productos }
     return render(request, 'app/index.html', contexto)
 
@@ -290,39 +501,176 @@ def contact(request):
     return render(request, 'app/contact.html', {'titulo': 'Contacto'})
 
 @login_required
+@bd.reportes
 def ver_reportes(request):
     # Filtros de fecha
     fecha_inicio_str = request.GET.get('fecha_inicio')
     fecha_fin_str = request.GET.get('fecha_fin')
       
-    movimientos_query = MovimientoInventario.objects.all()
+    filtro = fecha_inicio = None
+    dia_inicio = dia_fin = None
 
     if fecha_inicio_str and fecha_fin_str:
         try:
             fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
             fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
+            dia_inicio, dia_fin = fecha_inicio.date(), fecha_fin.date()
             fecha_fin = fecha_fin + timedelta(days=1) - timedelta(seconds=1)
-            movimientos_query = movimientos_query.filter(fecha__range=[fecha_inicio, fecha_fin])
+            fecha_inicio, fecha_fin = timezone.make_aware(fecha_inicio), timezone.make_aware(fecha_fin)
+            filtro = Q(fecha__range=[fecha_inicio, fecha_fin])
         except ValueError:
-            pass
+            fecha_inicio = None
       
-    ultimos_movimientos = movimientos_query.order_by('-fecha')[:50]
-
-    total_piezas = Producto.objects.aggregate(total=Sum('pz'))['total'] or 0
-    productos_unicos = Producto.objects.count()
-    stock_por_modelo = Producto.objects.values('nombre_tela').annotate(total_pz=Sum('pz')).order_by('-total_pz')
+    # Historial paginado por cursor sobre (fecha, id), del más reciente al más antiguo;
+    # si el rango llega a los movimientos archivados se siguen leyendo de ahí.
+    # Producto y usuario vienen en el mismo JOIN: la tabla y el JSON los leen por fila.
+    historial = [
+        queryset.select_related('producto', 'usuario')
+        for queryset in archivo.historial(filtro, desde=fecha_inicio)
+    ]
+    pagina = paginacion.paginar(
+        historial, ['-fecha', '-id'],
+        despues=request.GET.get('despues'), antes=request.GET.get('antes'),
+    )
+    ultimos_movimientos = pagina.items
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'movimientos': [
+                {
+                    'id': mov.pk,
+                    'fecha': mov.fecha.isoformat(),
+                    'sku': mov.producto_id,
+                    'nombre_tela': mov.producto.nombre_tela,
+                    'tipo_movimiento': mov.tipo_movimiento,
+                    'cantidad': mov.cantidad,
+                    'usuario': mov.usuario.username if mov.usuario else None,
+                    'notas': mov.notas,
+                }
+                for mov in ultimos_movimientos
+            ],
+            'siguiente': pagina.siguiente,
+            'anterior': pagina.anterior,
+        })
+
+    total_piezas = kpis.total_piezas()
+    productos_unicos = kpis.total_productos()
+    stock_por_modelo = kpis.stock_por_modelo()
+    # Entradas/salidas del periodo desde el resumen diario
+    resumen_periodo = resumenes.totales_por_tipo(dia_inicio, dia_fin)
 
     contexto = {
         'titulo': 'Reportes',
+        'resumen_entradas': resumen_periodo['ENTRADA'],
+        'resumen_salidas': resumen_periodo['SALIDA'],
         'total_piezas': total_piezas,
         'productos_unicos': productos_unicos,
         'stock_por_modelo': stock_por_modelo,
         'ultimos_movimientos': ultimos_movimientos,
+        'url_siguiente': pagina.url_siguiente(request),
+        'url_anterior': pagina.url_anterior(request),
         'fecha_inicio': fecha_inicio_str,
         'fecha_fin': fecha_fin_str,
     }
     return render(request, 'app/reportes.html', contexto)
 
+# --- Códigos QR y Etiquetas ---
+
+def qr_producto(request, sku, tipo, formato):
+    """PNG/SVG del QR de info o de acción, generado en el servidor y cacheado en disco."""
+    if tipo not in etiquetas.TIPOS_QR or formato not in etiquetas.FORMATOS:
+        raise Http404
+    producto = get_object_or_404(Producto.objects.only('sku'), sku=sku)
+    url = etiquetas.url_qr(request.build_absolute_uri('/'), producto.sku, tipo)
+    respuesta = FileResponse(
+        open(etiquetas.imagen_qr(url, producto.sku, tipo, formato), 'rb'),
+        content_type=etiquetas.FORMATOS[formato],
+    )
+    # La URL del QR no cambia mientras no cambie el SKU
+    respuesta['Cache-Control'] = 'public, max-age=86400'
+    if request.GET.get('descargar'):
+        respuesta['Content-Disposition'] = f'attachment; filename="QR_{tipo}_{producto.sku}.{formato}"'
+    return respuesta
+
+@login_required
+def etiquetas_pdf(request):
+    """
+    Hoja de etiquetas lista para imprimir. Productos por lista de SKUs
+    (``sku=A&sku=B`` o ``skus=A,B``), por búsqueda (``q``) o por ``tipo`` /
+    ``ubicacion``. ``qr`` elige ``info``, ``accion`` o ``ambos``.
+    """
+    datos = request.POST if request.method == 'POST' else request.GET
+    skus = [
+        sku.strip()
+        for valor in datos.getlist('sku') + datos.getlist('skus')
+        for sku in valor.replace('\n', ',').split(',')
+        if sku.strip()
+    ]
+    if skus:
+        encontrados = Producto.objects.only('sku', 'nombre_tela').in_bulk(skus)
+        # Se respeta el orden en que llegaron (p. ej. el de la lista del camión)
+        productos = [encontrados[sku] for sku in dict.fromkeys(skus) if sku in encontrados]
+    elif datos.get('q'):
+        productos = busqueda.buscar_productos(datos['q'], limite=etiquetas.MAX_ETIQUETAS + 1)
+    else:
+        filtros = {campo: datos[campo] for campo in ('tipo', 'ubicacion') if datos.get(campo)}
+        if not filtros:
+            return JsonResponse({'error': 'Indica skus, q, tipo o ubicacion'}, status=400)
+        productos = list(
+            Producto.objects.filter(**filtros).only('sku', 'nombre_tela')
+            .order_by('nombre_tela', 'sku')[:etiquetas.MAX_ETIQUETAS + 1]
+        )
+
+    tipos = ('info', 'accion') if datos.get('qr') == 'ambos' else (datos.get('qr') or 'info',)
+    if any(tipo not in etiquetas.TIPOS_QR for tipo in tipos):
+        return JsonResponse({'error': 'qr debe ser info, accion o ambos'}, status=400)
+    if not productos:
+        return JsonResponse({'error': 'No hay productos que coincidan'}, status=404)
+    if len(productos) * len(tipos) > etiquetas.MAX_ETIQUETAS:
+        return JsonResponse({'error': f'Máximo {etiquetas.MAX_ETIQUETAS} etiquetas por hoja'}, status=400)
+
+    pdf = etiquetas.hoja_etiquetas(productos, request.build_absolute_uri('/'), tipos)
+    respuesta = HttpResponse(pdf, content_type='application/pdf')
+    respuesta['Content-Disposition'] = f'inline; filename="etiquetas_{timezone.localdate().isoformat()}.pdf"'
+    return respuesta
+
+# --- Exportaciones (CSV / XLSX en streaming) ---
+
+def _respuesta_exportacion(request, nombre, encabezados, filas, hoja):
+    if request.GET.get('formato') == 'xlsx':
+        respuesta = StreamingHttpResponse(
+            exportar.xlsx_streaming(encabezados, filas, nombre_hoja=hoja),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+        extension = 'xlsx'
+    else:
+        respuesta = StreamingHttpResponse(
+            exportar.csv_streaming(encabezados, filas),
+            content_type='text/csv; charset=utf-8',
+        )
+        extension = 'csv'
+    fecha = timezone.localdate().isoformat()
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}_{fecha}.{extension}"'
+    return respuesta
+
+@login_required
+@bd.reportes
+def exportar_movimientos(request):
+    """Historial filtrado por fechas, SKU, usuario y tipo (``?formato=csv|xlsx``)."""
+    movimientos = exportar.filtrar_movimientos(request.GET)
+    return _respuesta_exportacion(
+        request, 'movimientos', exportar.ENCABEZADOS_MOVIMIENTOS,
+        exportar.filas_movimientos(movimientos), 'Movimientos',
+    )
+
+@login_required
+@bd.reportes
+def exportar_stock(request):
+    """Foto del stock actual de todos los productos (``?formato=csv|xlsx``)."""
+    return _respuesta_exportacion(
+        request, 'stock', exportar.ENCABEZADOS_STOCK, exportar.filas_stock(), 'Stock',
+    )
+
 # --- Vistas del Escáner ---
 
 def escaner_view(request):
@@ -340,35 +688,80 @@ def camara_view(request):
     return render(request, 'app/escaner.html', {'titulo': 'Cámara Activa'})
 
 
+# --- Métricas (Prometheus) ---
+
+def metricas_view(request):
+    """
+    Métricas del proceso en formato de texto de Prometheus. Acceso con
+    ``Authorization: Bearer <METRICAS_TOKEN>`` (para el scraper) o sesión de staff.
+    """
+    token = settings.METRICAS_TOKEN
+    autorizado = request.user.is_staff or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not autorizado:
+        return HttpResponse(status=403)
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # --- API PARA IA (GEMINI) ---
+# La llamada al modelo tarda segundos: no se hace aquí sino en el trabajador
+# (``manage.py trabajador``). Si la respuesta ya está en caché se devuelve
+# de inmediato; si no, se encola y el cliente consulta ``estado_trabajo``.
+
+def _trabajo_json(trabajo):
+    return {
+        'trabajo': trabajo.pk,
+        'estado': trabajo.estado,
+        'resultado': trabajo.resultado,
+        'error': trabajo.error or None,
+        'estado_url': reverse('app:estado_trabajo', args=[trabajo.pk]),
+    }
 
 @login_required
-def generar_descripcion_api(request):
+async def generar_descripcion_api(request):
     """
-    Recibe un prompt en JSON, llama a Gemini y devuelve la respuesta.
+    Recibe ``{"prompt": ...}`` o ``{"sku": ...}`` en JSON. Devuelve 200 con la
+    descripción si ya estaba en caché, o 202 con el trabajo encolado.
     """
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            prompt = data.get('prompt', '')
-            
-            if not prompt:
-                return JsonResponse({'error': 'No prompt provided'}, status=400)
-
-            # Configuración del modelo (Gemini Pro)
-            model = genai.GenerativeModel('gemini-pro')
-            
-            # Generar contenido
-            response = model.generate_content(prompt)
-            texto_generado = response.text
-
-            return JsonResponse({'descripcion': texto_generado})
-
-        except Exception as e:
-            print(f"Error Gemini API: {e}")
-            return JsonResponse({'error': str(e)}, status=500)
-      
-    return JsonResponse({'error': 'Invalid method'}, status=405)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+
+    prompt = data.get('prompt', '')
+    sku = data.get('sku')
+    if sku:
+        prompt = ia.prompt_descripcion(await aget_object_or_404(Producto, sku=sku))
+    if not prompt:
+        return JsonResponse({'error': 'No prompt provided'}, status=400)
+
+    guardada = await ia.arespuesta_guardada(prompt)
+    if guardada is not None:
+        return JsonResponse({'descripcion': guardada})
+
+    trabajo = await trabajos.aencolar('descripcion', usuario=await request.auser(), prompt=prompt)
+    return JsonResponse(_trabajo_json(trabajo), status=202)
+
+@login_required
+def describir_faltantes_api(request):
+    """Encola la generación de descripciones para todos los SKUs sin ``descripcion``."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Solo personal autorizado'}, status=403)
+    trabajo = trabajos.encolar('describir_faltantes', usuario=request.user)
+    return JsonResponse(_trabajo_json(trabajo), status=202)
+
+@login_required
+async def estado_trabajo(request, pk):
+    """Estado y resultado de un trabajo; cada quien ve solo los suyos (el staff, todos)."""
+    usuario = await request.auser()
+    trabajos_visibles = Trabajo.objects.all() if usuario.is_staff else Trabajo.objects.filter(usuario=usuario)
+    trabajo = await aget_object_or_404(trabajos_visibles, pk=pk)
+    return JsonResponse(_trabajo_json(trabajo))
 
 # --- BORRAR ESTO DESPUÉS DE USAR ---
 def crear_superusuario_rapido(request):